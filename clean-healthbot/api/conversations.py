@@ -1,72 +1,175 @@
-from fastapi import APIRouter, HTTPException
+import asyncio
+import logging
+from fastapi import APIRouter, Header, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from models.conversation import Conversation, ConversationCreate
-from services.openai_service import analyze_conversation_scores, get_mental_health_response
-from services.conversation_service import update_conversation_scores_in_db
-from core.config import supabase
-from typing import List, Dict, Any
+from models.mood import BotResponse
+from services.idempotency import Reservation, idempotency_cache, request_fingerprint
+from services.openai_service import analyze_conversation_scores, get_first_response, stream_first_response
+from services.conversation_service import (
+    update_conversation_scores_in_db,
+    save_message,
+    create_conversation_record,
+    delete_conversation_record,
+    verify_conversation_owner,
+    get_stored_conversation_scores
+)
+from utils.streaming import sse_event
+from utils.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, keyset_page, parse_fields, split_page
+from core.config import get_supabase
+from core.logging import describe_error
+from typing import List, Dict, Any, Optional
 from datetime import datetime
 import uuid
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter()
 
 @router.post("/conversations/", response_model=Conversation)
 async def create_conversation(
     conversation: ConversationCreate,
     user_id: str,
-    is_paid: bool = False
+    response: Response,
+    is_paid: bool = False,
+    stream: bool = False,
+    idempotency_key: Optional[str] = Header(None, max_length=255)
 ):
     """
     Creates a new conversation.
     - Generates a title if not provided.
-    - Creates a new conversation record in the database.
-    - Creates the first message in the conversation.
+    - Creates a new conversation record in the database while the first reply is generated.
+    - Creates the first message in the conversation; common openers may be answered from the first-reply cache.
+    - With stream=true, replies as Server-Sent Events: a "conversation" event with
+      the new record, "delta" events with the bot's content, then a "done" event.
+    - With an Idempotency-Key header, a retry returns the conversation already created
+      (marked Idempotent-Replayed) instead of creating another, waiting for it if still running.
     """
+    reservation = None
+    if idempotency_key:
+        reservation = await idempotency_cache.reserve(
+            idempotency_cache.key("conversations", user_id, idempotency_key),
+            request_fingerprint(conversation.model_dump(), is_paid),
+            endpoint="conversations"
+        )
+        if reservation.replayed:
+            created, content = reservation.result
+            if stream:
+                return StreamingResponse(
+                    replay_conversation_events(created, content),
+                    media_type="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "Idempotent-Replayed": "true"}
+                )
+            response.headers["Idempotent-Replayed"] = "true"
+            return created
+
     # Generate a title if not provided
     title = conversation.title
     if not title:
         title = f"Chat on {datetime.utcnow().strftime('%Y-%m-%d %H:%M')}"
 
-    # Create new conversation
     new_conversation_id = str(uuid.uuid4())
-    
-    try:
-        conv_data = supabase.table("conversations").insert({
-            "id": new_conversation_id,
-            "user_id": user_id,
-            "title": title
-        }).execute().data[0]
+    if stream:
+        return StreamingResponse(
+            stream_conversation_events(new_conversation_id, user_id, title, conversation.first_message, is_paid, reservation),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+            # Runs even when the client left before the body started, which skips the generator's finally
+            background=BackgroundTask(reservation.release) if reservation is not None else None
+        )
 
+    # Create new conversation; the insert runs while the first reply is generated
+    insert_task = asyncio.create_task(create_conversation_record(new_conversation_id, user_id, title))
+    try:
         # Create first message
-        bot_response = await get_mental_health_response(conversation.first_message, [])
-    
-        supabase.table("messages").insert({
-            "conversation_id": new_conversation_id,
-            "user_id": user_id,
-            "user_input": conversation.first_message,
-            "bot_response": bot_response.model_dump(),
-            "created_at": datetime.utcnow().isoformat()
-        }).execute()
+        bot_response = await get_first_response(conversation.first_message, is_paid)
+        conv_data = await insert_task
+
+        await save_message(new_conversation_id, user_id, conversation.first_message, bot_response)
         
-        return Conversation(**conv_data)
+        created = Conversation(**conv_data)
+        if reservation is not None:
+            reservation.complete((created, bot_response.content))
+        return created
         
     except Exception as e:
-        print(f"Error creating conversation: {e}")
-        # If something fails, we should probably delete the conversation record
-        supabase.table("conversations").delete().eq("id", new_conversation_id).execute()
+        logger.error("Error creating conversation: %s", describe_error(e))
+        await discard_conversation(insert_task, new_conversation_id)
         raise HTTPException(status_code=500, detail="Failed to create conversation.")
+    finally:
+        if reservation is not None:
+            reservation.release()
+
+async def discard_conversation(insert_task: asyncio.Task, conversation_id: str):
+    """Wait for the pending insert, then delete the conversation record"""
+    await asyncio.gather(insert_task, return_exceptions=True)
+    await delete_conversation_record(conversation_id)
+
+async def stream_conversation_events(
+    conversation_id: str,
+    user_id: str,
+    title: str,
+    first_message: str,
+    is_paid: bool = False,
+    reservation: Optional[Reservation] = None
+):
+    """
+    Relay the first reply as SSE and persist it once the stream ends.
+    The record is inserted here, while the reply is generated, so a client that leaves before the body
+    starts leaves no row behind; one that leaves mid-stream has the record discarded.
+    """
+    insert_task = asyncio.create_task(create_conversation_record(conversation_id, user_id, title))
+    replies = stream_first_response(first_message, is_paid)
+    conv_sent = False
+    bot_response = None
+    saved = False
+    try:
+        async for item in replies:
+            if not conv_sent:
+                # The conversation record leads the stream, ahead of the first token
+                conv_data = await insert_task
+                yield sse_event("conversation", Conversation(**conv_data).model_dump(mode="json"))
+                conv_sent = True
+            if isinstance(item, BotResponse):
+                bot_response = item
+            else:
+                yield sse_event("delta", {"content": item})
+
+        await save_message(conversation_id, user_id, first_message, bot_response)
+        saved = True
+        if reservation is not None:
+            reservation.complete((Conversation(**conv_data), bot_response.content))
+    except Exception as e:
+        logger.error("Error creating conversation: %s", describe_error(e))
+        yield sse_event("error", {"detail": "Failed to create conversation."})
+        return
+    finally:
+        if not saved:
+            # Failed, cancelled or closed by a disconnect: no conversation without its first message
+            await replies.aclose()
+            await asyncio.shield(discard_conversation(insert_task, conversation_id))
+        # No-op once completed; otherwise retries waiting on this request run it themselves
+        if reservation is not None:
+            reservation.release()
+
+    yield sse_event("done", {"conversation_id": conversation_id, "content": bot_response.content})
+
+async def replay_conversation_events(created: Conversation, content: str):
+    """A stored conversation and first reply as the SSE events of a streamed creation"""
+    yield sse_event("conversation", created.model_dump(mode="json"))
+    yield sse_event("delta", {"content": content})
+    yield sse_event("done", {"conversation_id": created.id, "content": content})
 
 @router.post("/conversations/{conversation_id}/analyze")
 async def analyze_conversation_endpoint(conversation_id: str, user_id: str):
     """
     Analyzes the conversation and updates the scores in the database.
-    - Fetches user data to verify ownership.
+    - Verifies ownership (served from the ownership cache when possible).
     - Analyzes conversation scores.
     - Updates scores in the database.
     """
-    # Verify user owns conversation
-    conv_response = supabase.table("conversations").select("user_id").eq("id", conversation_id).execute()
-    if not conv_response.data or conv_response.data[0]['user_id'] != user_id:
-        raise HTTPException(status_code=403, detail="Forbidden")
+    await verify_conversation_owner(conversation_id, user_id)
 
     scores = await analyze_conversation_scores(conversation_id)
     if not scores:
@@ -85,48 +188,64 @@ async def get_conversation_scores(conversation_id: str, user_id: str):
     Retrieves the conversation scores for a given conversation.
     - Verifies that the user owns the conversation.
     """
-    response = supabase.table("conversations") \
-        .select("conversation_scores, user_id") \
-        .eq("id", conversation_id) \
-        .execute()
-
-    if not response.data:
-        raise HTTPException(status_code=404, detail="Conversation not found")
-
-    if response.data[0]['user_id'] != user_id:
-        raise HTTPException(status_code=403, detail="Forbidden")
+    _, scores = await asyncio.gather(
+        verify_conversation_owner(conversation_id, user_id),
+        get_stored_conversation_scores(conversation_id)
+    )
+    return scores or None
 
-    return response.data[0]['conversation_scores']
 
+MESSAGE_FIELDS = ["id", "conversation_id", "user_id", "user_input", "bot_response", "created_at"]
+CONVERSATION_FIELDS = ["id", "user_id", "title", "conversation_scores", "created_at", "updated_at"]
 
 @router.get("/conversations/{conversation_id}/messages")
-async def get_conversation_messages(conversation_id: str, user_id: str):
+async def get_conversation_messages(
+    conversation_id: str,
+    user_id: str,
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None
+):
     """
-    Retrieves all messages for a given conversation.
-    - Verifies that the user owns the conversation.
+    Retrieves a page of messages for a given conversation, oldest first.
+    - Verifies that the user owns the conversation (served from the ownership cache when possible).
+    - Keyset pagination on (created_at, id): pass the X-Next-Cursor header of a page as `cursor` to get the next one.
+    - `fields` is an optional comma-separated projection, e.g. "user_input,created_at" to skip bot_response.
     """
-    # Verify user owns conversation
-    conv_response = supabase.table("conversations").select("user_id").eq("id", conversation_id).execute()
-    if not conv_response.data or conv_response.data[0]['user_id'] != user_id:
-        raise HTTPException(status_code=403, detail="Forbidden")
-
-    response = supabase.table("messages") \
-        .select("*") \
-        .eq("conversation_id", conversation_id) \
-        .order("created_at") \
-        .execute()
-        
-    return response.data
+    await verify_conversation_owner(conversation_id, user_id)
+
+    columns = parse_fields(fields, MESSAGE_FIELDS, required=["id", "created_at"])
+    query = get_supabase().table("messages") \
+        .select(*columns) \
+        .eq("conversation_id", conversation_id)
+    result = await keyset_page(query, cursor, limit).execute()
+
+    rows, next_cursor = split_page(result.data, limit)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return rows
 
-@router.get("/conversations/")
-async def get_user_conversations(user_id: str) -> List[Conversation]:
+@router.get("/conversations/", response_model_exclude_unset=True)
+async def get_user_conversations(
+    user_id: str,
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None
+) -> List[Conversation]:
     """
-    Retrieves all conversations for a given user.
+    Retrieves a page of conversations for a given user, newest first.
+    - Keyset pagination on (created_at, id): pass the X-Next-Cursor header of a page as `cursor` to get the next one.
+    - `fields` is an optional comma-separated projection, e.g. "title" to skip conversation_scores.
     """
-    response = supabase.table("conversations") \
-        .select("*") \
-        .eq("user_id", user_id) \
-        .order("created_at", desc=True) \
-        .execute()
-        
-    return [Conversation(**conv) for conv in response.data] 
\ No newline at end of file
+    columns = parse_fields(fields, CONVERSATION_FIELDS, required=["id", "user_id", "created_at"])
+    query = get_supabase().table("conversations") \
+        .select(*columns) \
+        .eq("user_id", user_id)
+    result = await keyset_page(query, cursor, limit, desc=True).execute()
+
+    rows, next_cursor = split_page(result.data, limit)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return [Conversation(**conv) for conv in rows]
@@ -1,63 +1,155 @@
-from fastapi import APIRouter, HTTPException, BackgroundTasks
+import asyncio
+import logging
+from typing import Optional
+from fastapi import APIRouter, Header, HTTPException, Response
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from models.message import MessageCreate, ChatResponse
 from models.mood import BotResponse
-from services.openai_service import get_mental_health_response
-from services.conversation_service import get_conversation_history, update_conversation_scores_in_db
+from core.logging import describe_error
+from core.metrics import stage_timer, timed
+from services.idempotency import Reservation, idempotency_cache, request_fingerprint
+from services.openai_service import get_mental_health_response, stream_mental_health_response
+from services.conversation_service import get_conversation_history, update_conversation_scores_in_db, save_message, verify_conversation_owner
 from services.openai_service import analyze_conversation_scores
 from utils.rate_limiter import check_rate_limit
-from core.config import supabase
-from datetime import datetime
-import json
+from utils.streaming import sse_event
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
 async def run_analysis_and_update(conversation_id: str):
-    """Background task to run conversation analysis and update scores"""
-    scores = await analyze_conversation_scores(conversation_id)
-    if scores:
-        await update_conversation_scores_in_db(conversation_id, scores)
+    """Analysis scheduler handler: run conversation analysis and update scores"""
+    with stage_timer("analysis", endpoint="background", tier="background"):
+        scores = await analyze_conversation_scores(conversation_id)
+        if scores:
+            await update_conversation_scores_in_db(conversation_id, scores)
 
 @router.post("/messages/", response_model=ChatResponse)
 async def create_message(
     message: MessageCreate,
     user_id: str,
-    background_tasks: BackgroundTasks,
-    is_paid: bool = False
+    response: Response,
+    is_paid: bool = False,
+    stream: bool = False,
+    idempotency_key: Optional[str] = Header(None, max_length=255)
 ):
     """
     Create a new message in a conversation.
-    - Checks rate limit for the user.
-    - Retrieves conversation history.
+    - Checks rate limit, conversation ownership and retrieves history concurrently.
+    - Builds the prompt from as much history as the tier's token budget allows.
     - Gets a response from the mental health bot.
     - Saves the new message and bot response to the database.
-    - Triggers a background task to analyze conversation scores.
+    - Saving the message counts toward the analysis scheduler, which re-analyzes
+      conversation scores off the request path every few messages.
+    - With stream=true, replies as Server-Sent Events: "delta" events carry
+      content as it is generated, a final "done" event carries remaining_responses.
+    - With an Idempotency-Key header, a retry of a completed request gets the stored reply
+      (marked Idempotent-Replayed) without another model call, message or rate-limit charge,
+      and a retry of a request still running waits for it.
     """
-    remaining_responses = await check_rate_limit(user_id, is_paid)
-    
+    reservation = None
+    if idempotency_key:
+        reservation = await idempotency_cache.reserve(
+            idempotency_cache.key("messages", user_id, idempotency_key),
+            request_fingerprint(message.model_dump(), is_paid),
+            endpoint="messages"
+        )
+        if reservation.replayed:
+            if stream:
+                return StreamingResponse(
+                    replay_message_events(reservation.result),
+                    media_type="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "Idempotent-Replayed": "true"}
+                )
+            response.headers["Idempotent-Replayed"] = "true"
+            return reservation.result
+
+    try:
+        result = await respond_to_message(message, user_id, is_paid, stream, reservation)
+    except BaseException:
+        if reservation is not None:
+            reservation.release()
+        raise
+    if reservation is not None and isinstance(result, ChatResponse):
+        reservation.complete(result)
+    return result
+
+async def respond_to_message(
+    message: MessageCreate,
+    user_id: str,
+    is_paid: bool,
+    stream: bool,
+    reservation: Optional[Reservation]
+):
+    # Upper bound on turns fetched; the prompt builder trims them to the tier's token budget
     history_limit = 15 if is_paid else 5
-    conversation_history = await get_conversation_history(message.conversation_id, limit=history_limit)
-    
+    remaining_responses, conversation_history, _ = await asyncio.gather(
+        timed("rate_limit", check_rate_limit(user_id, is_paid)),
+        timed("history", get_conversation_history(message.conversation_id, limit=history_limit)),
+        timed("ownership", verify_conversation_owner(message.conversation_id, user_id))
+    )
+
+    if stream:
+        return StreamingResponse(
+            stream_message_events(message, user_id, conversation_history, remaining_responses, is_paid, reservation),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+            # Runs even when the client left before the body started, which skips the generator's finally
+            background=BackgroundTask(reservation.release) if reservation is not None else None
+        )
+
     bot_response: BotResponse = await get_mental_health_response(
         message.user_input,
-        conversation_history
+        conversation_history,
+        is_paid
     )
-    
+
     # Save message to database
     try:
-        supabase.table("messages").insert({
-            "conversation_id": message.conversation_id,
-            "user_id": user_id,
-            "user_input": message.user_input,
-            "bot_response": bot_response.model_dump(),
-            "created_at": datetime.utcnow().isoformat()
-        }).execute()
-        
-        # Trigger background analysis after every 5 messages
-        if len(conversation_history) % 5 == 0 and len(conversation_history) > 0:
-            background_tasks.add_task(run_analysis_and_update, message.conversation_id)
-            
+        await save_message(message.conversation_id, user_id, message.user_input, bot_response)
+
         return ChatResponse(content=bot_response.content, remaining_responses=remaining_responses - 1)
-        
+
     except Exception as e:
-        print(f"Error saving message: {e}")
-        raise HTTPException(status_code=500, detail="Failed to save message.") 
\ No newline at end of file
+        logger.error("Error saving message: %s", describe_error(e))
+        raise HTTPException(status_code=500, detail="Failed to save message.")
+
+async def stream_message_events(
+    message: MessageCreate,
+    user_id: str,
+    conversation_history: list,
+    remaining_responses: int,
+    is_paid: bool = False,
+    reservation: Optional[Reservation] = None
+):
+    """Relay streamed content as SSE and persist the final response once the stream ends"""
+    try:
+        bot_response = None
+        async for item in stream_mental_health_response(message.user_input, conversation_history, is_paid):
+            if isinstance(item, BotResponse):
+                bot_response = item
+            else:
+                yield sse_event("delta", {"content": item})
+
+        try:
+            await save_message(message.conversation_id, user_id, message.user_input, bot_response)
+        except Exception as e:
+            logger.error("Error saving message: %s", describe_error(e))
+            yield sse_event("error", {"detail": "Failed to save message."})
+            return
+
+        chat_response = ChatResponse(content=bot_response.content, remaining_responses=remaining_responses - 1)
+        if reservation is not None:
+            reservation.complete(chat_response)
+        yield sse_event("done", chat_response.model_dump())
+    finally:
+        # No-op once completed; otherwise retries waiting on this request run it themselves
+        if reservation is not None:
+            reservation.release()
+
+async def replay_message_events(chat_response: ChatResponse):
+    """A stored reply as the SSE events of a streamed one"""
+    yield sse_event("delta", {"content": chat_response.content})
+    yield sse_event("done", chat_response.model_dump())
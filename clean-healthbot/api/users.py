@@ -0,0 +1,114 @@
+import logging
+import re
+from datetime import date, datetime, timedelta
+from typing import AsyncIterator, Literal, Optional
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
+from services.export import export_user_history
+from services.mood_rollups import get_mood_timeline
+from services.mood_stats import MoodStats
+from core.config import get_supabase
+from core.logging import describe_error
+from utils.streaming import gzip_stream, ndjson_lines
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+@router.get("/users/{user_id}/mood-stats")
+async def get_user_mood_stats(user_id: str):
+    """
+    Aggregates mood statistics across all of a user's analyzed conversations.
+    - Merges the per-conversation state stored by conversation analysis, oldest conversation first,
+      so the cost grows with the number of conversations rather than messages.
+    """
+    response = await get_supabase().table("conversations") \
+        .select("id", "mood_state:conversation_scores->analysis_state->mood_state") \
+        .eq("user_id", user_id) \
+        .order("created_at") \
+        .execute()
+
+    user_stats = None
+    conversations = 0
+    for conv in response.data:
+        if not conv.get("mood_state"):
+            continue
+        stats = MoodStats.from_dict(conv["mood_state"])
+        user_stats = stats if user_stats is None else user_stats.merge(stats)
+        conversations += 1
+
+    return {
+        "user_id": user_id,
+        "conversations": conversations,
+        "mood_statistics": user_stats.summary() if user_stats else {}
+    }
+
+# Buckets returned when no start date is given, and the most one request may ask for
+DEFAULT_TIMELINE_BUCKETS = {"day": 30, "week": 26}
+MAX_TIMELINE_BUCKETS = 366
+
+@router.get("/users/{user_id}/mood-timeline")
+async def get_user_mood_timeline(
+    user_id: str,
+    period: Literal["day", "week"] = "day",
+    start: Optional[date] = None,
+    end: Optional[date] = None
+):
+    """
+    Mood per day or per week across all of a user's conversations.
+    - Served from the mood rollups updated as messages are written, so the cost grows with the
+      number of buckets rather than messages.
+    - Buckets are UTC days or ISO weeks (starting Monday); only buckets with messages are returned.
+    - Defaults to the last 30 days or 26 weeks up to today.
+    """
+    step = timedelta(days=7 if period == "week" else 1)
+    end = end or datetime.utcnow().date()
+    start = start or end - step * (DEFAULT_TIMELINE_BUCKETS[period] - 1)
+    if period == "week":
+        start -= timedelta(days=start.weekday())
+    if start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    if (end - start) // step + 1 > MAX_TIMELINE_BUCKETS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_TIMELINE_BUCKETS} buckets per request")
+
+    return {
+        "user_id": user_id,
+        "period": period,
+        "start": start,
+        "end": end,
+        "buckets": await get_mood_timeline(user_id, period, start, end)
+    }
+
+@router.get("/users/{user_id}/export")
+async def export_user_data(user_id: str, gzip: bool = False):
+    """
+    Streams all of a user's conversations and messages as newline-delimited JSON.
+    - Records are read page by page and sent as they arrive, so memory stays flat and the first
+      bytes go out before any query has run, however long the history.
+    - Lines carry a "type": one "export" header, "conversation" and "message" records
+      (each page of conversations followed by their messages), then an "end" record with the counts.
+    - gzip=true sends a .ndjson.gz file instead; it is flushed per page so it can be read while downloading.
+    - An error after the response has started is reported as a final "error" record instead of "end".
+    """
+    body = export_ndjson(user_id)
+    filename = re.sub(r"[^A-Za-z0-9_-]", "_", user_id) + "-export.ndjson"
+    if gzip:
+        body = gzip_stream(body)
+        filename += ".gz"
+    return StreamingResponse(
+        body,
+        media_type="application/gzip" if gzip else "application/x-ndjson",
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "Cache-Control": "no-store",
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+async def export_ndjson(user_id: str) -> AsyncIterator[bytes]:
+    try:
+        async for records in export_user_history(user_id):
+            yield ndjson_lines(records)
+    except Exception as e:
+        logger.error("Error exporting data for user %s: %s", user_id, describe_error(e))
+        yield ndjson_lines([{"type": "error", "detail": "Export failed before completion"}])
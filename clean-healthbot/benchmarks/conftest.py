@@ -0,0 +1,22 @@
+import os
+import sys
+
+# Benchmarks run from their own rootdir; import the app from the parent directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Same offline setup as the test suite: no credentials, no network
+os.environ.setdefault("FAKE_BACKENDS", "supabase,openai")
+os.environ.setdefault("TOKENIZER_ENCODING", "")
+
+import pytest
+from pathlib import Path
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_configure(config):
+    """Skip the regression check until a baseline has been saved with --benchmark-save"""
+    storage = getattr(config.option, "benchmark_storage", None)
+    if not storage or not str(storage).startswith("file://"):
+        return
+    if not any(Path(str(storage)[len("file://"):]).glob("*/*.json")):
+        config.option.benchmark_compare = None
+        config.option.benchmark_compare_fail = None
@@ -0,0 +1,110 @@
+import asyncio
+import json
+from datetime import datetime, timedelta, timezone
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from models.conversation import Conversation
+from services import prompt_builder
+from services.history_cache import ConversationHistoryCache
+from services.mood_stats import MoodStats
+from services.openai_service import format_conversation_text, parse_bot_response
+from services.prompts import render_system_prompt
+from utils.mood_helpers import format_mood_dimensions
+from utils.streaming import ContentStreamParser
+from fakes.database import DEFAULT_MOOD_DIMENSIONS
+
+MOODS = {"mood": 2.5, "stress": 6.0, "anxiety": 4.0, "energy": 3.0, "motivation": 5.0, "loneliness": 2.0, "confidence": 4.0, "hope": 6.0}
+ENVELOPE = json.dumps({"content": "**I hear you.** " + "That sounds exhausting, and it makes sense you feel this way. " * 6, "mood_dimensions": MOODS})
+
+def stored_turns(count: int):
+    return [
+        {
+            "id": i,
+            "user_input": f"Message {i}: " + "I have been feeling overwhelmed with work and sleep. " * 3,
+            "bot_response": {"content": f"Reply {i}: " + "Let's break that down into smaller steps. " * 5, "mood_dimensions": MOODS}
+        }
+        for i in range(count)
+    ]
+
+@pytest.fixture
+def static_system_prompt(monkeypatch):
+    prompt = render_system_prompt(format_mood_dimensions(DEFAULT_MOOD_DIMENSIONS))
+
+    async def get_system_prompt():
+        return prompt
+    monkeypatch.setattr(prompt_builder, "get_system_prompt", get_system_prompt)
+
+def test_build_chat_messages_with_full_history(benchmark, static_system_prompt):
+    """Prompt construction in get_mental_health_response: paid budget, 15 stored turns"""
+    history = stored_turns(15)
+    loop = asyncio.new_event_loop()
+    try:
+        messages, _ = benchmark(lambda: loop.run_until_complete(prompt_builder.build_chat_messages("How do I cope?", history, True)))
+    finally:
+        loop.close()
+    assert messages[-2]["content"] == "How do I cope?"
+
+def test_parse_bot_response(benchmark):
+    """JSON extraction and BotResponse validation of a reply wrapped in a code fence"""
+    raw = "```json\n" + ENVELOPE + "\n```"
+    response = benchmark(parse_bot_response, raw)
+    assert response.mood_dimensions.stress == 6.0
+
+def test_history_reversal_and_cache(benchmark):
+    """Reversing a newest-first history page, filling the history cache and reading it back"""
+    rows = list(reversed(stored_turns(15)))
+    cache = ConversationHistoryCache()
+
+    def run():
+        history = list(reversed(rows))
+        cache.fill("c1", history, complete=False)
+        return cache.get("c1", 15)
+
+    assert len(benchmark(run)) == 15
+
+def test_format_conversation_text(benchmark):
+    """conversation_text for analyze_conversation_scores over the largest incremental batch"""
+    text = benchmark(format_conversation_text, stored_turns(50))
+    assert text.count("User: ") == 50
+
+def test_conversation_models_for_a_full_page(benchmark):
+    """Conversation(**conv) for a maximum-size page in get_user_conversations"""
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    rows = [
+        {
+            "id": f"00000000-0000-0000-0000-{i:012d}",
+            "user_id": "e589c2c4-1cf4-4417-ac2f-99f4d9c39c46",
+            "title": f"Chat {i}",
+            "conversation_scores": {"summary": "A summary.", "key_themes": ["work", "sleep"], "average_mood_scores": MOODS},
+            "created_at": (start + timedelta(minutes=i)).isoformat(),
+            "updated_at": None
+        }
+        for i in range(200)
+    ]
+    conversations = benchmark(lambda: [Conversation(**conv) for conv in rows])
+    assert len(conversations) == 200
+
+def test_stream_parser_over_a_reply(benchmark):
+    """Incremental content extraction for a streamed reply arriving in 4-character chunks"""
+    chunks = [ENVELOPE[i:i + 4] for i in range(0, len(ENVELOPE), 4)]
+
+    def run():
+        parser = ContentStreamParser()
+        for chunk in chunks:
+            parser.feed(chunk)
+        return parser
+
+    assert benchmark(run).done
+
+def test_mood_statistics_update(benchmark):
+    """Incremental mood statistics for an analysis batch merged into stored state"""
+    dimensions = list(MOODS)
+    previous = MoodStats.from_messages(stored_turns(50), dimensions).to_dict()
+    batch = stored_turns(5)
+
+    def run():
+        return MoodStats.from_dict(previous).merge(MoodStats.from_messages(batch, dimensions)).summary()
+
+    assert benchmark(run)["stress"]["count"] == 55
@@ -1,19 +1,125 @@
 import os
+from typing import Optional
 from dotenv import load_dotenv
-from supabase import create_client, Client
-from supabase.client import ClientOptions
+import httpx
+from postgrest import AsyncPostgrestClient
+from postgrest.constants import DEFAULT_POSTGREST_CLIENT_HEADERS
 import openai
 
 # Load environment variables
 load_dotenv()
 
-# Initialize Supabase client
-opts = ClientOptions().replace(schema="chat")
-supabase: Client = create_client(
-    os.getenv("SUPABASE_URL", ""),
-    os.getenv("SUPABASE_KEY", ""),
-    options=opts
-)
+SUPABASE_URL = os.getenv("SUPABASE_URL", "")
+SUPABASE_KEY = os.getenv("SUPABASE_KEY", "")
 
-# Initialize OpenAI client
-client = openai.AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY")) 
\ No newline at end of file
+# Connection pool sizing for the Supabase (PostgREST) HTTP session
+SUPABASE_MAX_CONNECTIONS = int(os.getenv("SUPABASE_MAX_CONNECTIONS", "100"))
+SUPABASE_MAX_KEEPALIVE = int(os.getenv("SUPABASE_MAX_KEEPALIVE", "20"))
+SUPABASE_TIMEOUT = float(os.getenv("SUPABASE_TIMEOUT", "10"))
+
+# Connection pool sizing for the OpenAI HTTP client; retries and deadlines live in services.llm_gateway
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_MAX_KEEPALIVE = int(os.getenv("OPENAI_MAX_KEEPALIVE", "20"))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
+
+# Services replaced by in-process fakes (fakes/) for offline load tests and tests: "supabase", "openai"
+FAKE_BACKENDS = {name.strip() for name in os.getenv("FAKE_BACKENDS", "").split(",") if name.strip()}
+fake_database = None
+fake_openai = None
+if "supabase" in FAKE_BACKENDS:
+    from fakes.database import FakePostgrest
+
+    fake_database = FakePostgrest()
+    SUPABASE_URL = SUPABASE_URL or "http://supabase.fake"
+    SUPABASE_KEY = SUPABASE_KEY or "fake"
+if "openai" in FAKE_BACKENDS:
+    from fakes.llm import FakeOpenAI
+
+    fake_openai = FakeOpenAI()
+
+
+class PooledPostgrestClient(AsyncPostgrestClient):
+    """Async PostgREST client whose HTTP session keeps a bounded connection pool"""
+
+    def create_session(self, base_url, headers, timeout) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            base_url=base_url,
+            headers=headers,
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=SUPABASE_MAX_CONNECTIONS,
+                max_keepalive_connections=SUPABASE_MAX_KEEPALIVE,
+            ),
+            transport=fake_database,
+        )
+
+
+def create_supabase_client() -> PooledPostgrestClient:
+    if not SUPABASE_URL:
+        raise RuntimeError("SUPABASE_URL is required")
+    if not SUPABASE_KEY:
+        raise RuntimeError("SUPABASE_KEY is required")
+    headers = {
+        **DEFAULT_POSTGREST_CLIENT_HEADERS,
+        "apiKey": SUPABASE_KEY,
+        "Authorization": f"Bearer {SUPABASE_KEY}",
+    }
+    return PooledPostgrestClient(
+        f"{SUPABASE_URL}/rest/v1",
+        schema="chat",
+        headers=headers,
+        timeout=SUPABASE_TIMEOUT,
+    )
+
+
+
+def create_openai_client() -> openai.AsyncOpenAI:
+    """
+    OpenAI client on a bounded connection pool.
+    The SDK's own retries are disabled; services.llm_gateway retries within each request's deadline.
+    """
+    http_client = httpx.AsyncClient(
+        timeout=httpx.Timeout(None, connect=OPENAI_CONNECT_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_MAX_KEEPALIVE,
+        ),
+        transport=fake_openai,
+    )
+    return openai.AsyncOpenAI(
+        api_key=os.getenv("OPENAI_API_KEY") or ("fake" if fake_openai else None),
+        http_client=http_client,
+        max_retries=0,
+    )
+
+
+# Shared clients are created on first use rather than at import, so importing the app opens nothing;
+# the lifespan warm-up (services/warmup.py) creates them and pre-opens their connections
+_supabase: Optional[PooledPostgrestClient] = None
+_openai_client: Optional[openai.AsyncOpenAI] = None
+
+def get_supabase() -> PooledPostgrestClient:
+    """
+    Shared async Supabase client; every query must be awaited:
+      await get_supabase().table("messages").select("id").execute()
+    """
+    global _supabase
+    if _supabase is None:
+        _supabase = create_supabase_client()
+    return _supabase
+
+def get_openai_client() -> openai.AsyncOpenAI:
+    global _openai_client
+    if _openai_client is None:
+        _openai_client = create_openai_client()
+    return _openai_client
+
+async def close_clients() -> None:
+    """Release pooled connections; the next get_*() call creates a fresh client"""
+    global _supabase, _openai_client
+    supabase, llm_client = _supabase, _openai_client
+    _supabase = _openai_client = None
+    if supabase is not None:
+        await supabase.aclose()
+    if llm_client is not None:
+        await llm_client.close()
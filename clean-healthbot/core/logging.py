@@ -0,0 +1,153 @@
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import traceback
+from datetime import datetime, timezone
+from typing import Any, Optional
+from postgrest.exceptions import APIError
+from core.metrics import LOG_RECORDS_DROPPED
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# "json" (one object per line) or "text"
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+# Share of DEBUG records kept; INFO and above are always kept
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "0.1"))
+# Replace user mental-health text in log fields with its length
+LOG_REDACT = os.getenv("LOG_REDACT", "true").lower() in ("1", "true", "yes")
+# Records waiting for the writer thread; further records are dropped rather than blocking
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+# Libraries that log every HTTP request; openai's DEBUG records include the full prompt, which redaction cannot see
+QUIET_LOGGERS = ("httpx", "httpcore", "openai", "urllib3", "asyncio")
+
+REDACTED_FIELDS = frozenset({"user_input", "content", "first_message", "bot_response", "raw"})
+
+# Attributes every LogRecord has; anything else was passed with extra= and is logged as a field
+_RECORD_ATTRIBUTES = frozenset(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+def redact(value: Any) -> Any:
+    """Copy of `value` with the text under REDACTED_FIELDS keys replaced by its length"""
+    if isinstance(value, dict):
+        return {
+            key: f"[redacted {len(str(item))} chars]" if key in REDACTED_FIELDS and item is not None else redact(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return [redact(item) for item in value]
+    return value
+
+def describe_error(e: BaseException) -> str:
+    """
+    Loggable text for `e`. PostgREST errors keep their code and message but not `details`,
+    which for a constraint violation echoes the failing row, user text included.
+    """
+    if isinstance(e, APIError):
+        return f"{type(e).__name__} {e.code}: {e.message}"
+    return str(e)
+
+def record_fields(record: logging.LogRecord) -> dict:
+    """Fields passed to the logger with extra="""
+    return {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES}
+
+class SamplingFilter(logging.Filter):
+    """Keep a `rate` share of records below INFO, all others"""
+
+    def __init__(self, rate: float = LOG_DEBUG_SAMPLE_RATE):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= logging.INFO or random.random() < self.rate
+
+class RedactingFilter(logging.Filter):
+    """
+    Redact REDACTED_FIELDS in extra= fields before the record leaves the calling thread.
+    PostgREST errors in the message arguments or the logged exception are reduced to describe_error().
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if isinstance(record.args, tuple) and any(isinstance(arg, APIError) for arg in record.args):
+            record.args = tuple(describe_error(arg) if isinstance(arg, APIError) else arg for arg in record.args)
+        if record.exc_info and isinstance(record.exc_info[1], APIError):
+            record.exc_text = "Traceback (most recent call last):\n" + \
+                "".join(traceback.format_tb(record.exc_info[2])) + describe_error(record.exc_info[1])
+            record.exc_info = None
+        for key, value in record_fields(record).items():
+            if key in REDACTED_FIELDS and value is not None:
+                setattr(record, key, f"[redacted {len(str(value))} chars]")
+            elif isinstance(value, (dict, list, tuple)):
+                setattr(record, key, redact(value))
+        return True
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, message, extra= fields and any exception"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **record_fields(record)
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to a bounded queue drained by a QueueListener thread.
+    - The caller only merges the message arguments; formatting and I/O happen on the listener thread.
+    - When the queue is full the record is dropped and counted instead of blocking the event loop.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            # Tracebacks hold frames that must not cross threads
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+def configure_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT) -> None:
+    """Route the root logger through the queue handler; safe to call more than once"""
+    global _listener
+    if _listener is not None:
+        return
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter(
+        "%(asctime)s %(levelname)s %(name)s: %(message)s"
+    ))
+
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+    handler.addFilter(SamplingFilter())
+    if LOG_REDACT:
+        handler.addFilter(RedactingFilter())
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(handler)
+    for name in QUIET_LOGGERS:
+        logging.getLogger(name).setLevel(logging.WARNING)
+    _listener = logging.handlers.QueueListener(handler.queue, output, respect_handler_level=True)
+    _listener.start()
+    # Write out what is still queued when the process exits
+    atexit.register(_listener.stop)
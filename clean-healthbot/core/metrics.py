@@ -0,0 +1,156 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Awaitable, Iterator, List, Tuple, TypeVar
+from prometheus_client import Counter, Gauge, Histogram
+from starlette.datastructures import QueryParams
+from starlette.routing import BaseRoute, Match
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+T = TypeVar("T")
+
+# Exposed on GET /metrics in the Prometheus text format
+
+CHAT_PARSE_FAILURES = Counter(
+    "chat_response_parse_failures_total",
+    "Chat replies that did not validate as a BotResponse",
+    ["mode", "attempt"]
+)
+CHAT_RETRIES = Counter(
+    "chat_response_parse_retries_total",
+    "Chat calls repeated because the previous reply did not validate",
+    ["mode"]
+)
+CHAT_FALLBACKS = Counter(
+    "chat_fallback_responses_total",
+    "Canned replies returned instead of a model reply",
+    ["reason"]
+)
+LLM_CALLS = Counter(
+    "llm_calls_total",
+    "OpenAI chat completions through the LLM gateway by outcome",
+    ["tier", "outcome"]
+)
+FIRST_REPLY_CACHE_LOOKUPS = Counter(
+    "first_reply_cache_lookups_total",
+    "First-message replies by cache result (hit, miss, bypass)",
+    ["result"]
+)
+IDEMPOTENCY_LOOKUPS = Counter(
+    "idempotency_lookups_total",
+    "Requests carrying an Idempotency-Key by outcome (new, replayed, coalesced, conflict)",
+    ["endpoint", "result"]
+)
+MESSAGE_WRITES = Counter(
+    "message_writes_total",
+    "Messages written by the write-behind queue (inserted or dropped)",
+    ["result"]
+)
+MESSAGE_WRITE_QUEUE = Gauge(
+    "message_write_queue_depth",
+    "Messages saved but not yet written to the database"
+)
+MOOD_ROLLUP_UPDATES = Counter(
+    "mood_rollup_updates_total",
+    "Batches of written messages folded into chat.mood_rollups (ok or failed)",
+    ["result"]
+)
+LOG_RECORDS_DROPPED = Counter(
+    "log_records_dropped_total",
+    "Log records discarded because the logging queue was full"
+)
+LLM_TOKENS = Counter(
+    "llm_tokens_total",
+    "Tokens sent to and generated by the model (streamed completions are estimated locally)",
+    ["tier", "kind"]
+)
+RATE_LIMITED = Counter(
+    "rate_limit_rejections_total",
+    "Messages refused with 429 because the hourly limit was reached",
+    ["tier"]
+)
+
+# Seconds; spans from a cached lookup to a slow model call
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Time to the last byte of the response, streamed bodies included",
+    ["endpoint", "method", "status", "tier"],
+    buckets=LATENCY_BUCKETS
+)
+STAGE_LATENCY = Histogram(
+    "request_stage_duration_seconds",
+    "Time spent in one stage of a chat turn or background job",
+    ["stage", "endpoint", "tier"],
+    buckets=LATENCY_BUCKETS
+)
+
+# (endpoint, tier) of the request being served; background tasks keep the default
+_request_labels: ContextVar[Tuple[str, str]] = ContextVar("request_labels", default=("background", "background"))
+
+def observe_stage(stage: str, seconds: float, endpoint: str = None, tier: str = None) -> None:
+    current_endpoint, current_tier = _request_labels.get()
+    STAGE_LATENCY.labels(stage=stage, endpoint=endpoint or current_endpoint, tier=tier or current_tier).observe(seconds)
+
+@contextmanager
+def stage_timer(stage: str, endpoint: str = None, tier: str = None) -> Iterator[None]:
+    """Time the enclosed block as `stage`, labelled with the current request's endpoint and tier"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start, endpoint, tier)
+
+async def timed(stage: str, awaitable: Awaitable[T]) -> T:
+    """Await `awaitable` as a timed stage; lets stages run side by side in asyncio.gather"""
+    with stage_timer(stage):
+        return await awaitable
+
+def request_tier(query_string: bytes) -> str:
+    return "paid" if QueryParams(query_string.decode("latin-1")).get("is_paid", "").lower() in ("1", "true", "yes", "on") else "free"
+
+class RequestMetricsMiddleware:
+    """
+    Pure ASGI middleware recording REQUEST_LATENCY for every HTTP request.
+    - `endpoint` is the matched route template ("POST /messages/"), so path parameters do not
+      multiply label values; unmatched paths share "unmatched".
+    - `tier` comes from the is_paid query parameter.
+    - The endpoint and tier are set for the request's context, so stage_timer() spans inside it carry them.
+    """
+
+    def __init__(self, app: ASGIApp, routes: List[BaseRoute]):
+        self.app = app
+        # The app's live route list: routers included after the middleware is added still match
+        self.routes = routes
+
+    def endpoint(self, scope: Scope) -> str:
+        for route in self.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return f"{scope['method']} {route.path}"
+        return "unmatched"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        endpoint = self.endpoint(scope)
+        tier = request_tier(scope.get("query_string", b""))
+        token = _request_labels.set((endpoint, tier))
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            REQUEST_LATENCY.labels(endpoint=endpoint, method=scope["method"], status=str(status), tier=tier) \
+                .observe(time.perf_counter() - start)
+            _request_labels.reset(token)
@@ -0,0 +1,315 @@
+import asyncio
+import itertools
+import json
+import os
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+import httpx
+
+FAKE_DB_LATENCY = float(os.getenv("FAKE_DB_LATENCY", "0"))
+
+TIMESTAMP_COLUMNS = {"created_at", "updated_at"}
+# Columns the fake fills in when an insert leaves them out (ids are handled separately)
+TABLE_DEFAULTS = {
+    "conversations": {"title": None, "conversation_scores": None, "updated_at": None},
+    "messages": {"bot_response": None},
+    "mood_dim": {},
+    "mood_rollups": {}
+}
+ROLLUP_KEY = ("user_id", "period", "bucket_start", "dimension")
+DEFAULT_MOOD_DIMENSIONS = [
+    {"name": "mood", "range": "[-5, 5]"},
+    {"name": "stress", "range": "[0, 10]"},
+    {"name": "anxiety", "range": "[0, 10]"},
+    {"name": "energy", "range": "[0, 10]"},
+    {"name": "motivation", "range": "[0, 10]"},
+    {"name": "loneliness", "range": "[0, 10]"},
+    {"name": "confidence", "range": "[0, 10]"},
+    {"name": "hope", "range": "[0, 10]"}
+]
+
+class FakeDatabaseError(Exception):
+    def __init__(self, status: int, code: str, message: str):
+        super().__init__(message)
+        self.status = status
+        self.code = code
+
+def _timestamp(value) -> Optional[str]:
+    """Normalise a timestamp the way Postgres returns timestamptz, so strings compare in time order"""
+    if value is None:
+        return None
+    ts = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return ts.astimezone(timezone.utc).isoformat(timespec="microseconds")
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="microseconds")
+
+def _split(expression: str) -> List[str]:
+    """Split on commas that are not inside parentheses or double quotes"""
+    parts, depth, quoted, current = [], 0, False, ""
+    for i, char in enumerate(expression):
+        if char == '"' and (i == 0 or expression[i - 1] != "\\"):
+            quoted = not quoted
+        elif not quoted and char == "(":
+            depth += 1
+        elif not quoted and char == ")":
+            depth -= 1
+        elif not quoted and depth == 0 and char == ",":
+            parts.append(current)
+            current = ""
+            continue
+        current += char
+    if current:
+        parts.append(current)
+    return parts
+
+def _unquote(value: str) -> str:
+    if len(value) >= 2 and value[0] == value[-1] == '"':
+        return value[1:-1].replace('\\"', '"')
+    return value
+
+def _coerce(column: str, current, raw: str):
+    if column in TIMESTAMP_COLUMNS:
+        return _timestamp(raw)
+    if isinstance(current, bool):
+        return raw == "true"
+    if isinstance(current, int):
+        return int(raw)
+    if isinstance(current, float):
+        return float(raw)
+    return raw
+
+def _compare(row: dict, column: str, op: str, raw: str) -> bool:
+    current = row.get(column)
+    if op == "is":
+        return current is {"null": None, "true": True, "false": False}[raw]
+    if op == "in":
+        return current in [_coerce(column, current, _unquote(v)) for v in _split(raw.strip("()"))]
+    if current is None:
+        return False
+    value = _coerce(column, current, _unquote(raw))
+    if op == "eq":
+        return current == value
+    if op == "neq":
+        return current != value
+    if op == "gt":
+        return current > value
+    if op == "gte":
+        return current >= value
+    if op == "lt":
+        return current < value
+    if op == "lte":
+        return current <= value
+    raise FakeDatabaseError(400, "PGRST100", f"Unsupported operator {op}")
+
+def _condition(expression: str) -> Callable[[dict], bool]:
+    """One element of a logical filter: col.op.value, and(...) or or(...)"""
+    for logic, combine in (("and(", all), ("or(", any)):
+        if expression.startswith(logic):
+            conditions = [_condition(part) for part in _split(expression[len(logic):-1])]
+            return lambda row, c=conditions, f=combine: f(cond(row) for cond in c)
+    negate = False
+    column, op, raw = expression.split(".", 2)
+    if op == "not":
+        negate = True
+        op, raw = raw.split(".", 1)
+    return lambda row: _compare(row, column, op, raw) != negate
+
+def _json_path(row: dict, expression: str):
+    """Resolve col->key->>key selects; returns (output name, value)"""
+    parts = expression.replace("->>", "->").split("->")
+    value = row.get(parts[0])
+    for key in parts[1:]:
+        value = value.get(key) if isinstance(value, dict) else None
+    name = parts[-1]
+    if "->>" in expression and value is not None and not isinstance(value, str):
+        value = json.dumps(value)
+    return name, value
+
+def _add_mood_rollups(db: "FakePostgrest", args: dict) -> List[dict]:
+    """chat.add_mood_rollups: add each delta's count and sum to its bucket and widen min and max"""
+    result = []
+    for delta in args["deltas"]:
+        for row in db.tables["mood_rollups"]:
+            if all(row[key] == delta[key] for key in ROLLUP_KEY):
+                row["count"] += delta["count"]
+                row["sum"] += delta["sum"]
+                row["min"] = min(row["min"], delta["min"])
+                row["max"] = max(row["max"], delta["max"])
+                break
+        else:
+            row = db.insert("mood_rollups", dict(delta))
+        result.append(dict(row))
+    return result
+
+def _update_conversation_scores(db: "FakePostgrest", args: dict) -> List[dict]:
+    """chat.update_conversation_scores: set conversation_scores on the listed conversations that still exist"""
+    scores = {update["id"]: update["conversation_scores"] for update in args["updates"]}
+    result = []
+    for row in db.tables["conversations"]:
+        if row["id"] in scores:
+            row["conversation_scores"] = scores[row["id"]]
+            result.append({"id": row["id"]})
+    return result
+
+class FakePostgrest(httpx.AsyncBaseTransport):
+    """
+    In-memory stand-in for the PostgREST API of the `chat` schema (conversations, messages, mood_dim, mood_rollups).
+    - Plugs into the HTTP session of the real client, so application code runs unchanged.
+    - Implements what the app uses: select projections (including JSON paths), eq/neq/gt/gte/lt/lte/in/is
+      filters, or/and filters, multi-column order, limit/offset, insert, upsert, update, delete,
+      exact counts and RPC functions registered with register_function(); add_mood_rollups and
+      update_conversation_scores are built in.
+    - Enforces the messages -> conversations foreign key like the real schema.
+    - `latency` seconds are added to every request to imitate a network round trip.
+    """
+
+    def __init__(self, latency: float = FAKE_DB_LATENCY, mood_dimensions: List[dict] = None):
+        self.latency = latency
+        self.tables: Dict[str, List[dict]] = {name: [] for name in TABLE_DEFAULTS}
+        self.tables["mood_dim"] = [dict(row) for row in (mood_dimensions or DEFAULT_MOOD_DIMENSIONS)]
+        self.functions: Dict[str, Callable[["FakePostgrest", dict], Any]] = {}
+        self.requests = 0
+        self._message_ids = itertools.count(1)
+        self.register_function("add_mood_rollups", _add_mood_rollups)
+        self.register_function("update_conversation_scores", _update_conversation_scores)
+
+    def register_function(self, name: str, function: Callable[["FakePostgrest", dict], Any]) -> None:
+        """Serve POST /rpc/<name>; `function(db, args)` returns the JSON result"""
+        self.functions[name] = function
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        body = await request.aread()
+        payload = json.loads(body) if body else None
+        resource = request.url.path.split("/rest/v1/", 1)[-1].strip("/")
+        try:
+            if resource.startswith("rpc/"):
+                return self._rpc(resource[4:], payload or {})
+            if resource not in self.tables:
+                raise FakeDatabaseError(404, "42P01", f'relation "chat.{resource}" does not exist')
+            return self._table(request, resource, payload)
+        except FakeDatabaseError as e:
+            return httpx.Response(e.status, json={"message": str(e), "code": e.code, "details": None, "hint": None})
+
+    def _rpc(self, name: str, args: dict) -> httpx.Response:
+        function = self.functions.get(name)
+        if function is None:
+            raise FakeDatabaseError(404, "PGRST202", f"Could not find the function chat.{name}")
+        return httpx.Response(200, json=function(self, args))
+
+    def _table(self, request: httpx.Request, table: str, payload) -> httpx.Response:
+        params = request.url.params
+        prefer = request.headers.get("prefer", "")
+        if request.method == "POST":
+            rows = payload if isinstance(payload, list) else [payload]
+            # A multi-row insert is one statement: it writes every row or none
+            snapshot = list(self.tables[table])
+            try:
+                if "resolution=merge-duplicates" in prefer:
+                    keys = (params.get("on_conflict") or "id").split(",")
+                    result = [self.upsert(table, row, keys) for row in rows]
+                else:
+                    result = [self.insert(table, row) for row in rows]
+            except FakeDatabaseError:
+                self.tables[table] = snapshot
+                raise
+            return self._respond(201, result, params)
+
+        matches = self.select(table, params)
+        if request.method == "GET":
+            total = len(matches)
+            matches = self._order_and_limit(matches, params)
+            headers = {}
+            if "count=" in prefer:
+                headers["content-range"] = f"0-{max(len(matches) - 1, 0)}/{total}"
+            return self._respond(200, matches, params, headers)
+        if request.method == "PATCH":
+            for row in matches:
+                row.update({key: _timestamp(v) if key in TIMESTAMP_COLUMNS else v for key, v in payload.items()})
+            return self._respond(200, matches, params)
+        if request.method == "DELETE":
+            if table == "conversations":
+                ids = {row["id"] for row in matches}
+                if any(msg["conversation_id"] in ids for msg in self.tables["messages"]):
+                    raise FakeDatabaseError(409, "23503", "update or delete on table \"conversations\" violates foreign key constraint")
+            deleted = {id(row) for row in matches}
+            self.tables[table] = [row for row in self.tables[table] if id(row) not in deleted]
+            return self._respond(200, matches, params)
+        raise FakeDatabaseError(405, "PGRST105", f"Unsupported method {request.method}")
+
+    def insert(self, table: str, values: dict) -> dict:
+        row = {**TABLE_DEFAULTS[table], **values}
+        if table == "messages":
+            if "id" in values:
+                raise FakeDatabaseError(400, "428C9", 'cannot insert a non-DEFAULT value into column "id"')
+            row["id"] = next(self._message_ids)
+            if not any(conv["id"] == row.get("conversation_id") for conv in self.tables["conversations"]):
+                raise FakeDatabaseError(409, "23503", 'insert or update on table "messages" violates foreign key constraint')
+        elif table == "conversations":
+            row.setdefault("id", str(uuid.uuid4()))
+            if any(conv["id"] == row["id"] for conv in self.tables["conversations"]):
+                raise FakeDatabaseError(409, "23505", "duplicate key value violates unique constraint \"conversations_pkey\"")
+        if table in ("conversations", "messages"):
+            row["created_at"] = _timestamp(row.get("created_at")) or _now()
+        self.tables[table].append(row)
+        return row
+
+    def upsert(self, table: str, values: dict, keys: List[str]) -> dict:
+        for row in self.tables[table]:
+            if all(row.get(key) == values.get(key) for key in keys):
+                row.update(values)
+                return row
+        return self.insert(table, values)
+
+    def select(self, table: str, params: httpx.QueryParams) -> List[dict]:
+        conditions = []
+        for key, value in params.multi_items():
+            if key in ("select", "order", "limit", "offset", "on_conflict", "columns"):
+                continue
+            if key in ("or", "and"):
+                conditions.append(_condition(f"{key}{value}"))
+            else:
+                conditions.append(_condition(f"{key}.{value}"))
+        return [row for row in self.tables[table] if all(condition(row) for condition in conditions)]
+
+    def _order_and_limit(self, rows: List[dict], params: httpx.QueryParams) -> List[dict]:
+        rows = list(rows)
+        order = params.get("order")
+        if order:
+            # Stable sorts from the last key to the first; nulls sort last ascending and first descending
+            for term in reversed(order.split(",")):
+                column, *modifiers = term.split(".")
+                desc = "desc" in modifiers
+                present = [row for row in rows if row.get(column) is not None]
+                missing = [row for row in rows if row.get(column) is None]
+                present.sort(key=lambda row: row[column], reverse=desc)
+                rows = missing + present if desc else present + missing
+        offset = int(params.get("offset") or 0)
+        limit = params.get("limit")
+        return rows[offset:offset + int(limit)] if limit else rows[offset:]
+
+    def _respond(self, status: int, rows: List[dict], params: httpx.QueryParams, headers: dict = None) -> httpx.Response:
+        select = params.get("select")
+        if select and select != "*":
+            rows = [self._project(row, _split(select)) for row in rows]
+        else:
+            rows = [dict(row) for row in rows]
+        return httpx.Response(status, json=rows, headers=headers)
+
+    @staticmethod
+    def _project(row: dict, columns: List[str]) -> dict:
+        projected = {}
+        for column in columns:
+            alias, _, expression = column.rpartition(":")
+            if "->" in expression:
+                name, value = _json_path(row, expression)
+            else:
+                name, value = expression, row.get(expression)
+            projected[alias or name] = value
+        return projected
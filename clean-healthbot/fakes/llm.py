@@ -0,0 +1,115 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+from typing import AsyncIterator, List
+import httpx
+from models.mood import MoodDimensions
+
+FAKE_OPENAI_LATENCY = float(os.getenv("FAKE_OPENAI_LATENCY", "0"))
+FAKE_OPENAI_JITTER = float(os.getenv("FAKE_OPENAI_JITTER", "0"))
+FAKE_OPENAI_FAILURE_RATE = float(os.getenv("FAKE_OPENAI_FAILURE_RATE", "0"))
+FAKE_OPENAI_FAILURE_STATUS = int(os.getenv("FAKE_OPENAI_FAILURE_STATUS", "500"))
+# Seconds between streamed chunks, and characters per chunk
+FAKE_OPENAI_CHUNK_DELAY = float(os.getenv("FAKE_OPENAI_CHUNK_DELAY", "0"))
+FAKE_OPENAI_CHUNK_SIZE = int(os.getenv("FAKE_OPENAI_CHUNK_SIZE", "8"))
+
+class _SSEStream(httpx.AsyncByteStream):
+    def __init__(self, events: List[str], delay: float):
+        self.events = events
+        self.delay = delay
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        for event in self.events:
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            yield event.encode()
+
+class FakeOpenAI(httpx.AsyncBaseTransport):
+    """
+    Stand-in for the OpenAI chat completions endpoint.
+    - Chat calls get a BotResponse envelope echoing the user's message with mood values derived from it;
+      conversation analyses get a summary and key themes.
+    - `latency` (+ up to `jitter`) seconds before the reply starts; streamed replies are sent in
+      `chunk_size`-character chunks `chunk_delay` seconds apart.
+    - A `failure_rate` fraction of calls fail with `failure_status` (e.g. 429 or 500).
+    """
+
+    def __init__(
+        self,
+        latency: float = FAKE_OPENAI_LATENCY,
+        jitter: float = FAKE_OPENAI_JITTER,
+        failure_rate: float = FAKE_OPENAI_FAILURE_RATE,
+        failure_status: int = FAKE_OPENAI_FAILURE_STATUS,
+        chunk_delay: float = FAKE_OPENAI_CHUNK_DELAY,
+        chunk_size: int = FAKE_OPENAI_CHUNK_SIZE,
+        seed: int = None
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.chunk_delay = chunk_delay
+        self.chunk_size = chunk_size
+        self.requests = 0
+        self._random = random.Random(seed)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        if not request.url.path.endswith("/chat/completions"):
+            return httpx.Response(404, json={"error": {"message": "Unknown endpoint", "type": "invalid_request_error"}})
+        body = json.loads(await request.aread())
+        delay = self.latency + self._random.uniform(0, self.jitter)
+        if delay:
+            await asyncio.sleep(delay)
+        if self._random.random() < self.failure_rate:
+            return httpx.Response(
+                self.failure_status,
+                json={"error": {"message": "Injected failure", "type": "server_error"}},
+                headers={"retry-after": "0"} if self.failure_status == 429 else None
+            )
+
+        content = self.reply(body["messages"])
+        completion = {
+            "id": f"chatcmpl-fake{self.requests}",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4o-mini")
+        }
+        if body.get("stream"):
+            events = []
+            for i in range(0, len(content), self.chunk_size):
+                chunk = {**completion, "object": "chat.completion.chunk", "choices": [
+                    {"index": 0, "delta": {"content": content[i:i + self.chunk_size]}, "finish_reason": None}
+                ]}
+                events.append(f"data: {json.dumps(chunk)}\n\n")
+            events.append("data: [DONE]\n\n")
+            return httpx.Response(200, headers={"content-type": "text/event-stream"}, stream=_SSEStream(events, self.chunk_delay))
+
+        prompt_tokens = sum(len(message.get("content") or "") for message in body["messages"]) // 4
+        return httpx.Response(200, json={
+            **completion,
+            "object": "chat.completion",
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": len(content) // 4,
+                "total_tokens": prompt_tokens + len(content) // 4
+            }
+        })
+
+    def reply(self, messages: List[dict]) -> str:
+        user_messages = [message["content"] for message in messages if message["role"] == "user"]
+        last = user_messages[-1] if user_messages else ""
+        if any("analyzes conversations" in (message.get("content") or "") for message in messages if message["role"] == "system"):
+            return json.dumps({
+                "summary": f"The user talked about: {last[:120]}",
+                "key_themes": sorted({word.strip(".,!?").lower() for word in last.split() if len(word) > 5})[:5]
+            })
+        digest = hashlib.sha256(last.encode()).digest()
+        moods = {
+            name: round((digest[i] / 255) * 10 - (5 if name == "mood" else 0), 1)
+            for i, name in enumerate(MoodDimensions.model_fields)
+        }
+        return json.dumps({"content": f"I hear you. You said: {last[:200]}", "mood_dimensions": moods})
@@ -1,8 +1,40 @@
-from fastapi import FastAPI
+import logging
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Response
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from api import conversations, messages
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from api import conversations, messages, users
+from core.config import close_clients
+from core.logging import configure_logging
+from core.metrics import RequestMetricsMiddleware
+from services.analysis_scheduler import analysis_scheduler
+from services.message_writer import message_writer, MESSAGE_WRITE_BEHIND
+from services.warmup import warmup
+from utils.rate_limiter import warn_if_per_worker
 
-app = FastAPI(title="Mental Health Chat API")
+# Log through a background thread (see core/logging.py) before anything else logs
+configure_logging()
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Clients, pooled connections, the mood_dim catalogue and the tokenizer are warmed up in the
+    # background; GET /ready reports when that has finished
+    warmup.start()
+    warn_if_per_worker()
+    if MESSAGE_WRITE_BEHIND:
+        # Also replays messages left unwritten in the spool by a previous run
+        await message_writer.start()
+    await analysis_scheduler.start(messages.run_analysis_and_update)
+    yield
+    await warmup.stop()
+    await analysis_scheduler.stop()
+    await message_writer.stop()
+    # Release pooled Supabase and OpenAI connections on shutdown
+    await close_clients()
+
+app = FastAPI(title="Mental Health Chat API", lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -11,12 +43,26 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Response headers browsers may read cross-origin: the paging cursor and the idempotent replay marker
+    expose_headers=["X-Next-Cursor", "Idempotent-Replayed"],
 )
+# Request latency by route and tier, plus the labels for per-stage timings
+app.add_middleware(RequestMetricsMiddleware, routes=app.routes)
 
 # Include API routers
 app.include_router(conversations.router, tags=["Conversations"])
 app.include_router(messages.router, tags=["Messages"])
+app.include_router(users.router, tags=["Users"])
 
 @app.get("/")
 async def root():
-    return {"message": "Welcome to the Mental Health Chat API"} 
\ No newline at end of file
+    return {"message": "Welcome to the Mental Health Chat API"}
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/ready", include_in_schema=False)
+async def ready():
+    """Readiness probe: 503 until the startup warm-up has finished (and again while shutting down)"""
+    return JSONResponse(warmup.status(), status_code=200 if warmup.ready else 503)
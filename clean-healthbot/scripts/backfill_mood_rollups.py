@@ -0,0 +1,76 @@
+"""
+Rebuild chat.mood_rollups from the stored messages.
+
+Reads `messages` in id order, one page at a time, and aggregates the mood values per user,
+period and bucket. It then writes the buckets with an upsert that replaces their counts. Rerunning it
+is therefore safe, and it repairs buckets that missed incremental updates.
+
+    # Every user, all time (run once after creating the table)
+    python scripts/backfill_mood_rollups.py
+
+    # One user, or only buckets from a date on
+    python scripts/backfill_mood_rollups.py --user 6f1c... --since 2024-06-01
+
+Buckets that receive new messages while the script runs may miss those messages, because the
+script replaces them with the counts it read. To repair them, rerun with --since set to the day the run started.
+--since is moved back to the Monday of its week so that weekly buckets are rebuilt whole.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.config import close_clients, get_supabase
+from services.mood_rollups import MoodRollup, ROLLUP_KEY
+
+async def backfill(user_id: str = None, since: date = None, page_size: int = 1000, batch_size: int = 500, dry_run: bool = False) -> dict:
+    """Aggregate messages into rollup rows and upsert them; returns counts for the report"""
+    supabase = get_supabase()
+    if since is not None:
+        since -= timedelta(days=since.weekday())
+    rollup = MoodRollup()
+    last_id, messages = 0, 0
+    while True:
+        query = supabase.table("messages") \
+            .select("id", "user_id", "created_at", "mood_dimensions:bot_response->mood_dimensions") \
+            .gt("id", last_id)
+        if user_id:
+            query = query.eq("user_id", user_id)
+        if since is not None:
+            query = query.gte("created_at", since.isoformat())
+        response = await query.order("id").limit(page_size).execute()
+        rollup.add(response.data)
+        messages += len(response.data)
+        if len(response.data) < page_size:
+            break
+        last_id = response.data[-1]["id"]
+
+    rows = rollup.rows()
+    if not dry_run:
+        for i in range(0, len(rows), batch_size):
+            await supabase.table("mood_rollups").upsert(rows[i:i + batch_size], on_conflict=ROLLUP_KEY).execute()
+    return {"messages": messages, "buckets": len(rows)}
+
+async def main(args) -> None:
+    started = time.perf_counter()
+    try:
+        result = await backfill(args.user, args.since, args.page_size, args.batch_size, args.dry_run)
+    finally:
+        await close_clients()
+    print(
+        f"{'Would write' if args.dry_run else 'Wrote'} {result['buckets']} rollup rows "
+        f"from {result['messages']} messages in {time.perf_counter() - started:.1f}s"
+    )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--user", help="only rebuild this user's rollups")
+    parser.add_argument("--since", type=date.fromisoformat, help="only rebuild buckets from this date (YYYY-MM-DD) on")
+    parser.add_argument("--page-size", type=int, default=1000, help="messages read per request")
+    parser.add_argument("--batch-size", type=int, default=500, help="rollup rows written per upsert")
+    parser.add_argument("--dry-run", action="store_true", help="aggregate and report without writing")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,180 @@
+"""
+Open-loop load generator for the chat endpoints.
+
+Drives POST /conversations/ and POST /messages/ at a target request rate and reports
+latency percentiles and throughput per endpoint.
+
+    # In process, against the Supabase and OpenAI fakes (no network, no server)
+    python scripts/load_test.py --rps 50 --duration 30
+
+    # Against a running server
+    python scripts/load_test.py --url http://127.0.0.1:8000 --rps 10 --duration 60
+
+In-process runs use FAKE_BACKENDS=supabase,openai unless it is already set; shape the fakes with
+FAKE_OPENAI_LATENCY, FAKE_OPENAI_JITTER, FAKE_OPENAI_FAILURE_RATE, FAKE_OPENAI_CHUNK_DELAY and FAKE_DB_LATENCY.
+The in-process transport delivers a response only once it is complete, so time to first byte
+(reported with --stream) is only meaningful with --url.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from collections import defaultdict
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+OPENERS = ["hi", "hello", "I feel stressed", "I can't sleep", "I'm lonely today", "work is overwhelming me"]
+FOLLOW_UPS = [
+    "It has been going on for weeks.",
+    "I don't know who to talk to about it.",
+    "Some days are better than others.",
+    "My exams are next week and I haven't started.",
+    "I tried going for a walk and it helped a little."
+]
+# Stay under the free tier's hourly limit so the run measures the chat path, not 429s
+MESSAGES_PER_CONVERSATION = 15
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+class LoadTest:
+    def __init__(self, client: httpx.AsyncClient, rps: float, duration: float, new_ratio: float, stream: bool, paid: bool):
+        self.client = client
+        self.rps = rps
+        self.duration = duration
+        self.new_ratio = new_ratio
+        self.stream = stream
+        self.paid = paid
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.first_byte: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+        # conversation_id -> (user_id, messages sent)
+        self.conversations: Dict[str, list] = {}
+        self.late = 0
+
+    async def run(self) -> float:
+        start = time.perf_counter()
+        tasks = []
+        total = int(self.rps * self.duration)
+        for i in range(total):
+            # Open loop: requests are issued on schedule whether or not earlier ones have finished
+            delay = start + i / self.rps - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            elif delay < -0.05:
+                self.late += 1
+            tasks.append(asyncio.create_task(self.one_request()))
+        await asyncio.gather(*tasks)
+        return time.perf_counter() - start
+
+    def pick_conversation(self):
+        open_conversations = [cid for cid, (_, sent) in self.conversations.items() if sent < MESSAGES_PER_CONVERSATION]
+        if not open_conversations or random.random() < self.new_ratio:
+            return None
+        return random.choice(open_conversations)
+
+    async def one_request(self) -> None:
+        conversation_id = self.pick_conversation()
+        params = {"is_paid": str(self.paid).lower(), "stream": str(self.stream).lower()}
+        if conversation_id is None:
+            endpoint = "POST /conversations/"
+            user_id = str(uuid.uuid4())
+            url, body = "/conversations/", {"first_message": random.choice(OPENERS)}
+        else:
+            endpoint = "POST /messages/"
+            user_id = self.conversations[conversation_id][0]
+            self.conversations[conversation_id][1] += 1
+            url, body = "/messages/", {"conversation_id": conversation_id, "user_input": random.choice(FOLLOW_UPS)}
+
+        started = time.perf_counter()
+        first_byte = None
+        try:
+            async with self.client.stream("POST", url, params={**params, "user_id": user_id}, json=body) as response:
+                chunks = []
+                async for chunk in response.aiter_bytes():
+                    if first_byte is None:
+                        first_byte = time.perf_counter() - started
+                    chunks.append(chunk)
+            status = response.status_code
+        except httpx.HTTPError:
+            status = 0
+        elapsed = time.perf_counter() - started
+
+        self.latencies[endpoint].append(elapsed)
+        if first_byte is not None:
+            self.first_byte[endpoint].append(first_byte)
+        self.statuses[endpoint][status] += 1
+        if conversation_id is None and status == 200:
+            created = self.conversation_id(b"".join(chunks))
+            if created:
+                self.conversations[created] = [user_id, 1]
+
+    def conversation_id(self, body: bytes):
+        if self.stream:
+            for frame in body.decode().split("\n\n"):
+                if frame.startswith("event: conversation"):
+                    return json.loads(frame.split("data: ", 1)[1])["id"]
+            return None
+        return json.loads(body)["id"]
+
+    def report(self, wall: float) -> str:
+        lines = [
+            f"Target {self.rps:g} req/s for {self.duration:g}s; wall time {wall:.1f}s"
+            + (f"; {self.late} requests issued late (generator saturated)" if self.late else ""),
+            f"{'endpoint':<22}{'count':>7}{'ok':>7}{'rps':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}"
+            + (f"{'ttfb p50':>10}" if self.stream else "")
+        ]
+        for endpoint, values in sorted(self.latencies.items()):
+            ordered = sorted(values)
+            ok = self.statuses[endpoint].get(200, 0)
+            line = (
+                f"{endpoint:<22}{len(values):>7}{ok:>7}{len(values) / wall:>8.1f}"
+                f"{percentile(ordered, 50) * 1000:>9.1f}{percentile(ordered, 95) * 1000:>9.1f}"
+                f"{percentile(ordered, 99) * 1000:>9.1f}{ordered[-1] * 1000:>9.1f}"
+            )
+            if self.stream:
+                line += f"{percentile(sorted(self.first_byte[endpoint]), 50) * 1000:>10.1f}"
+            lines.append(line)
+        for endpoint, statuses in sorted(self.statuses.items()):
+            failures = {status: count for status, count in statuses.items() if status != 200}
+            if failures:
+                lines.append(f"{endpoint} non-200 responses: {dict(sorted(failures.items()))}")
+        return "\n".join(lines)
+
+async def main(args) -> None:
+    if args.url:
+        async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout) as client:
+            test = LoadTest(client, args.rps, args.duration, args.new_ratio, args.stream, args.paid)
+            wall = await test.run()
+    else:
+        os.environ.setdefault("FAKE_BACKENDS", "supabase,openai")
+        import main as app_module
+
+        app = app_module.app
+        async with app_module.lifespan(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=args.timeout) as client:
+                test = LoadTest(client, args.rps, args.duration, args.new_ratio, args.stream, args.paid)
+                wall = await test.run()
+    print(test.report(wall))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="base URL of a running server; omit to run in process against the fakes")
+    parser.add_argument("--rps", type=float, default=20, help="requests issued per second")
+    parser.add_argument("--duration", type=float, default=10, help="seconds to generate load")
+    parser.add_argument("--new-ratio", type=float, default=0.2, help="share of requests that start a conversation")
+    parser.add_argument("--stream", action="store_true", help="use the SSE variants of the endpoints")
+    parser.add_argument("--paid", action="store_true", help="send requests as paid users")
+    parser.add_argument("--timeout", type=float, default=60, help="per-request client timeout in seconds")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,262 @@
+"""
+Re-score stored conversations in bulk, e.g. after the analysis prompt changes.
+
+Pages through `conversations` and fetches each page's messages in bulk. Every conversation is then
+analysed from scratch: the model summarises its latest --window messages, and mood statistics are
+computed over all of them. Results are written back with one update per page.
+
+    python scripts/reanalyze_conversations.py --concurrency 16 --rps 8
+    python scripts/reanalyze_conversations.py --resume          # continue after an interruption
+    python scripts/reanalyze_conversations.py --user 6f1c... --dry-run
+
+Model calls start at most --rps per second. When the provider sheds or rejects calls (429s past the
+gateway's retries, timeouts, an open circuit), the rate is halved, and it then recovers gradually.
+After each page, progress is saved to --checkpoint, and --resume continues from the next page.
+Conversations whose analysis still fails are listed in the checkpoint and skipped.
+Requires the chat.update_conversation_scores function (see README). In-process fakes can be used
+with FAKE_BACKENDS=supabase,openai.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.config import close_clients, get_supabase
+from services.llm_gateway import LLMGateway, LLMUnavailable, LLM_DEADLINE_ANALYSIS
+from services.openai_service import (
+    ANALYSIS_MAX_NEW_MESSAGES, add_mood_statistics, format_conversation_text, mood_dimension_names, summarize_conversation
+)
+from utils.pagination import SUPABASE_MAX_ROWS, encode_cursor, keyset_page, split_page
+
+# USD per million tokens for gpt-4o-mini (input, output)
+DEFAULT_PROMPT_PRICE = 0.15
+DEFAULT_COMPLETION_PRICE = 0.60
+
+class Pacer:
+    """
+    Spaces call starts to at most `rate` per second.
+    slow_down() halves the rate (not below `min_rate`) when the provider pushes back;
+    speed_up() adds a tenth of the configured rate back after each success.
+    """
+
+    def __init__(self, rate: float, min_rate: float = 0.2):
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min(min_rate, rate)
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self) -> None:
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + 1 / self.rate
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def slow_down(self) -> None:
+        self.rate = max(self.min_rate, self.rate / 2)
+
+    def speed_up(self) -> None:
+        self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+
+class Reanalysis:
+    """One batch run; `state` is what the checkpoint file holds"""
+
+    def __init__(
+        self,
+        concurrency: int = 8,
+        rps: float = 5,
+        page_size: int = 100,
+        window: int = ANALYSIS_MAX_NEW_MESSAGES,
+        retries: int = 2,
+        user_id: str = None,
+        limit: int = None,
+        dry_run: bool = False,
+        checkpoint_path: str = None
+    ):
+        # A gateway of its own: the job's calls queue for a slot instead of being shed like request traffic
+        self.gateway = LLMGateway(
+            max_concurrency=concurrency,
+            tier_concurrency={"batch": concurrency},
+            queue_timeout=LLM_DEADLINE_ANALYSIS
+        )
+        self.pacer = Pacer(rps)
+        self.page_size = page_size
+        self.window = window
+        self.retries = retries
+        self.user_id = user_id
+        self.limit = limit
+        self.dry_run = dry_run
+        self.checkpoint_path = checkpoint_path
+        self.state = {
+            "cursor": None, "done": False, "analyzed": 0, "empty": 0, "failed": [],
+            "prompt_tokens": 0, "completion_tokens": 0, "seconds": 0.0
+        }
+
+    def load_checkpoint(self) -> None:
+        with open(self.checkpoint_path, encoding="utf-8") as checkpoint:
+            self.state.update(json.load(checkpoint))
+
+    def save_checkpoint(self) -> None:
+        if not self.checkpoint_path:
+            return
+        # Written to a temporary file and renamed, so an interruption never leaves a torn checkpoint
+        temporary = self.checkpoint_path + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as checkpoint:
+            json.dump(self.state, checkpoint)
+        os.replace(temporary, self.checkpoint_path)
+
+    @property
+    def processed(self) -> int:
+        return self.state["analyzed"] + self.state["empty"] + len(self.state["failed"])
+
+    async def fetch_page(self, cursor: Optional[str]):
+        """(conversations, messages by conversation id, next cursor) for the page after `cursor`"""
+        query = get_supabase().table("conversations").select("id", "user_id", "created_at")
+        if self.user_id:
+            query = query.eq("user_id", self.user_id)
+        result = await keyset_page(query, cursor, self.page_size).execute()
+        conversations, next_cursor = split_page(result.data, self.page_size)
+
+        messages: Dict[str, List[dict]] = {conv["id"]: [] for conv in conversations}
+        last_id = 0
+        while conversations:
+            response = await get_supabase().table("messages") \
+                .select("id", "conversation_id", "user_input", "bot_response") \
+                .in_("conversation_id", list(messages)) \
+                .gt("id", last_id) \
+                .order("id") \
+                .limit(SUPABASE_MAX_ROWS) \
+                .execute()
+            for msg in response.data:
+                messages[msg["conversation_id"]].append(msg)
+            if len(response.data) < SUPABASE_MAX_ROWS:
+                break
+            last_id = response.data[-1]["id"]
+        return conversations, messages, next_cursor
+
+    async def analyze(self, conversation_id: str, messages: List[dict], dimensions: List[str]) -> Optional[dict]:
+        """Fresh scores for one conversation, or None once its retries are used up"""
+        text = format_conversation_text(messages[-self.window:])
+        for attempt in range(self.retries + 1):
+            await self.pacer.wait()
+            try:
+                scores, usage = await summarize_conversation(text, gateway=self.gateway, tier="batch")
+            except LLMUnavailable as e:
+                self.pacer.slow_down()
+                print(f"Conversation {conversation_id}: {e.reason} (attempt {attempt + 1}), slowing to {self.pacer.rate:.2f} calls/s")
+                if e.reason == "circuit_open":
+                    # Calls fail instantly until the breaker lets a probe through
+                    await asyncio.sleep(self.gateway.breaker.cooldown)
+                continue
+            except Exception as e:
+                print(f"Conversation {conversation_id}: {e} (attempt {attempt + 1})")
+                continue
+            self.pacer.speed_up()
+            if usage is not None:
+                self.state["prompt_tokens"] += usage.prompt_tokens
+                self.state["completion_tokens"] += usage.completion_tokens
+            return add_mood_statistics(scores, messages, dimensions)
+        return None
+
+    async def run(self) -> None:
+        dimensions = await mood_dimension_names()
+        started = time.perf_counter() - self.state["seconds"]
+        processed_before = self.processed
+        # The next page is fetched while the current one is analysed
+        next_page = None if self.state["done"] else asyncio.create_task(self.fetch_page(self.state["cursor"]))
+        while next_page is not None:
+            conversations, messages, cursor = await next_page
+            remaining = None if self.limit is None else self.limit - (self.processed - processed_before)
+            if remaining is not None and len(conversations) >= remaining:
+                if len(conversations) > remaining:
+                    # Stop mid-page with the cursor on the last conversation handled, so --resume picks up after it
+                    conversations = conversations[:remaining]
+                    cursor = encode_cursor(conversations[-1]) if conversations else self.state["cursor"]
+                next_page = None
+            else:
+                next_page = asyncio.create_task(self.fetch_page(cursor)) if cursor else None
+
+            scored = await asyncio.gather(*(
+                self.analyze(conv["id"], messages[conv["id"]], dimensions)
+                for conv in conversations if messages[conv["id"]]
+            ))
+            updates = []
+            for conv, scores in zip([conv for conv in conversations if messages[conv["id"]]], scored):
+                if scores is None:
+                    self.state["failed"].append(conv["id"])
+                else:
+                    updates.append({"id": conv["id"], "conversation_scores": scores})
+            if updates and not self.dry_run:
+                await get_supabase().rpc("update_conversation_scores", {"updates": updates}).execute()
+            self.state["analyzed"] += len(updates)
+            self.state["empty"] += sum(1 for conv in conversations if not messages[conv["id"]])
+            self.state["cursor"] = cursor
+            self.state["done"] = cursor is None
+            self.state["seconds"] = time.perf_counter() - started
+            self.save_checkpoint()
+            print(self.progress())
+
+    def cost(self, prompt_price: float, completion_price: float) -> float:
+        return (self.state["prompt_tokens"] * prompt_price + self.state["completion_tokens"] * completion_price) / 1_000_000
+
+    def progress(self) -> str:
+        seconds = self.state["seconds"] or 1e-9
+        return (
+            f"{self.processed} conversations ({self.state['analyzed']} analysed, {self.state['empty']} empty, "
+            f"{len(self.state['failed'])} failed), {self.processed / seconds:.1f}/s, "
+            f"{self.state['prompt_tokens'] + self.state['completion_tokens']} tokens"
+        )
+
+    def report(self, prompt_price: float, completion_price: float) -> str:
+        seconds = self.state["seconds"] or 1e-9
+        analyzed = self.state["analyzed"] or 1
+        cost = self.cost(prompt_price, completion_price)
+        return "\n".join([
+            f"{'Dry run: ' if self.dry_run else ''}{self.progress()} in {seconds:.1f}s",
+            f"Tokens: {self.state['prompt_tokens']} prompt + {self.state['completion_tokens']} completion, "
+            f"{(self.state['prompt_tokens'] + self.state['completion_tokens']) / analyzed:.0f} per conversation",
+            f"Estimated cost: ${cost:.4f} (${cost / analyzed * 1000:.4f} per 1000 conversations)"
+        ] + ([f"Failed conversations are listed in {self.checkpoint_path}"] if self.state["failed"] and self.checkpoint_path else []))
+
+async def main(args) -> None:
+    job = Reanalysis(
+        concurrency=args.concurrency,
+        rps=args.rps,
+        page_size=args.page_size,
+        window=args.window,
+        retries=args.retries,
+        user_id=args.user,
+        limit=args.limit,
+        dry_run=args.dry_run,
+        checkpoint_path=args.checkpoint
+    )
+    if args.resume:
+        job.load_checkpoint()
+    try:
+        await job.run()
+    finally:
+        await close_clients()
+    print(job.report(args.prompt_price, args.completion_price))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=8, help="model calls in flight")
+    parser.add_argument("--rps", type=float, default=5, help="model calls started per second (lowered on pushback)")
+    parser.add_argument("--page-size", type=int, default=100, help="conversations per page and per update")
+    parser.add_argument("--window", type=int, default=ANALYSIS_MAX_NEW_MESSAGES, help="latest messages sent to the model")
+    parser.add_argument("--retries", type=int, default=2, help="extra attempts per conversation")
+    parser.add_argument("--user", help="only re-score this user's conversations")
+    parser.add_argument("--limit", type=int, help="stop after this many conversations (resume later with --resume)")
+    parser.add_argument("--dry-run", action="store_true", help="analyse and report without writing scores")
+    parser.add_argument("--checkpoint", default="reanalysis.checkpoint.json", help="progress file written after every page")
+    parser.add_argument("--resume", action="store_true", help="continue from --checkpoint")
+    parser.add_argument("--prompt-price", type=float, default=DEFAULT_PROMPT_PRICE, help="USD per million prompt tokens")
+    parser.add_argument("--completion-price", type=float, default=DEFAULT_COMPLETION_PRICE, help="USD per million completion tokens")
+    asyncio.run(main(parser.parse_args()))
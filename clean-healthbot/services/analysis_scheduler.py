@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import os
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+ANALYSIS_EVERY_N_MESSAGES = int(os.getenv("ANALYSIS_EVERY_N_MESSAGES", "5"))
+ANALYSIS_DEBOUNCE_SECONDS = float(os.getenv("ANALYSIS_DEBOUNCE_SECONDS", "30"))
+ANALYSIS_MAX_CONCURRENCY = int(os.getenv("ANALYSIS_MAX_CONCURRENCY", "2"))
+ANALYSIS_QUEUE_SIZE = int(os.getenv("ANALYSIS_QUEUE_SIZE", "1000"))
+ANALYSIS_MAX_TRACKED_CONVERSATIONS = int(os.getenv("ANALYSIS_MAX_TRACKED_CONVERSATIONS", "100000"))
+
+class AnalysisScheduler:
+    """
+    Decides when a conversation is re-analysed and runs analyses off the request path.
+    - record_message() counts saved messages per conversation; every `every` messages it requests an analysis.
+    - Requests wait `debounce` seconds (restarted by further requests) so a burst of messages yields one run.
+    - A conversation is queued at most once; a request arriving while it runs schedules a single rerun.
+    - `concurrency` worker tasks drain a bounded queue, capping how many analyses run at once.
+    """
+
+    def __init__(
+        self,
+        every: int = ANALYSIS_EVERY_N_MESSAGES,
+        debounce: float = ANALYSIS_DEBOUNCE_SECONDS,
+        concurrency: int = ANALYSIS_MAX_CONCURRENCY,
+        max_queue: int = ANALYSIS_QUEUE_SIZE,
+        max_tracked: int = ANALYSIS_MAX_TRACKED_CONVERSATIONS
+    ):
+        self.every = every
+        self.debounce = debounce
+        self.concurrency = concurrency
+        self.max_tracked = max_tracked
+        self._counts: "OrderedDict[str, int]" = OrderedDict()
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._queued: Set[str] = set()
+        self._running: Set[str] = set()
+        self._rerun: Set[str] = set()
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._workers = []
+        self._handler: Optional[Callable[[str], Awaitable]] = None
+
+    async def start(self, handler: Callable[[str], Awaitable]) -> None:
+        self._handler = handler
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def stop(self) -> None:
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def record_message(self, conversation_id: str) -> None:
+        count = self._counts.pop(conversation_id, 0) + 1
+        if count >= self.every:
+            count = 0
+            self.request(conversation_id)
+        self._counts[conversation_id] = count
+        while len(self._counts) > self.max_tracked:
+            self._counts.popitem(last=False)
+
+    def request(self, conversation_id: str) -> None:
+        """Ask for an analysis; duplicate requests for the same conversation are coalesced"""
+        if conversation_id in self._queued:
+            return
+        if conversation_id in self._running:
+            self._rerun.add(conversation_id)
+            return
+        timer = self._timers.pop(conversation_id, None)
+        if timer is not None:
+            timer.cancel()
+        if self.debounce <= 0:
+            self._enqueue(conversation_id)
+            return
+        loop = asyncio.get_running_loop()
+        self._timers[conversation_id] = loop.call_later(self.debounce, self._enqueue, conversation_id)
+
+    def _enqueue(self, conversation_id: str) -> None:
+        self._timers.pop(conversation_id, None)
+        try:
+            self._queue.put_nowait(conversation_id)
+            self._queued.add(conversation_id)
+        except asyncio.QueueFull:
+            logger.warning("Analysis queue full, skipping conversation %s", conversation_id)
+
+    async def _worker(self) -> None:
+        while True:
+            conversation_id = await self._queue.get()
+            self._queued.discard(conversation_id)
+            self._running.add(conversation_id)
+            try:
+                await self._handler(conversation_id)
+            except Exception as e:
+                logger.error("Error analyzing conversation %s: %s", conversation_id, e)
+            finally:
+                self._running.discard(conversation_id)
+                self._queue.task_done()
+            if conversation_id in self._rerun:
+                self._rerun.discard(conversation_id)
+                self._enqueue(conversation_id)
+
+    async def drain(self) -> None:
+        """Wait until every queued analysis has run (timers still pending are not awaited)"""
+        await self._queue.join()
+
+analysis_scheduler = AnalysisScheduler()
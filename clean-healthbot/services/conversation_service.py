@@ -1,36 +1,168 @@
-from typing import List, Dict, Any
-from core.config import supabase
+import logging
+import os
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional
+from datetime import datetime
+from fastapi import HTTPException
+from core.config import get_supabase
+from core.logging import describe_error
+from core.metrics import stage_timer
+from models.mood import BotResponse
+from services.analysis_scheduler import analysis_scheduler
+from services.history_cache import history_cache
+from services.message_writer import message_writer
+from services.mood_rollups import add_mood_rollups
+from utils.rate_limiter import record_message
+
+logger = logging.getLogger(__name__)
 
 async def get_conversation_history(conversation_id: str, limit: int = None) -> List[dict]:
-    query = supabase.table("messages") \
-        .select("user_input", "bot_response") \
+    """
+    Most recent turns of a conversation in chronological order, served from the history cache when possible.
+    Turns still queued in the message writer are included (their "id" is None until written).
+    """
+    cached = history_cache.get(conversation_id, limit)
+    if cached is not None:
+        return cached
+
+    since = history_cache.write_stamp()
+    pending = message_writer.pending_turns(conversation_id)
+    query = get_supabase().table("messages") \
+        .select("id", "user_input", "bot_response") \
         .eq("conversation_id", conversation_id) \
         .order("created_at", desc=True)
     if limit:
         query = query.limit(limit)
-    response = query.execute()
+    response = await query.execute()
     # Reverse to maintain chronological order
-    return list(reversed(response.data))
+    history = list(reversed(response.data))
+    complete = not limit or len(history) < limit
+
+    # Read-your-writes: a batch may have been written, or a turn queued, while the query ran
+    seen = {id(turn) for turn in pending}
+    pending += [turn for turn in message_writer.pending_turns(conversation_id) if id(turn) not in seen]
+    if pending:
+        stored_ids = {msg["id"] for msg in history}
+        history += [turn for turn in pending if turn["id"] not in stored_ids]
+        if limit and len(history) > limit:
+            # Trimming drops stored turns, so this is no longer the whole conversation
+            history = history[-limit:]
+            complete = False
+    history_cache.fill(conversation_id, history, complete=complete, since=since)
+    return history
+
+async def get_messages_since(conversation_id: str, after_id: int, limit: int) -> List[dict]:
+    """The first `limit` turns with an id greater than `after_id`, in chronological order; page by passing the last id back"""
+    cached = history_cache.get_since(conversation_id, after_id)
+    if cached is not None:
+        return cached[:limit]
+
+    response = await get_supabase().table("messages") \
+        .select("id", "user_input", "bot_response") \
+        .eq("conversation_id", conversation_id) \
+        .gt("id", after_id) \
+        .order("id") \
+        .limit(limit) \
+        .execute()
+    return response.data
+
+async def get_stored_conversation_scores(conversation_id: str) -> Dict[str, Any]:
+    """Stored conversation_scores, or an empty dict if the conversation has none yet"""
+    response = await get_supabase().table("conversations") \
+        .select("conversation_scores") \
+        .eq("id", conversation_id) \
+        .execute()
+    if not response.data:
+        return {}
+    return response.data[0].get("conversation_scores") or {}
+
+# Conversations never change owner, so conversation_id -> user_id is cached until evicted or deleted
+OWNER_CACHE_SIZE = int(os.getenv("OWNER_CACHE_SIZE", "100000"))
+_conversation_owners: "OrderedDict[str, str]" = OrderedDict()
+
+def remember_conversation_owner(conversation_id: str, user_id: str) -> None:
+    _conversation_owners[conversation_id] = user_id
+    _conversation_owners.move_to_end(conversation_id)
+    while len(_conversation_owners) > OWNER_CACHE_SIZE:
+        _conversation_owners.popitem(last=False)
+
+def forget_conversation_owner(conversation_id: str) -> None:
+    """Invalidate cached state for a deleted conversation"""
+    _conversation_owners.pop(conversation_id, None)
+    history_cache.invalidate(conversation_id)
+
+async def get_conversation_owner(conversation_id: str) -> Optional[str]:
+    """Owner of a conversation from the cache, falling back to the database; None if it does not exist"""
+    owner = _conversation_owners.get(conversation_id)
+    if owner is not None:
+        _conversation_owners.move_to_end(conversation_id)
+        return owner
+    response = await get_supabase().table("conversations") \
+        .select("user_id") \
+        .eq("id", conversation_id) \
+        .execute()
+    if not response.data:
+        return None
+    owner = response.data[0]["user_id"]
+    remember_conversation_owner(conversation_id, owner)
+    return owner
+
+async def verify_conversation_owner(conversation_id: str, user_id: str) -> None:
+    """Raise 404 if the conversation does not exist and 403 if it belongs to another user"""
+    owner = await get_conversation_owner(conversation_id)
+    if owner is None:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    if owner != user_id:
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+async def delete_conversation_record(conversation_id: str) -> None:
+    await get_supabase().table("conversations").delete().eq("id", conversation_id).execute()
+    forget_conversation_owner(conversation_id)
+
+async def create_conversation_record(conversation_id: str, user_id: str, title: str) -> dict:
+    """Insert a conversation row and return it"""
+    response = await get_supabase().table("conversations").insert({
+        "id": conversation_id,
+        "user_id": user_id,
+        "title": title
+    }).execute()
+    remember_conversation_owner(conversation_id, user_id)
+    return response.data[0]
+
+async def save_message(conversation_id: str, user_id: str, user_input: str, bot_response: BotResponse) -> None:
+    """
+    Persist a user turn together with the bot's structured response.
+    With the write-behind queue running this returns once the row is queued; the insert is batched.
+    """
+    row = {
+        "conversation_id": conversation_id,
+        "user_id": user_id,
+        "user_input": user_input,
+        "bot_response": bot_response.model_dump(),
+        "created_at": datetime.utcnow().isoformat()
+    }
+    turn = {"id": None, "user_input": row["user_input"], "bot_response": row["bot_response"]}
+    # With write-behind this times the enqueue; the batched insert is timed as "db_batch_insert"
+    with stage_timer("db_insert"):
+        if message_writer.running:
+            await message_writer.submit(row, turn)
+        else:
+            response = await get_supabase().table("messages").insert(row).execute()
+            turn["id"] = response.data[0]["id"]
+            await add_mood_rollups([row])
+    history_cache.append(conversation_id, turn)
+    # Every persisted message counts toward the user's hourly limit and the next analysis
+    await record_message(user_id)
+    analysis_scheduler.record_message(conversation_id)
 
 async def update_conversation_scores_in_db(conversation_id: str, scores: Dict[str, Any]) -> bool:
     """Update conversation scores in Supabase"""
     try:
-        supabase.table("conversations") \
+        await get_supabase().table("conversations") \
             .update({"conversation_scores": scores}) \
             .eq("id", conversation_id) \
             .execute()
         return True
     except Exception as e:
-        print(f"Error updating conversation scores: {e}")
+        logger.error("Error updating conversation scores: %s", describe_error(e))
         return False
-
-def get_mood_dimensions() -> str :
-    response = supabase.table("mood_dim") \
-    .select("name,range").execute()
-    mood_dimensions = response.data
-    res = ""
-    for dimension in mood_dimensions:
-       res+=dimension["name"].lower()+" : float between "+str(dimension["range"])+","
-    
-    res = res[:-1]
-    return res 
\ No newline at end of file
@@ -0,0 +1,55 @@
+from datetime import datetime, timezone
+from typing import AsyncIterator, List
+from core.config import get_supabase
+from utils.pagination import SUPABASE_MAX_ROWS, keyset_page, split_page
+
+EXPORT_FORMAT_VERSION = 1
+# Conversations per page; their messages are then read in pages of SUPABASE_MAX_ROWS
+EXPORT_CONVERSATION_PAGE_SIZE = 100
+
+EXPORT_CONVERSATION_FIELDS = ["id", "title", "conversation_scores", "created_at", "updated_at"]
+EXPORT_MESSAGE_FIELDS = ["id", "conversation_id", "user_input", "bot_response", "created_at"]
+
+async def export_user_history(user_id: str) -> AsyncIterator[List[dict]]:
+    """
+    A user's conversations and messages as export records, one page at a time, oldest first.
+    - Starts with an "export" header record, before any query, and ends with an "end" record
+      holding the counts, so a truncated export can be told apart from a complete one.
+    - Each page of "conversation" records is followed by the "message" records of those conversations,
+      read with one query per 1000 messages; at most one page of rows is held at a time.
+    """
+    yield [{
+        "type": "export",
+        "version": EXPORT_FORMAT_VERSION,
+        "user_id": user_id,
+        "exported_at": datetime.now(timezone.utc).isoformat()
+    }]
+    supabase = get_supabase()
+    conversations, messages, cursor = 0, 0, None
+    while True:
+        query = supabase.table("conversations").select(*EXPORT_CONVERSATION_FIELDS).eq("user_id", user_id)
+        result = await keyset_page(query, cursor, EXPORT_CONVERSATION_PAGE_SIZE).execute()
+        page, cursor = split_page(result.data, EXPORT_CONVERSATION_PAGE_SIZE)
+        if not page:
+            break
+        conversations += len(page)
+        yield [{"type": "conversation", **conv} for conv in page]
+
+        last_id = 0
+        while True:
+            response = await supabase.table("messages") \
+                .select(*EXPORT_MESSAGE_FIELDS) \
+                .in_("conversation_id", [conv["id"] for conv in page]) \
+                .gt("id", last_id) \
+                .order("id") \
+                .limit(SUPABASE_MAX_ROWS) \
+                .execute()
+            if response.data:
+                messages += len(response.data)
+                yield [{"type": "message", **msg} for msg in response.data]
+            if len(response.data) < SUPABASE_MAX_ROWS:
+                break
+            last_id = response.data[-1]["id"]
+        if cursor is None:
+            break
+    yield [{"type": "end", "conversations": conversations, "messages": messages}]
@@ -0,0 +1,148 @@
+import os
+import time
+from collections import OrderedDict, deque
+from typing import List, Optional
+
+HISTORY_CACHE_MAX_CONVERSATIONS = int(os.getenv("HISTORY_CACHE_MAX_CONVERSATIONS", "10000"))
+HISTORY_CACHE_MAX_BYTES = int(os.getenv("HISTORY_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+HISTORY_CACHE_MAX_TURNS = int(os.getenv("HISTORY_CACHE_MAX_TURNS", "15"))
+# Per worker and write-through only for this worker's saves: turns saved by other workers appear once the entry expires
+HISTORY_CACHE_TTL = float(os.getenv("HISTORY_CACHE_TTL", "30"))
+
+# Rough per-turn overhead for the dicts and the mood_dimensions payload
+_TURN_OVERHEAD = 512
+
+def _turn_size(turn: dict) -> int:
+    bot_response = turn.get("bot_response") or {}
+    return len(turn.get("user_input") or "") + len(bot_response.get("content") or "") + _TURN_OVERHEAD
+
+class _Entry:
+    __slots__ = ("turns", "complete", "size", "expires_at")
+
+    def __init__(self, turns: deque, complete: bool, ttl: float):
+        self.turns = turns
+        self.complete = complete
+        self.size = sum(_turn_size(turn) for turn in turns)
+        self.expires_at = time.monotonic() + ttl
+
+class ConversationHistoryCache:
+    """
+    LRU cache of the most recent turns of each conversation, oldest first.
+    - fill() stores what a history query returned; `complete` means it is the whole conversation.
+      A fill whose query started (write_stamp()) before a turn of that conversation was saved or
+      invalidated is dropped, since the query may have missed the turn.
+    - get_since() answers "turns after message id N" when the cached window reaches back to N.
+    - append() writes a newly saved turn through to conversations already cached.
+    - Evicts least recently used conversations beyond `max_conversations` or `max_bytes`.
+    - Entries expire after `ttl` seconds so turns written by other workers are picked up.
+    """
+
+    def __init__(
+        self,
+        max_conversations: int = HISTORY_CACHE_MAX_CONVERSATIONS,
+        max_bytes: int = HISTORY_CACHE_MAX_BYTES,
+        max_turns: int = HISTORY_CACHE_MAX_TURNS,
+        ttl: float = HISTORY_CACHE_TTL
+    ):
+        self.max_conversations = max_conversations
+        self.max_bytes = max_bytes
+        self.max_turns = max_turns
+        self.ttl = ttl
+        self.size = 0
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        # Stamp of the latest write (append or invalidate) per conversation, bounded like the entries;
+        # `_forgotten` is the newest stamp evicted from it, assumed for conversations no longer tracked
+        self._writes = 0
+        self._last_write: "OrderedDict[str, int]" = OrderedDict()
+        self._forgotten = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, conversation_id: str, limit: int = None) -> Optional[List[dict]]:
+        """Return the last `limit` turns, or None if the cache cannot answer"""
+        entry = self._entries.get(conversation_id)
+        if entry is None:
+            return None
+        if entry.expires_at < time.monotonic():
+            self._drop(conversation_id)
+            return None
+        if not entry.complete and (limit is None or len(entry.turns) < limit):
+            return None
+        self._entries.move_to_end(conversation_id)
+        turns = list(entry.turns)
+        return turns[-limit:] if limit else turns
+
+    def get_since(self, conversation_id: str, after_id: int) -> Optional[List[dict]]:
+        """Return every cached turn with an id above `after_id`, or None if some may be missing"""
+        entry = self._entries.get(conversation_id)
+        if entry is None:
+            return None
+        if entry.expires_at < time.monotonic():
+            self._drop(conversation_id)
+            return None
+        turns = list(entry.turns)
+        if not entry.complete and not (turns and turns[0].get("id") is not None and turns[0]["id"] <= after_id):
+            return None
+        self._entries.move_to_end(conversation_id)
+        return [turn for turn in turns if turn.get("id") is not None and turn["id"] > after_id]
+
+    def write_stamp(self) -> int:
+        """Take before a history query and pass to fill() as `since`"""
+        return self._writes
+
+    def fill(self, conversation_id: str, turns: List[dict], complete: bool, since: int = None) -> None:
+        if since is not None and self._last_write.get(conversation_id, self._forgotten) > since:
+            # A turn was saved while the query ran; it may be missing from `turns`
+            return
+        self._drop(conversation_id)
+        if len(turns) > self.max_turns:
+            turns = turns[-self.max_turns:]
+            complete = False
+        entry = _Entry(deque(turns), complete, self.ttl)
+        self._entries[conversation_id] = entry
+        self.size += entry.size
+        self._evict()
+
+    def append(self, conversation_id: str, turn: dict) -> None:
+        self._record_write(conversation_id)
+        entry = self._entries.get(conversation_id)
+        if entry is None:
+            return
+        if turn.get("id") is not None and any(cached.get("id") == turn["id"] for cached in entry.turns):
+            # Already read back by a query that ran after the insert
+            return
+        entry.turns.append(turn)
+        entry.size += _turn_size(turn)
+        self.size += _turn_size(turn)
+        if len(entry.turns) > self.max_turns:
+            dropped = entry.turns.popleft()
+            entry.size -= _turn_size(dropped)
+            self.size -= _turn_size(dropped)
+            entry.complete = False
+        self._entries.move_to_end(conversation_id)
+        self._evict()
+
+    def invalidate(self, conversation_id: str) -> None:
+        self._record_write(conversation_id)
+        self._drop(conversation_id)
+
+    def _record_write(self, conversation_id: str) -> None:
+        self._writes += 1
+        self._last_write[conversation_id] = self._writes
+        self._last_write.move_to_end(conversation_id)
+        while len(self._last_write) > self.max_conversations:
+            _, stamp = self._last_write.popitem(last=False)
+            self._forgotten = max(self._forgotten, stamp)
+
+    def _drop(self, conversation_id: str) -> None:
+        entry = self._entries.pop(conversation_id, None)
+        if entry is not None:
+            self.size -= entry.size
+
+    def _evict(self) -> None:
+        while self._entries and (len(self._entries) > self.max_conversations or self.size > self.max_bytes):
+            _, entry = self._entries.popitem(last=False)
+            self.size -= entry.size
+
+history_cache = ConversationHistoryCache()
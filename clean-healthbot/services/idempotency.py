@@ -0,0 +1,147 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+from fastapi import HTTPException
+from core.metrics import IDEMPOTENCY_LOOKUPS
+
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000"))
+# Seconds a completed result is replayed to retries carrying the same key
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "600"))
+# Seconds a retry waits for the original request; an original still unfinished after this is treated as abandoned
+IDEMPOTENCY_WAIT_TIMEOUT = float(os.getenv("IDEMPOTENCY_WAIT_TIMEOUT", "60"))
+
+def request_fingerprint(*parts: Any) -> str:
+    """Hash of the request parameters a key is bound to"""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+class _Entry:
+    __slots__ = ("fingerprint", "result", "expires_at")
+
+    def __init__(self, fingerprint: str, result: Any, ttl: float):
+        self.fingerprint = fingerprint
+        self.result = result
+        self.expires_at = time.monotonic() + ttl
+
+class _Pending:
+    __slots__ = ("fingerprint", "future", "started_at")
+
+    def __init__(self, fingerprint: str):
+        self.fingerprint = fingerprint
+        self.future = asyncio.get_running_loop().create_future()
+        self.started_at = time.monotonic()
+
+class Reservation:
+    """
+    Outcome of IdempotencyCache.reserve().
+    - `replayed`: `result` holds the stored result of an earlier request with the same key.
+    - Otherwise the caller owns the key: it must call complete() with the result, or release()
+      when the request fails, so retries waiting on it run the request themselves. Both are no-ops after the first call.
+    """
+
+    def __init__(self, cache: "IdempotencyCache" = None, key: str = None, pending: _Pending = None, result: Any = None):
+        self.replayed = pending is None
+        self.result = result
+        self._cache = cache
+        self._key = key
+        self._pending = pending
+
+    def complete(self, result: Any) -> None:
+        if self._pending is None:
+            return
+        self.result = result
+        self._cache._finish(self._key, self._pending, result)
+        self._pending = None
+
+    def release(self) -> None:
+        if self._pending is None:
+            return
+        self._cache._finish(self._key, self._pending, None)
+        self._pending = None
+
+class IdempotencyCache:
+    """
+    Results of requests sent with an Idempotency-Key header, so client retries do not repeat the work.
+    - Keys are scoped to an endpoint and user, and bound to a fingerprint of the request parameters:
+      reusing a key for a different request is rejected with 422.
+    - A retry that arrives while the original request is still running waits for its result instead of
+      starting another model call.
+    - Only successful results are stored, for `ttl` seconds and up to `max_entries` (LRU);
+      after a failure, the next retry runs the request again.
+    - Per worker: a retry routed to another worker is not deduplicated.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = IDEMPOTENCY_CACHE_SIZE,
+        ttl: float = IDEMPOTENCY_TTL,
+        wait_timeout: float = IDEMPOTENCY_WAIT_TIMEOUT
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.wait_timeout = wait_timeout
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._pending: Dict[str, _Pending] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def key(endpoint: str, user_id: str, idempotency_key: str) -> str:
+        return hashlib.sha256(f"{endpoint}\0{user_id}\0{idempotency_key}".encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[_Entry]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    async def reserve(self, key: str, fingerprint: str, endpoint: str = "") -> Reservation:
+        """Replay the stored result for `key`, wait for the request in flight with it, or take ownership of it"""
+        while True:
+            entry = self.get(key)
+            pending = self._pending.get(key)
+            current = entry or pending
+            if current is not None and current.fingerprint != fingerprint:
+                IDEMPOTENCY_LOOKUPS.labels(endpoint=endpoint, result="conflict").inc()
+                raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+            if entry is not None:
+                IDEMPOTENCY_LOOKUPS.labels(endpoint=endpoint, result="replayed").inc()
+                return Reservation(result=entry.result)
+            if pending is None or time.monotonic() - pending.started_at >= self.wait_timeout:
+                # A pending entry this old belongs to a request that never finished (e.g. a stream nobody read)
+                pending = _Pending(fingerprint)
+                self._pending[key] = pending
+                IDEMPOTENCY_LOOKUPS.labels(endpoint=endpoint, result="new").inc()
+                return Reservation(self, key, pending)
+
+            wait = self.wait_timeout - (time.monotonic() - pending.started_at)
+            try:
+                result = await asyncio.wait_for(asyncio.shield(pending.future), wait)
+            except asyncio.TimeoutError:
+                # Loop round and take over the abandoned key
+                continue
+            if result is not None:
+                IDEMPOTENCY_LOOKUPS.labels(endpoint=endpoint, result="coalesced").inc()
+                return Reservation(result=result)
+            # The original failed; loop round to run the request ourselves
+
+    def _finish(self, key: str, pending: _Pending, result: Any) -> None:
+        if self._pending.get(key) is pending:
+            del self._pending[key]
+        if result is not None:
+            self._entries[key] = _Entry(pending.fingerprint, result, self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        if not pending.future.done():
+            pending.future.set_result(result)
+
+idempotency_cache = IdempotencyCache()
@@ -0,0 +1,242 @@
+import asyncio
+import os
+import random
+import time
+from typing import AsyncIterator, Dict, Optional
+import httpx
+import openai
+from core.config import get_openai_client
+from core.metrics import LLM_CALLS
+
+# Latency budgets (seconds) per caller; a call and all of its retries must finish within its budget
+LLM_DEADLINE_CHAT = float(os.getenv("LLM_DEADLINE_CHAT", "20"))
+LLM_DEADLINE_STREAM = float(os.getenv("LLM_DEADLINE_STREAM", "45"))
+LLM_DEADLINE_ANALYSIS = float(os.getenv("LLM_DEADLINE_ANALYSIS", "60"))
+
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.25"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "4"))
+
+# Concurrent provider calls per worker, overall and per tier
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "64"))
+LLM_MAX_CONCURRENCY_FREE = int(os.getenv("LLM_MAX_CONCURRENCY_FREE", "40"))
+LLM_MAX_CONCURRENCY_PAID = int(os.getenv("LLM_MAX_CONCURRENCY_PAID", "64"))
+LLM_MAX_CONCURRENCY_BACKGROUND = int(os.getenv("LLM_MAX_CONCURRENCY_BACKGROUND", "4"))
+# How long a call may wait for a free slot before it is shed
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "1"))
+
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+
+class LLMUnavailable(Exception):
+    """The provider call was shed, timed out or kept failing; callers should fall back"""
+
+    def __init__(self, reason: str, detail: str = ""):
+        super().__init__(f"{reason}: {detail}" if detail else reason)
+        self.reason = reason
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+    - Opens after `threshold` failures in a row and rejects calls for `cooldown` seconds.
+    - Then lets a single probe call through; its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, threshold: int = LLM_BREAKER_FAILURES, cooldown: float = LLM_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def release_probe(self) -> None:
+        """The probe call was cancelled before it had an outcome; let the next call probe instead"""
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self._probing or self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+        self._probing = False
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, (openai.APIConnectionError, asyncio.TimeoutError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and (error.status_code == 429 or error.status_code >= 500)
+
+def _retry_after(error: Exception) -> Optional[float]:
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+class LLMGateway:
+    """
+    Single path for every OpenAI chat completion.
+    - Each call carries an absolute deadline (time.monotonic()) covering queueing, retries and streaming.
+    - 429, 5xx, timeouts and connection errors are retried with full-jitter backoff while the deadline allows.
+    - A global and a per-tier semaphore cap concurrent calls; a call that cannot get a slot
+      within LLM_QUEUE_TIMEOUT is shed instead of queueing behind a slow provider.
+    - A circuit breaker rejects calls outright after repeated failures.
+    Anything that prevents a usable reply is raised as LLMUnavailable.
+    """
+
+    def __init__(
+        self,
+        llm_client: openai.AsyncOpenAI = None,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        tier_concurrency: Dict[str, int] = None,
+        max_retries: int = LLM_MAX_RETRIES,
+        queue_timeout: float = LLM_QUEUE_TIMEOUT,
+        breaker: CircuitBreaker = None
+    ):
+        # None uses the shared OpenAI client, created on first call
+        self.client = llm_client
+        self.max_retries = max_retries
+        self.queue_timeout = queue_timeout
+        self.breaker = breaker or CircuitBreaker()
+        self._global = asyncio.Semaphore(max_concurrency)
+        self._tiers = {
+            tier: asyncio.Semaphore(limit)
+            for tier, limit in (tier_concurrency or {
+                "free": LLM_MAX_CONCURRENCY_FREE,
+                "paid": LLM_MAX_CONCURRENCY_PAID,
+                "background": LLM_MAX_CONCURRENCY_BACKGROUND
+            }).items()
+        }
+
+    async def _acquire(self, tier: str, deadline: float) -> None:
+        wait = min(self.queue_timeout, deadline - time.monotonic())
+        tier_semaphore = self._tiers[tier]
+        try:
+            await asyncio.wait_for(tier_semaphore.acquire(), max(wait, 0))
+        except asyncio.TimeoutError:
+            LLM_CALLS.labels(tier=tier, outcome="shed").inc()
+            raise LLMUnavailable("overloaded", f"no {tier} slot")
+        try:
+            await asyncio.wait_for(self._global.acquire(), max(min(self.queue_timeout, deadline - time.monotonic()), 0))
+        except asyncio.TimeoutError:
+            tier_semaphore.release()
+            LLM_CALLS.labels(tier=tier, outcome="shed").inc()
+            raise LLMUnavailable("overloaded", "no global slot")
+
+    def _release(self, tier: str) -> None:
+        self._global.release()
+        self._tiers[tier].release()
+
+    async def _create(self, tier: str, deadline: float, **kwargs):
+        """Issue the request with retries; returns the completion (or the stream once it has started)"""
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                LLM_CALLS.labels(tier=tier, outcome="circuit_open").inc()
+                raise LLMUnavailable("circuit_open")
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                LLM_CALLS.labels(tier=tier, outcome="timeout").inc()
+                raise LLMUnavailable("timeout")
+            try:
+                response = await asyncio.wait_for(
+                    (self.client or get_openai_client()).chat.completions.create(timeout=remaining, **kwargs),
+                    remaining
+                )
+                self.breaker.record_success()
+                return response
+            except asyncio.CancelledError:
+                # A disconnected client says nothing about the provider, but a cancelled probe must not block later ones
+                self.breaker.release_probe()
+                raise
+            except Exception as e:
+                if not _is_retryable(e):
+                    # A 4xx other than 429 means the provider answered; anything else counts against it
+                    if isinstance(e, openai.APIStatusError):
+                        self.breaker.record_success()
+                    else:
+                        self.breaker.record_failure()
+                    LLM_CALLS.labels(tier=tier, outcome="error").inc()
+                    raise
+                self.breaker.record_failure()
+                delay = random.uniform(0, min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * 2 ** attempt))
+                delay = max(delay, _retry_after(e) or 0)
+                if attempt >= self.max_retries or time.monotonic() + delay >= deadline:
+                    if isinstance(e, (asyncio.TimeoutError, openai.APITimeoutError)):
+                        LLM_CALLS.labels(tier=tier, outcome="timeout").inc()
+                        raise LLMUnavailable("timeout", str(e))
+                    LLM_CALLS.labels(tier=tier, outcome="failed").inc()
+                    raise LLMUnavailable("provider_error", str(e))
+                LLM_CALLS.labels(tier=tier, outcome="retry").inc()
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    async def complete(self, tier: str, deadline: float, **kwargs):
+        """Chat completion within `deadline`"""
+        await self._acquire(tier, deadline)
+        try:
+            response = await self._create(tier, deadline, **kwargs)
+        finally:
+            self._release(tier)
+        LLM_CALLS.labels(tier=tier, outcome="ok").inc()
+        return response
+
+    async def stream(self, tier: str, deadline: float, **kwargs) -> AsyncIterator:
+        """
+        Streamed chat completion within `deadline`.
+        Retries only until the stream has started; a stream that stalls past the deadline raises LLMUnavailable.
+        """
+        await self._acquire(tier, deadline)
+        stream = None
+        try:
+            stream = await self._create(tier, deadline, stream=True, **kwargs)
+            chunks = stream.__aiter__()
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), max(deadline - time.monotonic(), 0))
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError:
+                    self.breaker.record_failure()
+                    LLM_CALLS.labels(tier=tier, outcome="timeout").inc()
+                    raise LLMUnavailable("timeout", "stream stalled")
+                except (openai.APIError, httpx.HTTPError) as e:
+                    self.breaker.record_failure()
+                    LLM_CALLS.labels(tier=tier, outcome="failed").inc()
+                    raise LLMUnavailable("provider_error", str(e))
+                yield chunk
+        finally:
+            if stream is not None:
+                await stream.close()
+            self._release(tier)
+        LLM_CALLS.labels(tier=tier, outcome="ok").inc()
+
+def deadline_after(seconds: float) -> float:
+    return time.monotonic() + seconds
+
+def chat_tier(is_paid: bool) -> str:
+    return "paid" if is_paid else "free"
+
+llm_gateway = LLMGateway()
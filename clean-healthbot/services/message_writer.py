@@ -0,0 +1,254 @@
+import asyncio
+import json
+import logging
+import os
+from typing import Dict, List, Optional, Set
+from postgrest.exceptions import APIError
+from core.config import get_supabase
+from core.logging import describe_error
+from core.metrics import MESSAGE_WRITES, MESSAGE_WRITE_QUEUE, stage_timer
+from services.mood_rollups import add_mood_rollups
+
+logger = logging.getLogger(__name__)
+
+# Optional append-only spool; unwritten messages in it are replayed on the next start
+MESSAGE_SPOOL_PATH = os.getenv("MESSAGE_SPOOL_PATH", "")
+# Replies are sent before their message is stored, so write-behind is only on by default with a spool
+MESSAGE_WRITE_BEHIND = os.getenv("MESSAGE_WRITE_BEHIND", "true" if MESSAGE_SPOOL_PATH else "false").lower() in ("1", "true", "yes")
+MESSAGE_BATCH_SIZE = int(os.getenv("MESSAGE_BATCH_SIZE", "50"))
+MESSAGE_FLUSH_INTERVAL = float(os.getenv("MESSAGE_FLUSH_INTERVAL", "0.2"))
+# Saves wait for room once this many messages are unwritten (backpressure while the database is down)
+MESSAGE_QUEUE_SIZE = int(os.getenv("MESSAGE_QUEUE_SIZE", "10000"))
+MESSAGE_SPOOL_FSYNC = os.getenv("MESSAGE_SPOOL_FSYNC", "false").lower() in ("1", "true", "yes")
+MESSAGE_SHUTDOWN_TIMEOUT = float(os.getenv("MESSAGE_SHUTDOWN_TIMEOUT", "10"))
+
+_RETRY_MAX_DELAY = 10.0
+
+def _rejects_row(e: APIError) -> bool:
+    """
+    True for errors that will fail the same row again: SQLSTATE classes 22 (invalid data) and
+    23 (constraint violation, e.g. 23503 for a deleted conversation) and PostgREST's PGRST1xx request errors.
+    Anything else (PGRST0xx connection errors, 5xx responses) is transient and retried.
+    """
+    code = str(e.code or "")
+    return code[:2] in ("22", "23") or code.startswith("PGRST1")
+
+class _Pending:
+    __slots__ = ("seq", "row", "turn")
+
+    def __init__(self, seq: int, row: dict, turn: dict):
+        self.seq = seq
+        self.row = row
+        self.turn = turn
+
+class MessageWriter:
+    """
+    Write-behind queue for `messages` inserts.
+    - submit() returns once the row is queued (and spooled); a background task inserts
+      queued rows in multi-row batches of up to `batch_size`, or after `flush_interval` seconds.
+    - Each row's history turn gets its database id once its batch is written, so the history
+      cache and pending_turns() serve unwritten turns to get_conversation_history (read-your-writes).
+    - Failed batches are retried with backoff, including while the database is down or restarting;
+      only rows the database rejects outright (invalid data, constraint violations) are dropped and logged.
+    - Each written batch is folded into the per-user mood rollups (services.mood_rollups) with one call.
+    - With a spool file every queued row is appended before submit() returns and acknowledged after
+      its insert; rows never acknowledged are replayed by start(). Delivery is at-least-once: a crash
+      between an insert and its acknowledgement replays those rows. The spool is truncated only when
+      no spooled row is unacknowledged.
+    - An error while finishing a batch is logged and the writer carries on; if its task stops anyway,
+      `running` turns False and save_message inserts directly.
+    """
+
+    def __init__(
+        self,
+        db=None,
+        batch_size: int = MESSAGE_BATCH_SIZE,
+        flush_interval: float = MESSAGE_FLUSH_INTERVAL,
+        max_queue: int = MESSAGE_QUEUE_SIZE,
+        spool_path: str = MESSAGE_SPOOL_PATH,
+        fsync: bool = MESSAGE_SPOOL_FSYNC
+    ):
+        # None uses the shared Supabase client
+        self.db = db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.spool_path = spool_path
+        self.fsync = fsync
+        self._queue: Optional[asyncio.Queue] = None
+        self._pending: Dict[str, List[_Pending]] = {}
+        # Seqs appended to the spool and not yet acknowledged; the spool is only truncated when this is empty
+        self._unacked: Set[int] = set()
+        self._seq = 0
+        self._spool = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        # A writer task that died is not running, so save_message falls back to direct inserts
+        return self._task is not None and not self._task.done()
+
+    def __len__(self) -> int:
+        return sum(len(items) for items in self._pending.values())
+
+    async def start(self) -> None:
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        replay = self._read_spool() if self.spool_path else []
+        if self.spool_path:
+            # Rewritten from scratch; replayed rows are spooled again as they are queued
+            self._spool = open(self.spool_path, "w", encoding="utf-8")
+        self._task = asyncio.create_task(self._run())
+        self._task.add_done_callback(self._stopped)
+        for row in replay:
+            await self.submit(row, {"id": None, "user_input": row["user_input"], "bot_response": row["bot_response"]})
+        if replay:
+            logger.info("Replaying %d unwritten messages from %s", len(replay), self.spool_path)
+
+    async def stop(self) -> None:
+        """Write what is queued (bounded by MESSAGE_SHUTDOWN_TIMEOUT), then stop; the spool keeps anything left"""
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), MESSAGE_SHUTDOWN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning("Stopping with %d unwritten messages", len(self))
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
+
+    async def submit(self, row: dict, turn: dict) -> None:
+        """Queue a messages row; `turn` is the history entry whose "id" is filled in once written"""
+        self._seq += 1
+        item = _Pending(self._seq, row, turn)
+        # Registered before spooling: a batch finishing during the fsync must not truncate this row away
+        self._pending.setdefault(row["conversation_id"], []).append(item)
+        if self._spool is not None:
+            self._unacked.add(item.seq)
+            try:
+                self._spool_write({"seq": item.seq, "row": row})
+                if self.fsync:
+                    await asyncio.to_thread(os.fsync, self._spool.fileno())
+            except BaseException:
+                self._unacked.discard(item.seq)
+                self._forget(item)
+                raise
+        await self._queue.put(item)
+        MESSAGE_WRITE_QUEUE.set(len(self))
+
+    def pending_turns(self, conversation_id: str) -> List[dict]:
+        """History turns of this conversation that are queued or being written, oldest first"""
+        return [item.turn for item in self._pending.get(conversation_id, ())]
+
+    async def drain(self) -> None:
+        # Nothing is ever queued when write-behind is off
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            flush_at = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = flush_at - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self._flush(batch)
+            except Exception:
+                # Keep the writer alive; rows are already written and anything unacknowledged stays in the spool
+                logger.exception("Error finishing a batch of %d messages", len(batch))
+                for item in batch:
+                    self._forget(item)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _flush(self, batch: List[_Pending]) -> None:
+        delay = self.flush_interval or 0.1
+        while True:
+            try:
+                with stage_timer("db_batch_insert", endpoint="background", tier="background"):
+                    written = await self._insert(batch)
+                break
+            except Exception as e:
+                logger.error("Error writing %d messages, retrying in %.1fs: %s", len(batch), delay, describe_error(e))
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, _RETRY_MAX_DELAY)
+
+        for item in batch:
+            data = written.get(item.seq)
+            if data is not None:
+                item.turn["id"] = data["id"]
+            self._forget(item)
+        MESSAGE_WRITES.labels(result="inserted").inc(len(written))
+        MESSAGE_WRITE_QUEUE.set(len(self))
+        if self._spool is not None:
+            self._unacked.difference_update(item.seq for item in batch)
+            if self._unacked:
+                self._spool_write({"ack": [item.seq for item in batch]})
+            else:
+                # Nothing unwritten: start the spool over instead of letting it grow
+                self._spool.seek(0)
+                self._spool.truncate()
+        await add_mood_rollups([item.row for item in batch if item.seq in written], self.db)
+
+    def _forget(self, item: _Pending) -> None:
+        pending = self._pending.get(item.row["conversation_id"], [])
+        if item in pending:
+            pending.remove(item)
+            if not pending:
+                del self._pending[item.row["conversation_id"]]
+
+    def _stopped(self, task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Message writer stopped; saving messages directly: %s", task.exception())
+
+    async def _insert(self, batch: List[_Pending]) -> Dict[int, dict]:
+        """Insert the batch; returns inserted rows by seq. Network and server errors propagate so the batch is retried."""
+        try:
+            response = await (self.db or get_supabase()).table("messages").insert([item.row for item in batch]).execute()
+            return {item.seq: data for item, data in zip(batch, response.data)}
+        except APIError as e:
+            if not _rejects_row(e):
+                raise
+            if len(batch) == 1:
+                logger.error("Dropping message rejected by the database: %s", describe_error(e))
+                MESSAGE_WRITES.labels(result="dropped").inc()
+                return {}
+        # One bad row (e.g. its conversation was deleted) must not block the rest of the batch
+        written = {}
+        for item in batch:
+            written.update(await self._insert([item]))
+        return written
+
+    def _spool_write(self, record: dict) -> None:
+        self._spool.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self._spool.flush()
+
+    def _read_spool(self) -> List[dict]:
+        rows, acked = {}, set()
+        try:
+            with open(self.spool_path, encoding="utf-8") as spool:
+                for line in spool:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A torn last line from a crash mid-write
+                        continue
+                    if "ack" in record:
+                        acked.update(record["ack"])
+                    else:
+                        rows[record["seq"]] = record["row"]
+        except FileNotFoundError:
+            return []
+        return [row for seq, row in sorted(rows.items()) if seq not in acked]
+
+message_writer = MessageWriter()
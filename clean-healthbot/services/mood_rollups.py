@@ -0,0 +1,135 @@
+import logging
+import os
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Tuple
+from postgrest.exceptions import APIError
+from core.config import get_supabase
+from core.logging import describe_error
+from core.metrics import MOOD_ROLLUP_UPDATES
+from utils.pagination import SUPABASE_MAX_ROWS
+
+logger = logging.getLogger(__name__)
+
+# Requires the chat.mood_rollups table and chat.add_mood_rollups function (see README);
+# without them updates stop after one warning
+MOOD_ROLLUPS_ENABLED = os.getenv("MOOD_ROLLUPS_ENABLED", "true").lower() in ("1", "true", "yes")
+
+ROLLUP_PERIODS = ("day", "week")
+ROLLUP_KEY = "user_id,period,bucket_start,dimension"
+# PostgREST codes for a missing function or table, and Postgres codes for an undefined function or table
+_MISSING_SCHEMA_CODES = {"PGRST202", "PGRST205", "42883", "42P01"}
+_schema_missing = False
+
+def bucket_start(created_at: str, period: str) -> date:
+    """UTC day, or the Monday of the UTC ISO week, that a message timestamp falls in"""
+    ts = datetime.fromisoformat(str(created_at).replace("Z", "+00:00"))
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc)
+    day = ts.date()
+    return day - timedelta(days=day.weekday()) if period == "week" else day
+
+def _mood_values(row: dict) -> dict:
+    if "mood_dimensions" in row:
+        return row["mood_dimensions"] or {}
+    return (row.get("bot_response") or {}).get("mood_dimensions") or {}
+
+class MoodRollup:
+    """
+    Per-user daily and weekly buckets of mood values: count, sum, min and max per dimension.
+    - add() folds in messages rows (user_id, created_at and bot_response, or a selected mood_dimensions).
+    - rows() returns one chat.mood_rollups row per (user, period, bucket, dimension); the same shape
+      is a delta for chat.add_mood_rollups, which adds counts and sums and widens min and max.
+    """
+
+    def __init__(self):
+        self.buckets: Dict[Tuple[str, str, str, str], List[float]] = {}
+
+    def add(self, messages: Iterable[dict]) -> "MoodRollup":
+        for msg in messages:
+            values = {
+                name: float(value) for name, value in _mood_values(msg).items()
+                if isinstance(value, (int, float)) and not isinstance(value, bool)
+            }
+            if not values:
+                continue
+            for period in ROLLUP_PERIODS:
+                start = bucket_start(msg["created_at"], period).isoformat()
+                for dimension, value in values.items():
+                    key = (msg["user_id"], period, start, dimension)
+                    bucket = self.buckets.get(key)
+                    if bucket is None:
+                        self.buckets[key] = [1, value, value, value]
+                    else:
+                        bucket[0] += 1
+                        bucket[1] += value
+                        bucket[2] = min(bucket[2], value)
+                        bucket[3] = max(bucket[3], value)
+        return self
+
+    def rows(self) -> List[dict]:
+        return [
+            {
+                "user_id": user_id, "period": period, "bucket_start": start, "dimension": dimension,
+                "count": count, "sum": total, "min": low, "max": high
+            }
+            for (user_id, period, start, dimension), (count, total, low, high) in self.buckets.items()
+        ]
+
+async def add_mood_rollups(messages: List[dict], db=None) -> None:
+    """
+    Fold newly written messages into chat.mood_rollups with one RPC call.
+    Errors are logged rather than raised: the messages are already stored, and the backfill script rebuilds the rollups.
+    If the migration has not been applied, updates stop for the life of the process after a single warning.
+    """
+    global _schema_missing
+    if not MOOD_ROLLUPS_ENABLED or _schema_missing:
+        return
+    deltas = MoodRollup().add(messages).rows()
+    if not deltas:
+        return
+    try:
+        await (db or get_supabase()).rpc("add_mood_rollups", {"deltas": deltas}).execute()
+        MOOD_ROLLUP_UPDATES.labels(result="ok").inc()
+    except APIError as e:
+        if e.code not in _MISSING_SCHEMA_CODES:
+            logger.error("Error updating mood rollups for %d messages: %s", len(messages), describe_error(e))
+            MOOD_ROLLUP_UPDATES.labels(result="failed").inc()
+            return
+        _schema_missing = True
+        logger.warning(
+            "Mood rollups disabled: chat.add_mood_rollups is missing (%s). Apply the mood_rollups migration "
+            "from the README, restart, and run scripts/backfill_mood_rollups.py", e.message
+        )
+        MOOD_ROLLUP_UPDATES.labels(result="failed").inc()
+    except Exception as e:
+        logger.error("Error updating mood rollups for %d messages: %s", len(messages), describe_error(e))
+        MOOD_ROLLUP_UPDATES.labels(result="failed").inc()
+
+async def get_mood_timeline(user_id: str, period: str, start: date, end: date) -> List[dict]:
+    """Buckets from `start` to `end` (inclusive) in order, each with count, mean, min and max per dimension"""
+    rows, offset = [], 0
+    while True:
+        query = get_supabase().table("mood_rollups") \
+            .select("bucket_start,dimension,count,sum,min,max") \
+            .eq("user_id", user_id) \
+            .eq("period", period) \
+            .gte("bucket_start", start.isoformat()) \
+            .lte("bucket_start", end.isoformat())
+        # One order parameter with both keys, so pages split the result consistently
+        query.params = query.params.add("order", "bucket_start.asc,dimension.asc")
+        response = await query.limit(SUPABASE_MAX_ROWS).offset(offset).execute()
+        rows += response.data
+        if len(response.data) < SUPABASE_MAX_ROWS:
+            break
+        offset += SUPABASE_MAX_ROWS
+
+    buckets: Dict[str, dict] = {}
+    for row in rows:
+        bucket = buckets.setdefault(row["bucket_start"], {"start": row["bucket_start"], "dimensions": {}})
+        bucket["dimensions"][row["dimension"]] = {
+            "count": row["count"],
+            "mean": round(row["sum"] / row["count"], 4) if row["count"] else None,
+            "min": row["min"],
+            "max": row["max"]
+        }
+    return list(buckets.values())
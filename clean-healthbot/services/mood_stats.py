@@ -0,0 +1,170 @@
+import os
+from typing import Dict, List, Optional
+import numpy as np
+
+MOOD_EWMA_ALPHA = float(os.getenv("MOOD_EWMA_ALPHA", "0.3"))
+
+# Per-dimension running sums; every field merges by addition except the ones handled explicitly
+_SUM_FIELDS = ("count", "sum", "sum_t", "sum_t2", "sum_ty", "diff_count", "diff_sum", "diff_sum_sq")
+_FIELDS = _SUM_FIELDS + ("min", "max", "ewma_raw", "first", "last")
+
+def mood_matrix(messages: List[dict], dimensions: List[str]) -> np.ndarray:
+    """Stack stored bot_response.mood_dimensions into a (messages x dimensions) array, NaN where missing"""
+    matrix = np.full((len(messages), len(dimensions)), np.nan)
+    for row, msg in enumerate(messages):
+        values = ((msg.get("bot_response") or {}).get("mood_dimensions") or {})
+        for col, dimension in enumerate(dimensions):
+            value = values.get(dimension)
+            if isinstance(value, (int, float)):
+                matrix[row, col] = value
+    return matrix
+
+class MoodStats:
+    """
+    Mergeable mood statistics over a sequence of messages, one column per mood dimension.
+    - Built from stored mood vectors with from_messages(); later batches are folded in with merge().
+    - Keeps only running sums, so the state stored in conversation_scores stays the same size
+      however long the conversation gets, and per-user figures merge per-conversation states.
+    - summary() reports count, mean, EWMA, min, max, slope (change per message) and volatility
+      (standard deviation of message-to-message changes).
+    """
+
+    def __init__(self, dimensions: List[str], alpha: float = MOOD_EWMA_ALPHA):
+        self.dimensions = list(dimensions)
+        self.alpha = alpha
+        self.messages = 0
+        size = len(self.dimensions)
+        for field in _SUM_FIELDS:
+            setattr(self, field, np.zeros(size))
+        self.ewma_raw = np.zeros(size)
+        for field in ("min", "max", "first", "last"):
+            setattr(self, field, np.full(size, np.nan))
+
+    @classmethod
+    def from_matrix(cls, matrix: np.ndarray, dimensions: List[str], alpha: float = MOOD_EWMA_ALPHA) -> "MoodStats":
+        stats = cls(dimensions, alpha)
+        n = matrix.shape[0]
+        stats.messages = n
+        if n == 0:
+            return stats
+        valid = ~np.isnan(matrix)
+        values = np.where(valid, matrix, 0.0)
+        t = np.arange(n, dtype=float)[:, None]
+
+        stats.count = valid.sum(axis=0).astype(float)
+        stats.sum = values.sum(axis=0)
+        stats.sum_t = (t * valid).sum(axis=0)
+        stats.sum_t2 = (t * t * valid).sum(axis=0)
+        stats.sum_ty = (t * values).sum(axis=0)
+        has_any = stats.count > 0
+        stats.min = np.where(has_any, np.where(valid, matrix, np.inf).min(axis=0), np.nan)
+        stats.max = np.where(has_any, np.where(valid, matrix, -np.inf).max(axis=0), np.nan)
+
+        # Zero-initialised EWMA; summary() divides by (1 - (1 - alpha) ** count) to remove the bias
+        remaining = np.cumsum(valid[::-1], axis=0)[::-1] - valid
+        weights = alpha * (1 - alpha) ** remaining * valid
+        stats.ewma_raw = (weights * values).sum(axis=0)
+
+        first_idx = valid.argmax(axis=0)
+        last_idx = n - 1 - valid[::-1].argmax(axis=0)
+        cols = np.arange(len(dimensions))
+        stats.first = np.where(has_any, matrix[first_idx, cols], np.nan)
+        stats.last = np.where(has_any, matrix[last_idx, cols], np.nan)
+
+        for col in range(len(dimensions)):
+            series = matrix[valid[:, col], col]
+            diffs = np.diff(series)
+            stats.diff_count[col] = diffs.size
+            stats.diff_sum[col] = diffs.sum()
+            stats.diff_sum_sq[col] = (diffs * diffs).sum()
+        return stats
+
+    @classmethod
+    def from_messages(cls, messages: List[dict], dimensions: List[str], alpha: float = MOOD_EWMA_ALPHA) -> "MoodStats":
+        return cls.from_matrix(mood_matrix(messages, dimensions), dimensions, alpha)
+
+    def merge(self, later: "MoodStats") -> "MoodStats":
+        """Combine with statistics for messages that came after these ones"""
+        dimensions = list(dict.fromkeys(self.dimensions + later.dimensions))
+        a, b = self.aligned(dimensions), later.aligned(dimensions)
+        merged = MoodStats(dimensions, self.alpha)
+        merged.messages = a.messages + b.messages
+        offset = a.messages
+        for field in ("count", "sum", "diff_count", "diff_sum", "diff_sum_sq"):
+            setattr(merged, field, getattr(a, field) + getattr(b, field))
+        # Shift the later block's message index by the number of earlier messages
+        merged.sum_t = a.sum_t + b.sum_t + offset * b.count
+        merged.sum_t2 = a.sum_t2 + b.sum_t2 + 2 * offset * b.sum_t + offset * offset * b.count
+        merged.sum_ty = a.sum_ty + b.sum_ty + offset * b.sum
+        merged.min = np.fmin(a.min, b.min)
+        merged.max = np.fmax(a.max, b.max)
+        merged.ewma_raw = (1 - self.alpha) ** b.count * a.ewma_raw + b.ewma_raw
+        merged.first = np.where(np.isnan(a.first), b.first, a.first)
+        merged.last = np.where(np.isnan(b.last), a.last, b.last)
+        # The change across the boundary between the two blocks
+        bridge = ~np.isnan(a.last) & ~np.isnan(b.first)
+        step = np.where(bridge, b.first - a.last, 0.0)
+        merged.diff_count = merged.diff_count + bridge
+        merged.diff_sum = merged.diff_sum + step
+        merged.diff_sum_sq = merged.diff_sum_sq + step * step
+        return merged
+
+    def aligned(self, dimensions: List[str]) -> "MoodStats":
+        if dimensions == self.dimensions:
+            return self
+        out = MoodStats(dimensions, self.alpha)
+        out.messages = self.messages
+        for i, dimension in enumerate(dimensions):
+            if dimension in self.dimensions:
+                j = self.dimensions.index(dimension)
+                for field in _FIELDS:
+                    getattr(out, field)[i] = getattr(self, field)[j]
+        return out
+
+    def summary(self) -> Dict[str, Dict[str, Optional[float]]]:
+        n = self.count
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = self.sum / n
+            ewma = self.ewma_raw / (1 - (1 - self.alpha) ** n)
+            denom = n * self.sum_t2 - self.sum_t ** 2
+            slope = np.where(denom > 0, (n * self.sum_ty - self.sum_t * self.sum) / denom, 0.0)
+            diff_mean = self.diff_sum / self.diff_count
+            volatility = np.sqrt(np.maximum(self.diff_sum_sq / self.diff_count - diff_mean ** 2, 0.0))
+            volatility = np.where(self.diff_count > 0, volatility, 0.0)
+
+        def value(x):
+            return None if np.isnan(x) else round(float(x), 3)
+
+        result = {}
+        for i, dimension in enumerate(self.dimensions):
+            if n[i] == 0:
+                continue
+            result[dimension] = {
+                "count": int(n[i]),
+                "mean": value(mean[i]),
+                "ewma": value(ewma[i]),
+                "min": value(self.min[i]),
+                "max": value(self.max[i]),
+                "slope": value(slope[i]),
+                "volatility": value(volatility[i])
+            }
+        return result
+
+    def means(self) -> Dict[str, float]:
+        return {dimension: stats["mean"] for dimension, stats in self.summary().items()}
+
+    def to_dict(self) -> dict:
+        """JSON-safe state for conversation_scores"""
+        state = {"messages": self.messages, "dimensions": self.dimensions}
+        for field in _FIELDS:
+            state[field] = [None if np.isnan(x) else float(x) for x in getattr(self, field)]
+        return state
+
+    @classmethod
+    def from_dict(cls, state: dict, alpha: float = MOOD_EWMA_ALPHA) -> "MoodStats":
+        stats = cls(state["dimensions"], alpha)
+        stats.messages = state.get("messages", 0)
+        for field in _FIELDS:
+            if field in state:
+                setattr(stats, field, np.array([np.nan if x is None else x for x in state[field]], dtype=float))
+        return stats
@@ -1,118 +1,290 @@
-from typing import List, Dict, Any
-from core.config import client, supabase
+import logging
+import os
+import time
+from typing import List, Dict, Any, AsyncIterator, Optional, Tuple, Union
+from core.metrics import CHAT_FALLBACKS, CHAT_PARSE_FAILURES, CHAT_RETRIES, FIRST_REPLY_CACHE_LOOKUPS, LLM_TOKENS, observe_stage, stage_timer
+from services.conversation_service import get_conversation_history, get_messages_since, get_stored_conversation_scores
 from models.mood import BotResponse, MoodDimensions
-from utils.mood_helpers import get_mood_dimensions
+from services.prompt_builder import build_chat_messages, count_tokens, token_budget
+from services.llm_gateway import (
+    llm_gateway, chat_tier, deadline_after, LLMGateway, LLMUnavailable,
+    LLM_DEADLINE_CHAT, LLM_DEADLINE_STREAM, LLM_DEADLINE_ANALYSIS
+)
+from services.mood_stats import MoodStats
+from services.prompts import get_system_prompt, FORMAT_REMINDER
+from services.response_cache import first_reply_cache, FIRST_REPLY_CACHE_ENABLED
+from utils.mood_helpers import mood_registry
+from utils.streaming import ContentStreamParser
+from utils.json_schema import strict_json_schema
 import json
 
-async def get_mental_health_response(user_input: str, conversation_history: List[dict] = None) -> BotResponse:
-    """Get structured response from OpenAI with mood dimensions"""
-    
-    system_prompt = ("""Be blunt in your response. Dont hold back and dont sugar coat it . You are a blunt friend. Reply in the same language as user. If it is HINGLISH then reply in HINGLISH. Do not include any text before or after the JSON. Only output the JSON object. The numeric values should lie between the range of the mood dimensions for example (negative = sad/depressed, positive = happy/positive) , (0 = no stress, 10 = extremely stressed), (0 = no energy, 10 = very energetic),(0 = no motivation, 10 = very motivated),
-     (0 = not lonely, 10 = very lonely),
-    (0 = no confidence, 10 = very confident),
-    (0 = no hope, 10 = very hopeful) ,
-    mood dimensions are : """ + get_mood_dimensions() + """. An example of the json response is  stick to this format only , no other format is allowed:
-{
-  "content": "**Hello!** How are you feeling today?",
-  "mood_dimensions": { "mood": 4, "stress": 1, "anxiety": 1, "energy": 6, "motivation": 7, "loneliness": 1, "confidence": 5, "hope": 7 }     
-}
-""")
-
-    messages = [{"role": "system", "content": system_prompt}]
-    
-    if conversation_history:
-        # Add recent conversation history (last 5 messages)
-        recent_history = conversation_history[-5:]
-        for msg in recent_history:
-            messages.append({"role": "user", "content": msg["user_input"]})
-            if msg.get("bot_response"):
-                messages.append({"role": "assistant", "content": f"{msg['bot_response']['content']} \n\n Mood Dimensions: {msg['bot_response']['mood_dimensions']}"})
+logger = logging.getLogger(__name__)
+
+def fallback_bot_response(content: str = None) -> BotResponse:
+    """Canned reply used when the model call or its JSON fails"""
+    return BotResponse(
+        content=content or "I'm here to listen and support you. How are you feeling today?",
+        mood_dimensions=MoodDimensions(
+            mood=0.0,
+            stress=5.0,
+            anxiety=5.0,
+            energy=5.0,
+            motivation=5.0,
+            loneliness=5.0,
+            confidence=5.0,
+            hope=5.0
+        )
+    )
+
+def is_fallback_response(bot_response: BotResponse) -> bool:
+    return bot_response.mood_dimensions == fallback_bot_response().mood_dimensions
+
+def parse_bot_response(response_content: str) -> BotResponse:
+    """
+    Validate the model's JSON envelope in a single parse.
+    Repairs the usual wrapping first: code fences and any text before the first or after the last brace.
+    Raises ValueError (pydantic's ValidationError) when the reply is not a valid BotResponse.
+    """
+    response_content = response_content.strip()
+    start = response_content.find("{")
+    end = response_content.rfind("}")
+    if start != -1 and end > start:
+        response_content = response_content[start:end + 1]
+    return BotResponse.model_validate_json(response_content)
+
+CHAT_MODEL = "gpt-4o-mini"
+
+# "json_schema" (strict structured outputs), "json_object" or "text" (prompt instructions only)
+CHAT_RESPONSE_FORMAT = os.getenv("CHAT_RESPONSE_FORMAT", "json_schema")
+# Extra chat calls allowed per request when the reply does not validate
+CHAT_PARSE_RETRIES = int(os.getenv("CHAT_PARSE_RETRIES", "1"))
+
+BOT_RESPONSE_SCHEMA = strict_json_schema(BotResponse)
+
+def record_usage(tier: str, response) -> None:
+    """Count the prompt and completion tokens the API reports for a completion"""
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        LLM_TOKENS.labels(tier=tier, kind="prompt").inc(usage.prompt_tokens)
+        LLM_TOKENS.labels(tier=tier, kind="completion").inc(usage.completion_tokens)
+
+def chat_response_format() -> Dict[str, Any]:
+    """response_format argument for the chat call in the configured mode"""
+    if CHAT_RESPONSE_FORMAT == "json_schema":
+        return {"response_format": {
+            "type": "json_schema",
+            "json_schema": {"name": "bot_response", "strict": True, "schema": BOT_RESPONSE_SCHEMA}
+        }}
+    if CHAT_RESPONSE_FORMAT == "json_object":
+        return {"response_format": {"type": "json_object"}}
+    return {}
+
+def retry_messages(messages: List[dict], response_content: str, error: Exception) -> List[dict]:
+    """Ask the model to correct its own reply instead of generating a new one from scratch"""
+    return messages + [
+        {"role": "assistant", "content": response_content},
+        {"role": "system", "content": (
+            f"Your reply was not a valid JSON object for the required format ({str(error).splitlines()[0]}). "
+            "Reply again with only the corrected JSON object."
+        )}
+    ]
+
+async def get_mental_health_response(user_input: str, conversation_history: List[dict] = None, is_paid: bool = False) -> BotResponse:
+    """
+    Get structured response from OpenAI with mood dimensions.
+    - The reply format is enforced with CHAT_RESPONSE_FORMAT and validated against BotResponse.
+    - A reply that fails validation is sent back for correction up to CHAT_PARSE_RETRIES times.
+    - The call and its retries share one LLM_DEADLINE_CHAT budget; if the gateway sheds or
+      times out the call, the canned reply is returned.
+    """
     
-    messages.append({"role": "user", "content": user_input})
-    messages.append({"role": "system", "content": """ Be blunt , dont sugarcoat it. Keep langugage same as user. Output only json, stick to this format only , no other format is allowed:
-{
-  "content": "**Hello!** What's on your mind?",
-  "mood_dimensions": { "mood": 4, "stress": 1, "anxiety": 1, "energy": 6, "motivation": 7, "loneliness": 1, "confidence": 5, "hope": 7 }     
-}
-"""})
+    deadline = deadline_after(LLM_DEADLINE_CHAT)
+    tier = chat_tier(is_paid)
+    with stage_timer("prompt_build"):
+        messages, prompt_tokens = await build_chat_messages(user_input, conversation_history, is_paid)
+    logger.debug("Prompt tokens: %d/%d (%d history messages)", prompt_tokens, token_budget(is_paid), len(messages) - 3)
+
+    for attempt in range(CHAT_PARSE_RETRIES + 1):
+        try:
+            with stage_timer("llm_total"):
+                response = await llm_gateway.complete(
+                    tier,
+                    deadline,
+                    model=CHAT_MODEL,
+                    messages=messages,
+                    temperature=0.5 if attempt == 0 else 0.0,
+                    max_tokens=350,
+                    **chat_response_format()
+                )
+        except Exception as e:
+            logger.error("Error in get_mental_health_response: %s", e)
+            # Return default response on error
+            CHAT_FALLBACKS.labels(reason=e.reason if isinstance(e, LLMUnavailable) else "error").inc()
+            return fallback_bot_response()
+
+        record_usage(tier, response)
+        response_content = response.choices[0].message.content or ""
+        try:
+            with stage_timer("parse"):
+                return parse_bot_response(response_content)
+        except ValueError as e:
+            logger.warning("Failed to parse JSON (attempt %d)", attempt + 1, extra={"raw": response_content})
+            CHAT_PARSE_FAILURES.labels(mode=CHAT_RESPONSE_FORMAT, attempt="initial" if attempt == 0 else "retry").inc()
+            if attempt < CHAT_PARSE_RETRIES:
+                CHAT_RETRIES.labels(mode=CHAT_RESPONSE_FORMAT).inc()
+                messages = retry_messages(messages, response_content, e)
+
+    # Fallback if JSON parsing keeps failing
+    CHAT_FALLBACKS.labels(reason="parse").inc()
+    return fallback_bot_response()
+
+async def stream_mental_health_response(
+    user_input: str,
+    conversation_history: List[dict] = None,
+    is_paid: bool = False
+) -> AsyncIterator[Union[str, BotResponse]]:
+    """
+    Stream the reply as it is generated.
+    - Yields the "content" text (str) incrementally as tokens arrive.
+    - Yields the complete BotResponse last, once the JSON envelope has been parsed.
+    - Content already reaches the client while streaming, so a reply that fails validation is not retried.
+    """
+    tier = chat_tier(is_paid)
+    with stage_timer("prompt_build"):
+        messages, prompt_tokens = await build_chat_messages(user_input, conversation_history, is_paid)
+    logger.debug("Prompt tokens: %d/%d (%d history messages)", prompt_tokens, token_budget(is_paid), len(messages) - 3)
+    parser = ContentStreamParser()
+    failure_reason = "parse"
+    started = time.perf_counter()
+    first_token = False
 
     try:
-        response = await client.chat.completions.create(
-            model="gpt-4o-mini",
+        stream = llm_gateway.stream(
+            tier,
+            deadline_after(LLM_DEADLINE_STREAM),
+            model=CHAT_MODEL,
             messages=messages,
             temperature=0.5,
-            max_tokens=350
+            max_tokens=350,
+            **chat_response_format()
         )
-
-        response_content = response.choices[0].message.content.strip()
-        
-        start=response_content.find("{")
-        if start != -1:
-            response_content = response_content[start:]
-        
-        try:
-            response_data = json.loads(response_content)
-            return BotResponse(**response_data)
-        except json.JSONDecodeError:
-            print(f"Failed to parse JSON: {response_content}")
-            # Fallback if JSON parsing fails
-            return BotResponse(
-                content="I'm here to listen and support you. How are you feeling today?",
-                mood_dimensions=MoodDimensions(
-                    mood=0.0,
-                    stress=5.0,
-                    anxiety=5.0,
-                    energy=5.0,
-                    motivation=5.0,
-                    loneliness=5.0,
-                    confidence=5.0,
-                    hope=5.0
-                )
-            )
-            
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            token = chunk.choices[0].delta.content
+            if token:
+                if not first_token:
+                    first_token = True
+                    observe_stage("llm_first_token", time.perf_counter() - started)
+                delta = parser.feed(token)
+                if delta:
+                    yield delta
     except Exception as e:
-        print(f"Error in get_mental_health_response: {e}")
-        # Return default response on error
-        return BotResponse(
-            content="I'm here to listen and support you. How are you feeling today?",
-            mood_dimensions=MoodDimensions(
-                mood=0.0,
-                stress=5.0,
-                anxiety=5.0,
-                energy=5.0,
-                motivation=5.0,
-                loneliness=5.0,
-                confidence=5.0,
-                hope=5.0
-            )
-        )
+        logger.error("Error in stream_mental_health_response: %s", e)
+        failure_reason = e.reason if isinstance(e, LLMUnavailable) else "error"
+    observe_stage("llm_total", time.perf_counter() - started)
+    if first_token:
+        # Streamed chunks carry no usage in this API version; estimate with the prompt builder's tokenizer
+        LLM_TOKENS.labels(tier=tier, kind="prompt").inc(prompt_tokens)
+        LLM_TOKENS.labels(tier=tier, kind="completion").inc(count_tokens(parser.raw))
 
-async def analyze_conversation_scores(conversation_id: str) -> Dict[str, Any]:
-    """Analyze conversation and generate conversation scores using OpenAI"""
-    
-    # Get the last 10 messages for this conversation
-    response = supabase.table("messages") \
-        .select("user_input, bot_response") \
-        .eq("conversation_id", conversation_id) \
-        .order("created_at", desc=True) \
-        .limit(10) \
-        .execute()
-    
-    if not response.data:
-        print(f"No messages found for conversation {conversation_id}")
-        return {}
-    
-    conversation_text = ""
-    for msg in reversed(response.data):
-        conversation_text += f"User: {msg['user_input']}\n"
+    try:
+        with stage_timer("parse"):
+            bot_response = parse_bot_response(parser.raw)
+    except ValueError:
+        logger.warning("Failed to parse streamed JSON", extra={"raw": parser.raw})
+        if failure_reason == "parse":
+            CHAT_PARSE_FAILURES.labels(mode=CHAT_RESPONSE_FORMAT, attempt="stream").inc()
+        CHAT_FALLBACKS.labels(reason=failure_reason).inc()
+        # Keep whatever content already reached the client
+        bot_response = fallback_bot_response(parser.content)
+        if not parser.content:
+            yield bot_response.content
+    yield bot_response
+
+async def first_reply_cache_key(user_input: str, is_paid: bool) -> Optional[str]:
+    """Key for first_reply_cache, or None when this reply must not be cached or served from cache"""
+    if not FIRST_REPLY_CACHE_ENABLED or not first_reply_cache.serves(chat_tier(is_paid)):
+        return None
+    # Any change to the prompt, model or reply format starts a fresh keyspace
+    version = "\0".join([CHAT_MODEL, CHAT_RESPONSE_FORMAT, await get_system_prompt(), FORMAT_REMINDER])
+    return first_reply_cache.key(user_input, version)
+
+async def get_first_response(user_input: str, is_paid: bool = False) -> BotResponse:
+    """
+    Reply to the opening message of a new conversation (no history).
+    - Served from first_reply_cache when it is enabled and the message is a cached opener.
+    - Concurrent misses for the same opener share one model call; canned fallback replies are never cached.
+    """
+    key = await first_reply_cache_key(user_input, is_paid)
+    if key is None:
+        FIRST_REPLY_CACHE_LOOKUPS.labels(result="bypass").inc()
+        return await get_mental_health_response(user_input, [], is_paid)
+
+    cached = first_reply_cache.get(key)
+    if cached is not None:
+        FIRST_REPLY_CACHE_LOOKUPS.labels(result="hit").inc()
+        return cached
+    FIRST_REPLY_CACHE_LOOKUPS.labels(result="miss").inc()
+    return await first_reply_cache.get_or_create(
+        key,
+        lambda: get_mental_health_response(user_input, [], is_paid),
+        cacheable=lambda bot_response: not is_fallback_response(bot_response)
+    )
+
+async def stream_first_response(user_input: str, is_paid: bool = False) -> AsyncIterator[Union[str, BotResponse]]:
+    """Streaming counterpart of get_first_response; a cache hit is sent as a single delta"""
+    key = await first_reply_cache_key(user_input, is_paid)
+    if key is None:
+        FIRST_REPLY_CACHE_LOOKUPS.labels(result="bypass").inc()
+    else:
+        cached = first_reply_cache.get(key)
+        if cached is not None:
+            FIRST_REPLY_CACHE_LOOKUPS.labels(result="hit").inc()
+            yield cached.content
+            yield cached
+            return
+        FIRST_REPLY_CACHE_LOOKUPS.labels(result="miss").inc()
+
+    bot_response = None
+    async for item in stream_mental_health_response(user_input, [], is_paid):
+        if isinstance(item, BotResponse):
+            bot_response = item
+        yield item
+    if key is not None and bot_response is not None and not is_fallback_response(bot_response):
+        first_reply_cache.put(key, bot_response)
+
+# First analysis looks at the latest turns; later runs only at turns added since
+ANALYSIS_INITIAL_WINDOW = 10
+ANALYSIS_MAX_NEW_MESSAGES = 50
+
+def format_conversation_text(messages: List[dict]) -> str:
+    """Transcript of stored turns for the analysis prompt"""
+    lines = []
+    for msg in messages:
+        lines.append(f"User: {msg['user_input']}\n")
         if msg.get('bot_response'):
-            conversation_text += f"Bot: {msg['bot_response']['content']}\n"
+            lines.append(f"Bot: {msg['bot_response']['content']}\n")
+    return "".join(lines)
+
+async def mood_dimension_names() -> List[str]:
+    """Dimensions from the mood_dim registry, falling back to the MoodDimensions model"""
+    try:
+        names = (await mood_registry.refresh()).names
+    except Exception as e:
+        logger.error("Error loading mood dimensions: %s", e)
+        names = []
+    return names or list(MoodDimensions.model_fields)
 
-    prompt = f"""
+ANALYSIS_MODEL = "gpt-4o-mini"
+
+def analysis_prompt(conversation_text: str, previous_scores: Dict[str, Any] = None) -> str:
+    """Prompt for a first analysis, or for updating `previous_scores` with only the messages added since"""
+    if not previous_scores:
+        return f"""
     Analyze the following conversation and provide a summary of the user's emotional journey and key themes.
-    The response should be a JSON object with the following keys: "summary", "average_mood_scores", "key_themes".
+    The response should be a JSON object with the following keys: "summary", "key_themes".
     "summary" should be a concise paragraph.
-    "average_mood_scores" should be an object with the average score for each mood dimension.
     "key_themes" should be a list of strings.
 
     Conversation:
@@ -120,20 +292,113 @@ async def analyze_conversation_scores(conversation_id: str) -> Dict[str, Any]:
 
     JSON Response:
     """
-    
-    try:
-        response = await client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant that analyzes conversations."},
-                {"role": "user", "content": prompt}
-            ],
-            response_format={"type": "json_object"}
+    return f"""
+    Update the analysis of an ongoing conversation. You are given the summary and key themes so far and only the messages added since.
+    The response should be a JSON object with the following keys: "summary", "key_themes".
+    "summary" should be a concise paragraph covering the whole conversation, updated with the new messages.
+    "key_themes" should be a list of strings for the whole conversation.
+
+    Summary so far:
+    {previous_scores.get("summary", "")}
+
+    Key themes so far:
+    {json.dumps(previous_scores.get("key_themes", []))}
+
+    New messages:
+    {conversation_text}
+
+    JSON Response:
+    """
+
+async def summarize_conversation(
+    conversation_text: str,
+    previous_scores: Dict[str, Any] = None,
+    gateway: LLMGateway = None,
+    tier: str = "background"
+) -> Tuple[Dict[str, Any], Any]:
+    """
+    Ask the model for the summary and key themes of a transcript.
+    Returns the parsed scores and the API's token usage; errors (including unparseable JSON) propagate.
+    """
+    response = await (gateway or llm_gateway).complete(
+        tier,
+        deadline_after(LLM_DEADLINE_ANALYSIS),
+        model=ANALYSIS_MODEL,
+        messages=[
+            {"role": "system", "content": "You are a helpful assistant that analyzes conversations."},
+            {"role": "user", "content": analysis_prompt(conversation_text, previous_scores)}
+        ],
+        response_format={"type": "json_object"}
+    )
+    record_usage(tier, response)
+    return json.loads(response.choices[0].message.content), getattr(response, "usage", None)
+
+def add_mood_statistics(scores: Dict[str, Any], messages: List[dict], dimensions: List[str], state: Dict[str, Any] = None) -> Dict[str, Any]:
+    """
+    Attach mood statistics over `messages` (stored turns, oldest first) to `scores`, folded into the
+    statistics of a previous `state` when given, and the analysis_state for the next incremental run.
+    """
+    mood_stats = MoodStats.from_messages(messages, dimensions)
+    if state and state.get("mood_state"):
+        mood_stats = MoodStats.from_dict(state["mood_state"]).merge(mood_stats)
+
+    scores["average_mood_scores"] = mood_stats.means()
+    scores["mood_statistics"] = mood_stats.summary()
+    scores["analysis_state"] = {
+        "last_message_id": max(msg["id"] for msg in messages),
+        "message_count": mood_stats.messages,
+        "mood_state": mood_stats.to_dict()
+    }
+    return scores
+
+async def analyze_conversation_scores(conversation_id: str) -> Dict[str, Any]:
+    """
+    Analyze conversation and generate conversation scores using OpenAI.
+    - Incremental: only messages added since the previous analysis are sent, together with
+      the stored rolling summary and themes.
+    - Mood statistics are computed locally from the stored mood_dimensions (services.mood_stats);
+      the model only writes the summary and key themes.
+    - conversation_scores["analysis_state"] records the last analyzed message id and the
+      mergeable mood statistics state.
+    - More than ANALYSIS_MAX_NEW_MESSAGES new turns are analyzed in batches of that size, oldest first,
+      each folded into the previous one's summary, so no turn is skipped. If a batch fails, the scores
+      of the batches before it are returned and the next analysis carries on from their last message.
+    """
+    previous_scores = await get_stored_conversation_scores(conversation_id)
+    last_message_id = (previous_scores.get("analysis_state") or {}).get("last_message_id")
+    scores = previous_scores if last_message_id is not None else None
+    analyzed = False
+
+    while True:
+        if last_message_id is None:
+            # Get the last 10 messages for this conversation
+            new_messages = await get_conversation_history(conversation_id, limit=ANALYSIS_INITIAL_WINDOW)
+        else:
+            new_messages = await get_messages_since(conversation_id, last_message_id, limit=ANALYSIS_MAX_NEW_MESSAGES)
+        # Turns still in the write-behind queue have no id yet; the next analysis picks them up
+        new_messages = [msg for msg in new_messages if msg.get("id") is not None]
+        if not new_messages:
+            break
+
+        try:
+            summary, _ = await summarize_conversation(format_conversation_text(new_messages), scores)
+        except Exception as e:
+            logger.error("Error analyzing conversation scores: %s", e)
+            return scores if analyzed else {}
+
+        scores = add_mood_statistics(
+            summary,
+            new_messages,
+            await mood_dimension_names(),
+            scores.get("analysis_state") if scores else None
         )
-        
-        scores = json.loads(response.choices[0].message.content)
-        return scores
-        
-    except Exception as e:
-        print(f"Error analyzing conversation scores: {e}")
-        return {} 
\ No newline at end of file
+        analyzed = True
+        last_message_id = scores["analysis_state"]["last_message_id"]
+        if len(new_messages) < ANALYSIS_MAX_NEW_MESSAGES:
+            break
+
+    if scores is None:
+        logger.info("No messages found for conversation %s", conversation_id)
+        return {}
+    # Unchanged previous scores when nothing is new since the last analysis
+    return scores
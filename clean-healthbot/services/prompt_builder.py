@@ -0,0 +1,89 @@
+import json
+import logging
+import math
+import os
+from typing import List, Tuple
+from services.prompts import get_system_prompt, FORMAT_REMINDER
+
+logger = logging.getLogger(__name__)
+
+# Whole-prompt token budgets per tier (system prompt, history, new message and format reminder)
+PROMPT_TOKEN_BUDGET_FREE = int(os.getenv("PROMPT_TOKEN_BUDGET_FREE", "1500"))
+PROMPT_TOKEN_BUDGET_PAID = int(os.getenv("PROMPT_TOKEN_BUDGET_PAID", "4000"))
+# Only the newest assistant turns keep their mood annotation
+ANNOTATED_HISTORY_TURNS = int(os.getenv("ANNOTATED_HISTORY_TURNS", "2"))
+TOKENIZER_ENCODING = os.getenv("TOKENIZER_ENCODING", "o200k_base")
+
+# Tokens OpenAI adds around every chat message
+_MESSAGE_OVERHEAD = 4
+
+_encoding = None
+
+def load_tokenizer() -> bool:
+    """
+    Load the tiktoken encoding used by gpt-4o-mini.
+    Blocking (it may read or download the BPE file), so call it at startup off the event loop.
+    Until it is loaded, token counts use a conservative characters-per-token estimate.
+    """
+    global _encoding
+    if _encoding is not None or not TOKENIZER_ENCODING:
+        return _encoding is not None
+    try:
+        import tiktoken
+
+        _encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+    except Exception as e:
+        logger.warning("Tokenizer unavailable, estimating token counts: %s", e)
+    return _encoding is not None
+
+def count_tokens(text: str) -> int:
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return math.ceil(len(text) / 3)
+
+def count_message_tokens(message: dict) -> int:
+    return count_tokens(message["content"]) + _MESSAGE_OVERHEAD
+
+def token_budget(is_paid: bool) -> int:
+    return PROMPT_TOKEN_BUDGET_PAID if is_paid else PROMPT_TOKEN_BUDGET_FREE
+
+def _history_turn(msg: dict, annotate: bool) -> List[dict]:
+    turn = [{"role": "user", "content": msg["user_input"]}]
+    bot_response = msg.get("bot_response")
+    if bot_response:
+        content = bot_response["content"]
+        if annotate and bot_response.get("mood_dimensions"):
+            content += "\n\nMood Dimensions: " + json.dumps(bot_response["mood_dimensions"], separators=(",", ":"))
+        turn.append({"role": "assistant", "content": content})
+    return turn
+
+async def build_chat_messages(
+    user_input: str,
+    conversation_history: List[dict] = None,
+    is_paid: bool = False
+) -> Tuple[List[dict], int]:
+    """
+    Assemble the system prompt, as much recent history as the tier's token budget allows,
+    and the new user turn.
+    - History is added newest-first and stops at the first turn that would exceed the budget.
+    - Only the newest ANNOTATED_HISTORY_TURNS assistant turns carry their mood annotation.
+    - Returns the messages and their token count.
+    """
+    head = [{"role": "system", "content": await get_system_prompt()}]
+    tail = [
+        {"role": "user", "content": user_input},
+        {"role": "system", "content": FORMAT_REMINDER}
+    ]
+    used = sum(count_message_tokens(message) for message in head + tail)
+    budget = token_budget(is_paid)
+
+    history = []
+    for age, msg in enumerate(reversed(conversation_history or [])):
+        turn = _history_turn(msg, annotate=age < ANNOTATED_HISTORY_TURNS)
+        cost = sum(count_message_tokens(message) for message in turn)
+        if used + cost > budget:
+            break
+        history = turn + history
+        used += cost
+
+    return head + history + tail, used
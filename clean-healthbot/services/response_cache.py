@@ -0,0 +1,131 @@
+import asyncio
+import hashlib
+import os
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional
+from models.mood import BotResponse
+
+# Opt-in: a cached first reply is shared between users who open with the same message
+FIRST_REPLY_CACHE_ENABLED = os.getenv("FIRST_REPLY_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+FIRST_REPLY_CACHE_SIZE = int(os.getenv("FIRST_REPLY_CACHE_SIZE", "1000"))
+FIRST_REPLY_CACHE_TTL = float(os.getenv("FIRST_REPLY_CACHE_TTL", "3600"))
+# Longer openers are rarely repeated verbatim and tend to be personal, so they always go to the model
+FIRST_REPLY_CACHE_MAX_CHARS = int(os.getenv("FIRST_REPLY_CACHE_MAX_CHARS", "80"))
+# Hit policy: tiers served from the cache, and how many times one reply is reused before it is regenerated (0 = no limit)
+FIRST_REPLY_CACHE_TIERS = [tier.strip() for tier in os.getenv("FIRST_REPLY_CACHE_TIERS", "free").split(",") if tier.strip()]
+FIRST_REPLY_CACHE_MAX_HITS = int(os.getenv("FIRST_REPLY_CACHE_MAX_HITS", "0"))
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_WHITESPACE = re.compile(r"\s+")
+
+def normalize_message(text: str) -> str:
+    """Case, width, punctuation and spacing differences collapse to one key ("Hi!!" == "hi")"""
+    text = unicodedata.normalize("NFKC", text).casefold()
+    text = _PUNCTUATION.sub("", text)
+    return _WHITESPACE.sub(" ", text).strip()
+
+class _Entry:
+    __slots__ = ("response", "expires_at", "hits")
+
+    def __init__(self, response: BotResponse, ttl: float):
+        self.response = response
+        self.expires_at = time.monotonic() + ttl
+        self.hits = 0
+
+class FirstReplyCache:
+    """
+    Exact-match LRU cache of replies to history-free first messages.
+    - Keyed on the normalised message plus a version string covering the prompt, model and
+      response format, so any prompt change starts a fresh keyspace.
+    - Entries expire after `ttl` seconds and are regenerated after `max_hits` reuses.
+    - Concurrent misses for the same key share a single model call.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = FIRST_REPLY_CACHE_SIZE,
+        ttl: float = FIRST_REPLY_CACHE_TTL,
+        max_chars: int = FIRST_REPLY_CACHE_MAX_CHARS,
+        tiers=None,
+        max_hits: int = FIRST_REPLY_CACHE_MAX_HITS
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_chars = max_chars
+        self.tiers = set(FIRST_REPLY_CACHE_TIERS if tiers is None else tiers)
+        self.max_hits = max_hits
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._pending: Dict[str, asyncio.Future] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def serves(self, tier: str) -> bool:
+        return tier in self.tiers
+
+    def key(self, message: str, version: str) -> Optional[str]:
+        """Cache key, or None when the message should not be cached"""
+        normalized = normalize_message(message)
+        if not normalized or len(normalized) > self.max_chars:
+            return None
+        return hashlib.sha256(f"{version}\0{normalized}".encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[BotResponse]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at < time.monotonic() or (self.max_hits and entry.hits >= self.max_hits):
+            del self._entries[key]
+            return None
+        entry.hits += 1
+        self._entries.move_to_end(key)
+        return entry.response
+
+    def put(self, key: str, response: BotResponse) -> None:
+        self._entries[key] = _Entry(response, self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get_or_create(
+        self,
+        key: str,
+        create: Callable[[], Awaitable[BotResponse]],
+        cacheable: Callable[[BotResponse], bool] = lambda response: True
+    ) -> BotResponse:
+        """Return the cached reply, or run `create` once for all concurrent callers and cache its result"""
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+        pending = self._pending.get(key)
+        if pending is not None:
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                # The caller that owned the model call went away; make our own
+                if not pending.cancelled():
+                    raise
+                return await create()
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        try:
+            response = await create()
+            if cacheable(response):
+                self.put(key, response)
+            future.set_result(response)
+            return response
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception retrieved when no other caller is waiting on it
+            future.exception()
+            raise
+        finally:
+            del self._pending[key]
+
+first_reply_cache = FirstReplyCache()
@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Dict, Optional
+import openai
+from core.config import get_openai_client, get_supabase
+from services.prompt_builder import load_tokenizer, TOKENIZER_ENCODING
+from services.prompts import get_system_prompt
+
+logger = logging.getLogger(__name__)
+
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() in ("1", "true", "yes")
+# Connections pre-opened to Supabase and to OpenAI (kept alive up to *_MAX_KEEPALIVE)
+WARMUP_CONNECTIONS = int(os.getenv("WARMUP_CONNECTIONS", "4"))
+# Seconds each warm-up step may take before the worker is reported ready without it
+WARMUP_TIMEOUT = float(os.getenv("WARMUP_TIMEOUT", "10"))
+
+async def open_supabase_connections() -> None:
+    supabase = get_supabase()
+    # Concurrent requests each need their own connection, which then stays in the pool
+    await asyncio.gather(*(
+        supabase.table("mood_dim").select("name").limit(1).execute()
+        for _ in range(WARMUP_CONNECTIONS)
+    ))
+
+async def open_openai_connections() -> None:
+    llm_client = get_openai_client().with_options(timeout=WARMUP_TIMEOUT)
+
+    async def connect():
+        try:
+            await llm_client.models.list()
+        except openai.APIStatusError:
+            # Any HTTP response means the TLS connection is open, which is all the warm-up needs
+            pass
+
+    await asyncio.gather(*(connect() for _ in range(WARMUP_CONNECTIONS)))
+
+async def load_mood_dimensions() -> None:
+    # Fills the mood_dim registry and renders the system prompt
+    await get_system_prompt()
+
+async def load_tokenizer_encoding() -> None:
+    # An empty TOKENIZER_ENCODING always estimates, which is not a failure
+    if not await asyncio.to_thread(load_tokenizer) and TOKENIZER_ENCODING:
+        raise RuntimeError("tokenizer unavailable, estimating token counts")
+
+WARMUP_STEPS: Dict[str, Callable[[], Awaitable[None]]] = {
+    "supabase": open_supabase_connections,
+    "openai": open_openai_connections,
+    "mood_dimensions": load_mood_dimensions,
+    "tokenizer": load_tokenizer_encoding
+}
+
+class Warmup:
+    """
+    Startup warm-up run by the lifespan in the background, so the worker starts accepting
+    connections immediately and GET /ready turns 200 once it has finished.
+    - Creates the shared clients, pre-opens pooled connections and loads the mood_dim catalogue,
+      system prompt and tokenizer concurrently.
+    - A failed or timed-out step is reported by /ready but does not hold readiness back:
+      the request path loads everything lazily anyway, only more slowly.
+    """
+
+    def __init__(self, steps: Dict[str, Callable[[], Awaitable[None]]] = None, timeout: float = WARMUP_TIMEOUT):
+        self.steps = steps if steps is not None else WARMUP_STEPS
+        self.timeout = timeout
+        self.results: Dict[str, dict] = {}
+        self.ready = False
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, enabled: bool = WARMUP_ENABLED) -> None:
+        self.ready = False
+        self.results = {}
+        if not enabled:
+            self.ready = True
+            return
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        # Draining workers report not ready
+        self.ready = False
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def run(self) -> None:
+        started = time.perf_counter()
+        await asyncio.gather(*(self._step(name, step) for name, step in self.steps.items()))
+        self.ready = True
+        logger.info("Warm-up finished in %.2fs", time.perf_counter() - started)
+
+    async def _step(self, name: str, step: Callable[[], Awaitable[None]]) -> None:
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(step(), self.timeout)
+            self.results[name] = {"ok": True}
+        except Exception as e:
+            logger.warning("Warm-up step %s failed: %s", name, e or type(e).__name__)
+            self.results[name] = {"ok": False, "error": str(e) or type(e).__name__}
+        self.results[name]["seconds"] = round(time.perf_counter() - started, 3)
+
+    def status(self) -> dict:
+        return {"ready": self.ready, "warmup": self.results}
+
+warmup = Warmup()
@@ -1,6 +1,7 @@
 const params = new URLSearchParams({
   user_id: "fbcb388a-c847-4025-845e-c5b37d185f3b",
-  is_paid: true
+  is_paid: true,
+  stream: true
 });
 const response = await fetch(`/conversations/?${params.toString()}`, {
   method: "POST",
@@ -9,21 +10,27 @@ const response = await fetch(`/conversations/?${params.toString()}`, {
   },
   body: JSON.stringify({
   "title": "My Conversation Title",
-  "first_message": {
-    "content": "Hello, this is the first message"
-  }
+  "first_message": "Hello, this is the first message"
 }
 ),
 });
 
 const reader = response.body.getReader();
 const decoder = new TextDecoder();
+let buffer = "";
 
 while (true) {
   const { value, done } = await reader.read();
   if (done) break;
 
-  const chunk = decoder.decode(value);
-  // Handle the chunk (e.g., append to UI)
-  console.log(chunk);
-}
\ No newline at end of file
+  buffer += decoder.decode(value, { stream: true });
+  // Server-Sent Events are separated by a blank line
+  const frames = buffer.split("\n\n");
+  buffer = frames.pop();
+  for (const frame of frames) {
+    const event = frame.match(/^event: (.*)$/m)?.[1];
+    const data = JSON.parse(frame.match(/^data: (.*)$/m)?.[1] ?? "null");
+    // Handle the event (e.g., append delta.content to UI)
+    console.log(event, data);
+  }
+}
@@ -0,0 +1,10 @@
+import os
+
+# Offline tests import modules that build clients from the environment;
+# give them placeholder credentials so no real service is contacted.
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_KEY", "test.test.test")
+os.environ.setdefault("OPENAI_API_KEY", "test")
+# Route both services to the in-process fakes and never download the tokenizer
+os.environ.setdefault("FAKE_BACKENDS", "supabase,openai")
+os.environ.setdefault("TOKENIZER_ENCODING", "")
@@ -0,0 +1,54 @@
+import asyncio
+from services.analysis_scheduler import AnalysisScheduler
+
+def test_triggers_every_n_messages_and_coalesces():
+    async def run():
+        calls = []
+
+        async def handler(conversation_id):
+            calls.append(conversation_id)
+
+        scheduler = AnalysisScheduler(every=5, debounce=0.05, concurrency=1)
+        await scheduler.start(handler)
+        for _ in range(4):
+            scheduler.record_message("c1")
+        await asyncio.sleep(0.1)
+        assert calls == []
+        # Ten more messages request twice, but the debounce window merges them
+        for _ in range(11):
+            scheduler.record_message("c1")
+        await asyncio.sleep(0.1)
+        await scheduler.drain()
+        await scheduler.stop()
+        return calls
+    assert asyncio.run(run()) == ["c1"]
+
+def test_caps_concurrency_and_reruns_once():
+    async def run():
+        active = 0
+        peak = 0
+        calls = []
+
+        async def handler(conversation_id):
+            nonlocal active, peak
+            active += 1
+            peak = max(peak, active)
+            calls.append(conversation_id)
+            await asyncio.sleep(0.05)
+            active -= 1
+
+        scheduler = AnalysisScheduler(every=1, debounce=0, concurrency=2)
+        await scheduler.start(handler)
+        for cid in ("a", "b", "c", "d"):
+            scheduler.request(cid)
+        await asyncio.sleep(0.01)
+        # "a" is running: repeated requests collapse into a single rerun
+        scheduler.request("a")
+        scheduler.request("a")
+        await asyncio.sleep(0.2)
+        await scheduler.drain()
+        await scheduler.stop()
+        return peak, sorted(calls)
+    peak, calls = asyncio.run(run())
+    assert peak == 2
+    assert calls == ["a", "a", "b", "c", "d"]
@@ -0,0 +1,80 @@
+from services.history_cache import ConversationHistoryCache
+
+def turn(i, text="x"):
+    return {"user_input": f"{text}{i}", "bot_response": {"content": f"reply {i}", "mood_dimensions": {}}}
+
+def test_partial_fill_only_answers_smaller_limits():
+    cache = ConversationHistoryCache()
+    cache.fill("c1", [turn(i) for i in range(5)], complete=False)
+    assert [t["user_input"] for t in cache.get("c1", 3)] == ["x2", "x3", "x4"]
+    assert cache.get("c1", 10) is None
+    assert cache.get("c1") is None
+
+def test_complete_fill_answers_any_limit_and_appends_write_through():
+    cache = ConversationHistoryCache(max_turns=4)
+    cache.fill("c1", [turn(0)], complete=True)
+    cache.append("c1", turn(1))
+    assert [t["user_input"] for t in cache.get("c1", 15)] == ["x0", "x1"]
+    for i in range(2, 5):
+        cache.append("c1", turn(i))
+    # Dropping the oldest turn means the cache no longer holds the whole conversation
+    assert cache.get("c1", 15) is None
+    assert [t["user_input"] for t in cache.get("c1", 4)] == ["x1", "x2", "x3", "x4"]
+
+def test_append_ignores_uncached_conversations():
+    cache = ConversationHistoryCache()
+    cache.append("c1", turn(0))
+    assert cache.get("c1", 1) is None
+    assert len(cache) == 0
+
+def test_evicts_by_count_and_size():
+    cache = ConversationHistoryCache(max_conversations=2)
+    for cid in ("a", "b", "c"):
+        cache.fill(cid, [turn(0)], complete=True)
+    assert cache.get("a") is None and cache.get("c") is not None
+
+    cache = ConversationHistoryCache(max_bytes=3000)
+    cache.fill("a", [turn(0, "y" * 1000)], complete=True)
+    cache.fill("b", [turn(0, "y" * 1000)], complete=True)
+    cache.fill("c", [turn(0, "y" * 1000)], complete=True)
+    assert cache.get("a") is None
+    assert cache.size <= 3000
+
+def test_expired_entries_miss():
+    cache = ConversationHistoryCache(ttl=-1)
+    cache.fill("a", [turn(0)], complete=True)
+    assert cache.get("a") is None
+    assert cache.size == 0
+
+def test_get_since_requires_the_window_to_reach_the_watermark():
+    cache = ConversationHistoryCache()
+    turns = [dict(turn(i), id=100 + i) for i in range(5)]
+    cache.fill("c1", turns, complete=False)
+    assert [t["id"] for t in cache.get_since("c1", 102)] == [103, 104]
+    assert cache.get_since("c1", 104) == []
+    # Turns 90..99 are not cached, so the cache cannot answer
+    assert cache.get_since("c1", 90) is None
+    cache.fill("c2", turns, complete=True)
+    assert len(cache.get_since("c2", 0)) == 5
+
+def test_a_fill_that_raced_a_save_is_dropped():
+    cache = ConversationHistoryCache()
+    since = cache.write_stamp()
+    # The save finished while the miss query was in flight, before anything was cached
+    cache.append("c1", dict(turn(1), id=2))
+    cache.fill("c1", [dict(turn(0), id=1)], complete=True, since=since)
+    assert cache.get("c1") is None
+
+    since = cache.write_stamp()
+    cache.fill("c1", [dict(turn(0), id=1), dict(turn(1), id=2)], complete=True, since=since)
+    # A save whose row the query already read back is not appended twice
+    cache.append("c1", dict(turn(1), id=2))
+    assert [t["id"] for t in cache.get("c1")] == [1, 2]
+
+def test_forgotten_write_stamps_are_assumed_recent():
+    cache = ConversationHistoryCache(max_conversations=1)
+    since = cache.write_stamp()
+    cache.append("c1", turn(0))
+    cache.append("c2", turn(0))
+    cache.fill("c1", [turn(0)], complete=True, since=since)
+    assert cache.get("c1") is None
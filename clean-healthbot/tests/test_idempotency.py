@@ -0,0 +1,99 @@
+import asyncio
+import json
+import pytest
+from fastapi import HTTPException, Response
+from fastapi.testclient import TestClient
+import main
+from core.config import fake_database
+from api.messages import create_message
+from models.message import MessageCreate
+from services.idempotency import IdempotencyCache, idempotency_cache, request_fingerprint
+
+def test_concurrent_retries_share_one_run():
+    async def scenario():
+        cache = IdempotencyCache()
+        calls = 0
+
+        async def request():
+            nonlocal calls
+            reservation = await cache.reserve("k", "fp")
+            if reservation.replayed:
+                return reservation.result
+            calls += 1
+            await asyncio.sleep(0.01)
+            reservation.complete(f"reply {calls}")
+            return reservation.result
+
+        results = await asyncio.gather(*(request() for _ in range(3)))
+        assert results == ["reply 1"] * 3 and calls == 1
+        assert (await cache.reserve("k", "fp")).result == "reply 1"
+        with pytest.raises(HTTPException) as conflict:
+            await cache.reserve("k", "other")
+        assert conflict.value.status_code == 422
+
+    asyncio.run(scenario())
+
+def test_a_failed_or_abandoned_request_lets_the_retry_run():
+    async def scenario():
+        cache = IdempotencyCache(wait_timeout=0.05)
+        first = await cache.reserve("k", "fp")
+        waiter = asyncio.create_task(cache.reserve("k", "fp"))
+        await asyncio.sleep(0)
+        first.release()
+        retry = await waiter
+        assert not retry.replayed
+        retry.complete("ok")
+        first.complete("late")  # no-op after release
+        assert (await cache.reserve("k", "fp")).result == "ok"
+
+        # Never completed nor released: the retry takes over once the wait times out
+        await cache.reserve("abandoned", "fp")
+        assert not (await cache.reserve("abandoned", "fp")).replayed
+
+    asyncio.run(scenario())
+
+@pytest.fixture(scope="module")
+def api():
+    with TestClient(main.app) as client:
+        yield client
+
+def test_retried_posts_are_answered_once(api):
+    headers = {"Idempotency-Key": "create-1"}
+    params = {"user_id": "user-idempotent"}
+    created = api.post("/conversations/", params=params, headers=headers, json={"first_message": "hello"})
+    retried = api.post("/conversations/", params=params, headers=headers, json={"first_message": "hello"})
+    assert retried.json() == created.json() and retried.headers["Idempotent-Replayed"] == "true"
+    conversation_id = created.json()["id"]
+    assert sum(conv["user_id"] == "user-idempotent" for conv in fake_database.tables["conversations"]) == 1
+
+    body = {"conversation_id": conversation_id, "user_input": "still here"}
+    first = api.post("/messages/", params=params, headers={"Idempotency-Key": "msg-1"}, json=body)
+    again = api.post("/messages/", params={**params, "stream": "true"}, headers={"Idempotency-Key": "msg-1"}, json=body)
+    assert "Idempotent-Replayed" not in first.headers and again.headers["Idempotent-Replayed"] == "true"
+    done = again.text.strip().split("\n\n")[-1]
+    assert done.startswith("event: done\n") and json.loads(done.split("data: ", 1)[1]) == first.json()
+    api.portal.call(main.message_writer.drain)
+    stored = [msg for msg in fake_database.tables["messages"] if msg["conversation_id"] == conversation_id]
+    assert [msg["user_input"] for msg in stored] == ["hello", "still here"]
+
+    conflict = api.post("/messages/", params=params, headers={"Idempotency-Key": "msg-1"}, json={**body, "user_input": "other"})
+    assert conflict.status_code == 422
+
+def test_an_unread_stream_releases_its_key(api):
+    conversation_id = api.post("/conversations/", params={"user_id": "user-unread"}, json={"first_message": "hi"}).json()["id"]
+    message = MessageCreate(conversation_id=conversation_id, user_input="gone before reading")
+
+    async def scenario():
+        response = await create_message(message, "user-unread", Response(), stream=True, idempotency_key="unread-1")
+        # The client disconnected before the body started: only the background task runs
+        await response.background()
+        key = idempotency_cache.key("messages", "user-unread", "unread-1")
+        retry = await asyncio.wait_for(idempotency_cache.reserve(key, request_fingerprint(message.model_dump(), False)), 1)
+        assert not retry.replayed
+        retry.release()
+
+    api.portal.call(scenario)
+
+def test_browsers_can_read_the_replay_marker(api):
+    response = api.get("/conversations/", params={"user_id": "user-unread"}, headers={"Origin": "https://app.example"})
+    assert "idempotent-replayed" in response.headers["access-control-expose-headers"].lower()
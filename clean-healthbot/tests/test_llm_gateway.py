@@ -0,0 +1,108 @@
+import asyncio
+from types import SimpleNamespace
+import httpx
+import openai
+import pytest
+from services import llm_gateway as gateway_module
+from services.llm_gateway import CircuitBreaker, LLMGateway, LLMUnavailable, deadline_after
+
+def status_error(status: int, headers: dict = None) -> openai.APIStatusError:
+    response = httpx.Response(status, headers=headers, request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions"))
+    cls = openai.RateLimitError if status == 429 else openai.InternalServerError if status >= 500 else openai.BadRequestError
+    return cls("error", response=response, body=None)
+
+class FakeCompletions:
+    def __init__(self, outcomes, delay: float = 0):
+        self.outcomes = list(outcomes)
+        self.delay = delay
+        self.calls = 0
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        outcome = self.outcomes.pop(0) if self.outcomes else "ok"
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+def gateway(outcomes=(), delay: float = 0, **kwargs) -> LLMGateway:
+    fake = FakeCompletions(outcomes, delay)
+    kwargs.setdefault("tier_concurrency", {"free": 1, "paid": 2, "background": 1})
+    return LLMGateway(SimpleNamespace(chat=SimpleNamespace(completions=fake)), **kwargs)
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(gateway_module, "LLM_RETRY_BASE_DELAY", 0.001)
+
+def test_retries_429_and_5xx_then_succeeds():
+    llm = gateway([status_error(429), status_error(503), "reply"], max_retries=2)
+    assert asyncio.run(llm.complete("free", deadline_after(5))) == "reply"
+    assert llm.client.chat.completions.calls == 3
+
+def test_client_errors_are_not_retried():
+    llm = gateway([status_error(400)], max_retries=2)
+    with pytest.raises(openai.BadRequestError):
+        asyncio.run(llm.complete("free", deadline_after(5)))
+    assert llm.client.chat.completions.calls == 1
+
+def test_retries_are_bounded_and_reported_as_unavailable():
+    llm = gateway([status_error(500)] * 5, max_retries=1)
+    with pytest.raises(LLMUnavailable) as error:
+        asyncio.run(llm.complete("free", deadline_after(5)))
+    assert error.value.reason == "provider_error"
+    assert llm.client.chat.completions.calls == 2
+
+def test_deadline_cuts_off_a_hung_call():
+    llm = gateway(delay=10, max_retries=0)
+    with pytest.raises(LLMUnavailable) as error:
+        asyncio.run(llm.complete("free", deadline_after(0.05)))
+    assert error.value.reason == "timeout"
+
+def test_calls_beyond_the_tier_limit_are_shed():
+    llm = gateway(delay=0.2, queue_timeout=0.01)
+
+    async def run():
+        return await asyncio.gather(
+            llm.complete("free", deadline_after(5)),
+            llm.complete("free", deadline_after(5)),
+            return_exceptions=True
+        )
+
+    first, second = asyncio.run(run())
+    assert first == "ok"
+    assert isinstance(second, LLMUnavailable) and second.reason == "overloaded"
+
+def test_circuit_opens_after_repeated_failures_and_probes_after_cooldown():
+    breaker = CircuitBreaker(threshold=2, cooldown=0.05)
+    llm = gateway([status_error(502), status_error(502)], max_retries=0, breaker=breaker)
+
+    async def run():
+        for _ in range(2):
+            with pytest.raises(LLMUnavailable):
+                await llm.complete("paid", deadline_after(5))
+        with pytest.raises(LLMUnavailable) as error:
+            await llm.complete("paid", deadline_after(5))
+        assert error.value.reason == "circuit_open"
+        assert llm.client.chat.completions.calls == 2
+        await asyncio.sleep(0.06)
+        assert await llm.complete("paid", deadline_after(5)) == "ok"
+        assert breaker.state == "closed"
+
+    asyncio.run(run())
+
+def test_a_cancelled_probe_lets_the_next_call_probe():
+    breaker = CircuitBreaker(threshold=1, cooldown=0.01)
+    llm = gateway([status_error(502)], delay=0.05, max_retries=0, breaker=breaker)
+
+    async def run():
+        with pytest.raises(LLMUnavailable):
+            await llm.complete("paid", deadline_after(5))
+        await asyncio.sleep(0.02)
+        probe = asyncio.create_task(llm.complete("paid", deadline_after(5)))
+        await asyncio.sleep(0.01)
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+        assert breaker.state == "half_open" and breaker.allow()
+
+    asyncio.run(run())
@@ -0,0 +1,53 @@
+import json
+import logging
+import queue
+import sys
+from postgrest.exceptions import APIError
+from core.logging import JsonFormatter, NonBlockingQueueHandler, RedactingFilter, SamplingFilter
+from core.metrics import LOG_RECORDS_DROPPED
+
+def make_record(level=logging.INFO, msg="hello %s", args=("world",), **extra):
+    record = logging.LogRecord("test", level, __file__, 1, msg, args, None)
+    record.__dict__.update(extra)
+    return record
+
+def test_user_text_is_redacted_in_json_output():
+    record = make_record(raw='{"content": "I feel hopeless"}', conversation_id="c1", row={"user_input": "secret", "user_id": "u1"})
+    assert RedactingFilter().filter(record)
+    entry = json.loads(JsonFormatter().format(record))
+    assert entry["message"] == "hello world"
+    assert entry["raw"] == "[redacted 30 chars]"
+    assert entry["row"] == {"user_input": "[redacted 6 chars]", "user_id": "u1"}
+    assert entry["conversation_id"] == "c1"
+
+def test_database_errors_lose_the_failing_row():
+    error = APIError({
+        "message": 'null value in column "bot_response" violates not-null constraint', "code": "23502",
+        "details": "Failing row contains (12, c1, u1, I want to hurt myself, null)", "hint": None
+    })
+    try:
+        raise error
+    except APIError:
+        record = make_record(level=logging.ERROR, msg="Error saving message: %s", args=(error,), exc_info=sys.exc_info())
+    assert RedactingFilter().filter(record)
+    line = JsonFormatter().format(record)
+    assert "hurt myself" not in line
+    entry = json.loads(line)
+    assert entry["message"] == 'Error saving message: APIError 23502: null value in column "bot_response" violates not-null constraint'
+    assert entry["exception"].endswith("APIError 23502: null value in column \"bot_response\" violates not-null constraint")
+
+def test_debug_records_are_sampled_and_others_kept():
+    never = SamplingFilter(rate=0.0)
+    assert not never.filter(make_record(level=logging.DEBUG))
+    assert never.filter(make_record(level=logging.INFO))
+    assert SamplingFilter(rate=1.0).filter(make_record(level=logging.DEBUG))
+
+def test_full_queue_drops_instead_of_blocking():
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=1))
+    before = LOG_RECORDS_DROPPED._value.get()
+    handler.handle(make_record())
+    handler.handle(make_record())
+    assert handler.queue.qsize() == 1
+    assert LOG_RECORDS_DROPPED._value.get() == before + 1
+    # Arguments are merged before the record crosses to the listener thread
+    assert handler.queue.get_nowait().getMessage() == "hello world"
@@ -0,0 +1,181 @@
+import asyncio
+import json
+import logging
+import time
+from types import SimpleNamespace
+from postgrest.exceptions import APIError
+from services import message_writer as message_writer_module
+from services.message_writer import MessageWriter
+
+class FakeMessages:
+    def __init__(self, reject=(), unavailable=0):
+        self.batches = []
+        self.reject = set(reject)
+        # Inserts that fail as if Postgres were unreachable, before the database comes back
+        self.unavailable = unavailable
+        self.next_id = 1
+
+    def table(self, name):
+        assert name == "messages"
+        return self
+
+    def insert(self, rows):
+        self.rows = rows
+        return self
+
+    async def execute(self):
+        if self.unavailable:
+            self.unavailable -= 1
+            raise APIError({"message": "Database client error. Retrying the connection.", "code": "PGRST000"})
+        if any(row["user_input"] in self.reject for row in self.rows):
+            raise APIError({"message": "violates foreign key constraint", "code": "23503"})
+        self.batches.append([row["user_input"] for row in self.rows])
+        data = []
+        for row in self.rows:
+            data.append(dict(row, id=self.next_id))
+            self.next_id += 1
+        return SimpleNamespace(data=data)
+
+def message(conversation_id: str, text: str):
+    row = {"conversation_id": conversation_id, "user_id": "u1", "user_input": text, "bot_response": {"content": "ok"}}
+    return row, {"id": None, "user_input": text, "bot_response": row["bot_response"]}
+
+def test_rows_are_batched_and_turns_get_ids_once_written():
+    db = FakeMessages()
+    writer = MessageWriter(db, batch_size=3, flush_interval=0.05, spool_path="")
+
+    async def run():
+        await writer.start()
+        turns = []
+        for i in range(4):
+            row, turn = message("c1", f"m{i}")
+            turns.append(turn)
+            await writer.submit(row, turn)
+        assert [turn["user_input"] for turn in writer.pending_turns("c1")] == ["m0", "m1", "m2", "m3"]
+        await writer.drain()
+        await writer.stop()
+        return turns
+
+    turns = asyncio.run(run())
+    assert db.batches == [["m0", "m1", "m2"], ["m3"]]
+    assert [turn["id"] for turn in turns] == [1, 2, 3, 4]
+    assert writer.pending_turns("c1") == [] and len(writer) == 0
+
+def test_rejected_row_is_dropped_without_blocking_its_batch():
+    db = FakeMessages(reject={"bad"})
+    writer = MessageWriter(db, batch_size=10, flush_interval=0.01, spool_path="")
+
+    async def run():
+        await writer.start()
+        for text in ("a", "bad", "b"):
+            await writer.submit(*message("c1", text))
+        await writer.drain()
+        await writer.stop()
+
+    asyncio.run(run())
+    assert db.batches == [["a"], ["b"]]
+
+def test_a_rejected_row_is_logged_without_its_text(caplog):
+    class CheckViolation(FakeMessages):
+        async def execute(self):
+            raise APIError({
+                "message": 'new row for relation "messages" violates check constraint "messages_user_input_check"',
+                "code": "23514", "details": f"Failing row contains (7, c1, u1, {self.rows[0]['user_input']}, null).", "hint": None
+            })
+
+    writer = MessageWriter(CheckViolation(), flush_interval=0.01, spool_path="")
+
+    async def run():
+        await writer.start()
+        await writer.submit(*message("c1", "I want to hurt myself"))
+        await writer.drain()
+        await writer.stop()
+
+    with caplog.at_level(logging.ERROR, logger="services.message_writer"):
+        asyncio.run(run())
+    assert "23514" in caplog.text and "hurt myself" not in caplog.text
+
+def test_rows_are_retried_while_the_database_is_unavailable():
+    db = FakeMessages(unavailable=3)
+    writer = MessageWriter(db, batch_size=10, flush_interval=0.01, spool_path="")
+
+    async def run():
+        await writer.start()
+        turns = []
+        for text in ("a", "b"):
+            row, turn = message("c1", text)
+            turns.append(turn)
+            await writer.submit(row, turn)
+        await writer.drain()
+        await writer.stop()
+        return turns
+
+    turns = asyncio.run(run())
+    assert db.batches == [["a", "b"]]
+    assert [turn["id"] for turn in turns] == [1, 2]
+
+def test_unacknowledged_spooled_rows_are_replayed(tmp_path):
+    spool = tmp_path / "messages.jsonl"
+    written, _ = message("c1", "written")
+    lost, _ = message("c1", "lost")
+    spool.write_text("\n".join([
+        json.dumps({"seq": 1, "row": written}),
+        json.dumps({"seq": 2, "row": lost}),
+        json.dumps({"ack": [1]}),
+        '{"seq": 3, "ro'
+    ]))
+    db = FakeMessages()
+    writer = MessageWriter(db, batch_size=10, flush_interval=0.01, spool_path=str(spool))
+
+    async def run():
+        await writer.start()
+        await writer.drain()
+        await writer.stop()
+
+    asyncio.run(run())
+    assert db.batches == [["lost"]]
+    assert spool.read_text() == ""
+
+def test_a_batch_finishing_during_fsync_keeps_the_new_row_spooled(tmp_path, monkeypatch):
+    spool = tmp_path / "messages.jsonl"
+    writer = MessageWriter(FakeMessages(), batch_size=1, flush_interval=0.01, spool_path=str(spool), fsync=True)
+    fsyncs = []
+
+    def slow_fsync(fd):
+        fsyncs.append(fd)
+        if len(fsyncs) == 2:
+            # The first row's batch is written and acknowledged meanwhile
+            time.sleep(0.2)
+
+    monkeypatch.setattr(message_writer_module.os, "fsync", slow_fsync)
+
+    async def run():
+        await writer.start()
+        await writer.submit(*message("c1", "m0"))
+        await writer.submit(*message("c1", "m1"))
+        spooled = writer._read_spool()
+        await writer.drain()
+        await writer.stop()
+        return spooled
+
+    assert [row["user_input"] for row in asyncio.run(run())] == ["m1"]
+    assert writer.db.batches == [["m0"], ["m1"]]
+
+def test_writer_survives_an_error_after_the_insert(monkeypatch):
+    async def broken_rollups(rows, db=None):
+        raise RuntimeError("rollups unavailable")
+
+    monkeypatch.setattr(message_writer_module, "add_mood_rollups", broken_rollups)
+    writer = MessageWriter(FakeMessages(), batch_size=1, flush_interval=0.01, spool_path="")
+
+    async def run():
+        await writer.start()
+        for text in ("a", "b"):
+            await writer.submit(*message("c1", text))
+            await writer.drain()
+        running = writer.running
+        await writer.stop()
+        return running
+
+    assert asyncio.run(run())
+    assert writer.db.batches == [["a"], ["b"]] and len(writer) == 0
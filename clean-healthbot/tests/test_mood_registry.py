@@ -0,0 +1,79 @@
+import asyncio
+import copy
+import pytest
+from core.config import fake_database
+from services import prompts
+from utils.mood_helpers import MoodDimensionRegistry
+
+class CountingRegistry(MoodDimensionRegistry):
+    def __init__(self, ttl: float = 3600):
+        super().__init__(ttl)
+        self.loads = 0
+
+    async def load(self) -> None:
+        self.loads += 1
+        await asyncio.sleep(0.01)
+        await super().load()
+
+@pytest.fixture
+def mood_dim():
+    saved = copy.deepcopy(fake_database.tables["mood_dim"])
+    yield fake_database.tables["mood_dim"]
+    fake_database.tables["mood_dim"] = saved
+
+def test_catalogue_is_served_from_cache_until_it_expires(mood_dim):
+    async def run():
+        registry = CountingRegistry(ttl=0.05)
+        await registry.refresh()
+        assert registry.loads == 1 and registry.version == 1 and "mood" in registry.names
+
+        mood_dim.append({"name": "Calm", "range": "0 to 10"})
+        await registry.refresh()
+        assert registry.loads == 1 and "calm" not in registry.names
+
+        await asyncio.sleep(0.06)
+        await registry.refresh()
+        assert registry.loads == 2 and registry.version == 2 and "calm" in registry.names
+
+    asyncio.run(run())
+
+def test_concurrent_refreshes_share_one_query(mood_dim):
+    async def run():
+        registry = CountingRegistry()
+        results = await asyncio.gather(*(registry.refresh() for _ in range(10)))
+        assert registry.loads == 1 and all(result is registry for result in results)
+
+    asyncio.run(run())
+
+def test_failed_refresh_keeps_the_previous_catalogue(mood_dim, monkeypatch):
+    async def run():
+        registry = CountingRegistry(ttl=0)
+        await registry.refresh()
+        names = registry.names
+
+        async def unavailable():
+            raise ConnectionError("database down")
+
+        monkeypatch.setattr(registry, "load", unavailable)
+        assert (await registry.refresh()).names == names and registry.version == 1
+
+        # Nothing to fall back on before the first load
+        empty = CountingRegistry()
+        monkeypatch.setattr(empty, "load", unavailable)
+        with pytest.raises(ConnectionError):
+            await empty.refresh()
+
+    asyncio.run(run())
+
+def test_system_prompt_is_rendered_once_per_version(mood_dim, monkeypatch):
+    async def run():
+        registry = CountingRegistry(ttl=0.05)
+        monkeypatch.setattr(prompts, "mood_registry", registry)
+        first = await prompts.get_system_prompt()
+        assert await prompts.get_system_prompt() is first
+
+        mood_dim.append({"name": "Calm", "range": "0 to 10"})
+        await asyncio.sleep(0.06)
+        assert "calm : float between 0 to 10" in await prompts.get_system_prompt()
+
+    asyncio.run(run())
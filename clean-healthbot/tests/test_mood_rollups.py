@@ -0,0 +1,77 @@
+import copy
+import logging
+from datetime import date
+import pytest
+from fastapi.testclient import TestClient
+import main
+from core.config import fake_database
+from scripts.backfill_mood_rollups import backfill
+from services import mood_rollups
+from services.mood_rollups import MoodRollup, add_mood_rollups, bucket_start
+
+def message(created_at: str, mood: float, stress: float = None):
+    moods = {"mood": mood, **({"stress": stress} if stress is not None else {})}
+    return {"user_id": "u1", "created_at": created_at, "bot_response": {"content": "ok", "mood_dimensions": moods}}
+
+def test_buckets_are_utc_days_and_iso_weeks():
+    assert bucket_start("2024-06-02T23:30:00-02:00", "day") == date(2024, 6, 3)
+    assert bucket_start("2024-06-09T12:00:00", "week") == date(2024, 6, 3)
+    assert bucket_start("2024-06-10T00:00:00+00:00", "week") == date(2024, 6, 10)
+
+def test_rollup_counts_only_numeric_values_per_bucket():
+    rows = MoodRollup().add([
+        message("2024-06-03T09:00:00", 1.0, stress=4.0),
+        message("2024-06-03T18:00:00", -2.0),
+        message("2024-06-05T09:00:00", 3.0),
+        {"user_id": "u1", "created_at": "2024-06-05T10:00:00", "bot_response": {"content": "no moods"}}
+    ]).rows()
+    by_key = {(row["period"], row["bucket_start"], row["dimension"]): row for row in rows}
+    assert by_key[("day", "2024-06-03", "mood")] == {
+        "user_id": "u1", "period": "day", "bucket_start": "2024-06-03", "dimension": "mood",
+        "count": 2, "sum": -1.0, "min": -2.0, "max": 1.0
+    }
+    assert by_key[("week", "2024-06-03", "mood")]["count"] == 3
+    assert by_key[("week", "2024-06-03", "stress")]["count"] == 1
+    assert len(rows) == 5
+
+@pytest.fixture(scope="module")
+def api():
+    with TestClient(main.app) as client:
+        yield client
+
+def test_timeline_is_kept_up_to_date_and_matches_a_backfill(api):
+    conversation_id = api.post("/conversations/", params={"user_id": "user-timeline"}, json={"first_message": "hello"}).json()["id"]
+    for text in ("rough day", "a bit better"):
+        api.post("/messages/", params={"user_id": "user-timeline"}, json={"conversation_id": conversation_id, "user_input": text})
+    api.portal.call(main.message_writer.drain)
+
+    timeline = api.get("/users/user-timeline/mood-timeline", params={"period": "week"}).json()
+    assert len(timeline["buckets"]) == 1
+    mood = timeline["buckets"][0]["dimensions"]["mood"]
+    assert mood["count"] == 3 and mood["min"] <= mood["mean"] <= mood["max"]
+
+    incremental = copy.deepcopy(fake_database.tables["mood_rollups"])
+    fake_database.tables["mood_rollups"] = []
+    result = api.portal.call(lambda: backfill(user_id="user-timeline"))
+    assert result["messages"] == 3
+    key = lambda row: (row["period"], row["bucket_start"], row["dimension"])
+    rebuilt = sorted(fake_database.tables["mood_rollups"], key=key)
+    expected = sorted((row for row in incremental if row["user_id"] == "user-timeline"), key=key)
+    assert [(key(row), row["count"], row["min"], row["max"]) for row in rebuilt] == \
+        [(key(row), row["count"], row["min"], row["max"]) for row in expected]
+    assert all(row["sum"] == pytest.approx(other["sum"]) for row, other in zip(rebuilt, expected))
+
+def test_timeline_rejects_inverted_or_oversized_ranges(api):
+    assert api.get("/users/u/mood-timeline", params={"start": "2024-02-01", "end": "2024-01-01"}).status_code == 400
+    assert api.get("/users/u/mood-timeline", params={"start": "2020-01-01", "end": "2024-01-01"}).status_code == 400
+
+def test_missing_migration_disables_updates_after_one_warning(api, monkeypatch, caplog):
+    monkeypatch.setattr(mood_rollups, "_schema_missing", False)
+    monkeypatch.delitem(fake_database.functions, "add_mood_rollups")
+    rows = [message("2024-06-03T09:00:00", 1.0)]
+    with caplog.at_level(logging.WARNING, logger="services.mood_rollups"):
+        api.portal.call(add_mood_rollups, rows)
+        requests = fake_database.requests
+        api.portal.call(add_mood_rollups, rows)
+    assert fake_database.requests == requests
+    assert [record.levelname for record in caplog.records] == ["WARNING"]
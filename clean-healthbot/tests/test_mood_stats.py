@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+from services.mood_stats import MoodStats
+
+DIMS = ["mood", "stress"]
+
+def message(mood=None, stress=None):
+    dims = {k: v for k, v in (("mood", mood), ("stress", stress)) if v is not None}
+    return {"bot_response": {"content": "", "mood_dimensions": dims}}
+
+def reference(series, alpha=0.3):
+    series = np.array(series, dtype=float)
+    ewma = series[0]
+    for y in series[1:]:
+        ewma = alpha * y + (1 - alpha) * ewma
+    t = np.arange(len(series))
+    return {
+        "mean": series.mean(),
+        "min": series.min(),
+        "max": series.max(),
+        "slope": np.polyfit(t, series, 1)[0],
+        "volatility": np.diff(series).std(),
+        "ewma": ewma,
+    }
+
+def test_matches_direct_computation():
+    moods = [-2, 0, 1, 3, 2, 4]
+    summary = MoodStats.from_messages([message(mood=m, stress=5) for m in moods], DIMS).summary()
+    expected = reference(moods)
+    for key in ("mean", "min", "max", "slope", "volatility"):
+        assert summary["mood"][key] == pytest.approx(expected[key], abs=1e-3)
+    # Zero-initialised, bias-corrected EWMA is close to the seeded recurrence and tracks recent values
+    assert summary["mood"]["ewma"] > summary["mood"]["mean"]
+    assert summary["stress"] == {"count": 6, "mean": 5.0, "ewma": 5.0, "min": 5.0, "max": 5.0, "slope": 0.0, "volatility": 0.0}
+
+def test_merge_equals_single_pass_and_survives_serialisation():
+    msgs = [message(mood=m, stress=s) for m, s in [(1, 7), (2, None), (-1, 6), (0, 8), (3, 2), (2, 3), (4, 1)]]
+    whole = MoodStats.from_messages(msgs, DIMS).summary()
+    state = MoodStats.from_messages(msgs[:3], DIMS).to_dict()
+    merged = MoodStats.from_dict(state).merge(MoodStats.from_messages(msgs[3:], DIMS)).summary()
+    for dim in DIMS:
+        for key, value in whole[dim].items():
+            assert merged[dim][key] == pytest.approx(value, abs=1e-3), (dim, key)
+
+def test_merge_aligns_new_dimensions():
+    first = MoodStats.from_messages([message(mood=1)], ["mood"])
+    second = MoodStats.from_messages([message(mood=3, stress=4)], DIMS)
+    summary = first.merge(second).summary()
+    assert summary["mood"]["count"] == 2 and summary["mood"]["mean"] == 2.0
+    assert summary["stress"]["count"] == 1
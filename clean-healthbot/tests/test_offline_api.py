@@ -0,0 +1,179 @@
+import asyncio
+import gzip
+import json
+from types import SimpleNamespace
+import httpx
+import openai
+import pytest
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+import main
+from core.config import fake_database
+from fakes.llm import FakeOpenAI
+from services.llm_gateway import LLMGateway, LLMUnavailable, deadline_after
+
+@pytest.fixture(scope="module")
+def api():
+    with TestClient(main.app) as client:
+        yield client
+
+def sse_events(body: str):
+    for frame in body.strip().split("\n\n"):
+        event, data = frame.split("\n", 1)
+        yield event[len("event: "):], json.loads(data[len("data: "):])
+
+def test_conversation_round_trip_against_fakes(api):
+    response = api.post("/conversations/", params={"user_id": "user-a"}, json={"first_message": "hello there"})
+    assert response.status_code == 200
+    conversation_id = response.json()["id"]
+
+    for i in range(3):
+        reply = api.post("/messages/", params={"user_id": "user-a"}, json={"conversation_id": conversation_id, "user_input": f"message {i}"})
+        assert reply.status_code == 200
+        assert reply.json()["content"] == f"I hear you. You said: message {i}"
+
+    streamed = api.post("/messages/", params={"user_id": "user-a", "stream": "true"}, json={"conversation_id": conversation_id, "user_input": "streamed"})
+    events = list(sse_events(streamed.text))
+    assert events[-1][0] == "done"
+    assert "".join(data["content"] for event, data in events if event == "delta") == "I hear you. You said: streamed"
+
+    forbidden = api.post("/messages/", params={"user_id": "user-b"}, json={"conversation_id": conversation_id, "user_input": "hi"})
+    assert forbidden.status_code == 403
+
+    # Saved messages are written behind the response; wait for the batch before reading the table
+    api.portal.call(main.message_writer.drain)
+    page = api.get(f"/conversations/{conversation_id}/messages", params={"user_id": "user-a", "limit": 3})
+    assert [msg["user_input"] for msg in page.json()] == ["hello there", "message 0", "message 1"]
+    assert page.headers["X-Next-Cursor"]
+
+    analysis = api.post(f"/conversations/{conversation_id}/analyze", params={"user_id": "user-a"})
+    assert analysis.status_code == 200
+    assert "summary" in analysis.json()["scores"]
+
+def test_fake_database_paginates_with_keyset_cursors(api):
+    for i in range(5):
+        response = api.post("/conversations/", params={"user_id": "user-pages"}, json={"first_message": f"hi {i}"})
+        assert response.status_code == 200
+    seen, cursor = [], None
+    while True:
+        params = {"user_id": "user-pages", "limit": 2, **({"cursor": cursor} if cursor else {})}
+        page = api.get("/conversations/", params=params)
+        seen += [conv["id"] for conv in page.json()]
+        cursor = page.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    stored = [row for row in fake_database.tables["conversations"] if row["user_id"] == "user-pages"]
+    assert sorted(seen) == sorted(row["id"] for row in stored) and len(seen) == 5
+
+def test_fake_openai_failure_injection_trips_the_gateway():
+    transport = FakeOpenAI(failure_rate=1.0, failure_status=503, seed=1)
+    llm_client = openai.AsyncOpenAI(api_key="fake", max_retries=0, http_client=httpx.AsyncClient(transport=transport))
+    gateway = LLMGateway(llm_client, max_retries=1)
+
+    async def run():
+        with pytest.raises(LLMUnavailable):
+            await gateway.complete("free", deadline_after(5), model="gpt-4o-mini", messages=[{"role": "user", "content": "hi"}])
+
+    asyncio.run(run())
+    assert transport.requests == 2
+
+def test_metrics_break_a_turn_down_by_stage(api):
+    conversation_id = api.post("/conversations/", params={"user_id": "user-metrics", "is_paid": "true"}, json={"first_message": "hello"}).json()["id"]
+    api.post("/messages/", params={"user_id": "user-metrics", "is_paid": "true"}, json={"conversation_id": conversation_id, "user_input": "timed"})
+    api.portal.call(main.message_writer.drain)
+
+    assert api.get("/metrics").status_code == 200
+    sample = REGISTRY.get_sample_value
+    for stage in ("rate_limit", "history", "ownership", "prompt_build", "llm_total", "parse", "db_insert"):
+        assert sample("request_stage_duration_seconds_count", {"stage": stage, "endpoint": "POST /messages/", "tier": "paid"}) >= 1
+    assert sample("request_stage_duration_seconds_count", {"stage": "db_batch_insert", "endpoint": "background", "tier": "background"}) >= 1
+    assert sample("http_request_duration_seconds_count", {"endpoint": "POST /messages/", "method": "POST", "status": "200", "tier": "paid"}) >= 1
+    assert sample("llm_tokens_total", {"tier": "paid", "kind": "completion"}) > 0
+
+def test_export_streams_the_full_history_as_ndjson(api, monkeypatch):
+    monkeypatch.setattr("services.export.EXPORT_CONVERSATION_PAGE_SIZE", 2)
+    monkeypatch.setattr("services.export.SUPABASE_MAX_ROWS", 2)
+    conversation_ids = []
+    for i in range(3):
+        conversation_ids.append(api.post("/conversations/", params={"user_id": "user-export"}, json={"first_message": f"hi {i}"}).json()["id"])
+        api.post("/messages/", params={"user_id": "user-export"}, json={"conversation_id": conversation_ids[-1], "user_input": f"more {i}"})
+    api.portal.call(main.message_writer.drain)
+
+    plain = api.get("/users/user-export/export")
+    assert plain.headers["content-type"] == "application/x-ndjson"
+    records = [json.loads(line) for line in plain.text.splitlines()]
+    assert records[0]["type"] == "export" and records[-1] == {"type": "end", "conversations": 3, "messages": 6}
+    assert [r["id"] for r in records if r["type"] == "conversation"] == conversation_ids
+    messages = [r for r in records if r["type"] == "message"]
+    assert sorted(msg["user_input"] for msg in messages if msg["conversation_id"] == conversation_ids[2]) == ["hi 2", "more 2"]
+
+    compressed = api.get("/users/user-export/export", params={"gzip": "true"})
+    assert compressed.headers["content-disposition"] == 'attachment; filename="user-export-export.ndjson.gz"'
+    lines = gzip.decompress(compressed.content).decode().splitlines()
+    assert [json.loads(line) for line in lines][1:] == records[1:]
+
+def test_history_trimmed_to_the_limit_is_not_cached_as_complete(monkeypatch):
+    from services import conversation_service
+    queued = [{"id": None, "user_input": f"queued {i}", "bot_response": {"content": "ok"}} for i in range(2)]
+    monkeypatch.setattr(conversation_service, "message_writer", SimpleNamespace(pending_turns=lambda conversation_id: queued))
+
+    async def run():
+        conv = fake_database.insert("conversations", {"user_id": "user-trim"})
+        for text in ("one", "two"):
+            fake_database.insert("messages", {"conversation_id": conv["id"], "user_id": "user-trim", "user_input": text})
+        # Two stored rows (fewer than the limit) plus two queued turns, trimmed back to three
+        history = await conversation_service.get_conversation_history(conv["id"], limit=3)
+        assert [turn["user_input"] for turn in history] == ["two", "queued 0", "queued 1"]
+        assert conversation_service.history_cache.get(conv["id"], 4) is None
+
+    asyncio.run(run())
+
+def test_abandoned_conversation_streams_leave_no_record(api):
+    from fastapi import Response
+    from api.conversations import create_conversation
+    from models.conversation import ConversationCreate
+    request = ConversationCreate(first_message="hello")
+
+    def rows():
+        return [conv for conv in fake_database.tables["conversations"] if conv["user_id"] == "user-abandon"]
+
+    async def never_read():
+        await create_conversation(request, "user-abandon", Response(), stream=True, idempotency_key=None)
+        # Time for an insert started outside the body to land
+        await asyncio.sleep(0.05)
+
+    async def left_mid_stream():
+        response = await create_conversation(request, "user-abandon", Response(), stream=True, idempotency_key=None)
+        events = response.body_iterator
+        assert (await events.__anext__()).startswith("event: conversation")
+        assert len(rows()) == 1
+        await events.aclose()
+
+    api.portal.call(never_read)
+    assert rows() == []
+    api.portal.call(left_mid_stream)
+    assert rows() == []
+
+def test_incremental_analysis_covers_a_backlog_in_batches(api, monkeypatch):
+    from services import openai_service
+    conv = fake_database.insert("conversations", {"user_id": "user-backlog"})
+    ids = [
+        fake_database.insert("messages", {
+            "conversation_id": conv["id"], "user_id": "user-backlog", "user_input": f"turn {i}",
+            "bot_response": {"content": "ok", "mood_dimensions": {"mood": 1}}
+        })["id"]
+        for i in range(120)
+    ]
+    conv["conversation_scores"] = {"summary": "earlier", "analysis_state": {"last_message_id": ids[9], "message_count": 10}}
+    batches = []
+    summarize = openai_service.summarize_conversation
+
+    async def counting_summarize(conversation_text, previous=None):
+        batches.append(conversation_text.count("User: "))
+        return await summarize(conversation_text, previous)
+
+    monkeypatch.setattr(openai_service, "summarize_conversation", counting_summarize)
+    scores = api.portal.call(openai_service.analyze_conversation_scores, conv["id"])
+    assert batches == [50, 50, 10]
+    assert scores["analysis_state"]["last_message_id"] == ids[-1]
+    assert scores["mood_statistics"]["mood"]["count"] == 110
@@ -0,0 +1,55 @@
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+import main
+from core.config import fake_database
+from utils.pagination import decode_cursor, encode_cursor
+
+USER = "user-cursor"
+SAME_TIME = "2024-06-01T12:00:00+00:00"
+
+@pytest.fixture(scope="module")
+def api():
+    with TestClient(main.app) as client:
+        yield client
+
+@pytest.fixture(scope="module")
+def conversation_ids():
+    # Equal timestamps, so only the id tie-break orders them
+    ids = [fake_database.insert("conversations", {"user_id": USER, "created_at": SAME_TIME})["id"] for _ in range(5)]
+    for text in ("a", "b", "c", "d", "e"):
+        fake_database.insert("messages", {"conversation_id": ids[0], "user_id": USER, "user_input": text, "created_at": SAME_TIME})
+    return ids
+
+def pages(api, path: str, params: dict):
+    cursor, result = None, []
+    while True:
+        response = api.get(path, params={**params, **({"cursor": cursor} if cursor else {})})
+        assert response.status_code == 200
+        result.append(response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            return result
+
+def test_cursor_round_trips():
+    cursor = encode_cursor({"created_at": SAME_TIME, "id": "abc", "title": "ignored"})
+    assert decode_cursor(cursor) == (SAME_TIME, "abc")
+    with pytest.raises(HTTPException) as error:
+        decode_cursor("not a cursor")
+    assert error.value.status_code == 400
+
+def test_rows_with_equal_timestamps_are_paged_by_id_without_gaps(api, conversation_ids):
+    conversations = pages(api, "/conversations/", {"user_id": USER, "limit": 2})
+    assert [len(page) for page in conversations] == [2, 2, 1]
+    assert [conv["id"] for page in conversations for conv in page] == sorted(conversation_ids, reverse=True)
+
+    messages = pages(api, f"/conversations/{conversation_ids[0]}/messages", {"user_id": USER, "limit": 2})
+    assert [msg["user_input"] for page in messages for msg in page] == ["a", "b", "c", "d", "e"]
+
+def test_bad_cursor_is_a_400(api, conversation_ids):
+    response = api.get("/conversations/", params={"user_id": USER, "cursor": "%%%"})
+    assert response.status_code == 400 and response.json()["detail"] == "Invalid cursor"
+
+def test_browsers_can_read_the_cursor_header(api, conversation_ids):
+    response = api.get("/conversations/", params={"user_id": USER, "limit": 2}, headers={"Origin": "https://app.example"})
+    assert "x-next-cursor" in response.headers["access-control-expose-headers"].lower()
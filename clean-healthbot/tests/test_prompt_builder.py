@@ -0,0 +1,36 @@
+import asyncio
+import pytest
+from services import prompt_builder
+from services.prompt_builder import build_chat_messages, count_message_tokens
+
+@pytest.fixture(autouse=True)
+def fixed_system_prompt(monkeypatch):
+    async def get_system_prompt():
+        return "system prompt"
+    monkeypatch.setattr(prompt_builder, "get_system_prompt", get_system_prompt)
+
+def turn(i):
+    return {
+        "user_input": f"user message {i} " + "words " * 40,
+        "bot_response": {"content": f"reply {i} " + "words " * 40, "mood_dimensions": {"mood": 1, "stress": 2}}
+    }
+
+def test_history_is_filled_newest_first_within_budget(monkeypatch):
+    monkeypatch.setattr(prompt_builder, "PROMPT_TOKEN_BUDGET_FREE", 500)
+    history = [turn(i) for i in range(15)]
+    messages, used = asyncio.run(build_chat_messages("hello", history, is_paid=False))
+    assert used <= 500
+    assert used == sum(count_message_tokens(m) for m in messages)
+    history_messages = messages[1:-2]
+    assert history_messages[-2]["content"].startswith("user message 14")
+    assert 0 < len(history_messages) < 30
+    assert messages[-2] == {"role": "user", "content": "hello"}
+
+def test_paid_tier_gets_more_context_and_old_turns_lose_mood_annotations():
+    history = [turn(i) for i in range(15)]
+    free, _ = asyncio.run(build_chat_messages("hello", history, is_paid=False))
+    paid, _ = asyncio.run(build_chat_messages("hello", history, is_paid=True))
+    assert len(paid) > len(free)
+    annotated = [m for m in paid if m["role"] == "assistant" and "Mood Dimensions" in m["content"]]
+    assert len(annotated) == prompt_builder.ANNOTATED_HISTORY_TURNS
+    assert annotated[-1]["content"].endswith('{"mood":1,"stress":2}')
@@ -0,0 +1,65 @@
+import asyncio
+import logging
+import time
+import pytest
+from fastapi import HTTPException
+from utils import rate_limiter
+from utils.rate_limiter import InMemoryRateLimiter
+
+@pytest.fixture
+def limiter(monkeypatch):
+    seeded = {"u-seeded": [time.time() - 4000, time.time() - 10, time.time() - 5]}
+    queries = []
+
+    async def fake_load(user_id):
+        queries.append(user_id)
+        return [ts for ts in seeded.get(user_id, []) if ts > time.time() - 3600]
+
+    monkeypatch.setattr(rate_limiter, "load_recent_message_times", fake_load)
+    limiter = InMemoryRateLimiter(max_users=2)
+    monkeypatch.setattr(rate_limiter, "rate_limiter", limiter)
+    limiter.queries = queries
+    return limiter
+
+def test_seeds_once_then_counts_in_memory(limiter):
+    async def run():
+        assert await rate_limiter.check_rate_limit("u-seeded") == 18
+        await rate_limiter.record_message("u-seeded")
+        assert await rate_limiter.check_rate_limit("u-seeded") == 17
+        assert await rate_limiter.check_rate_limit("u-seeded", is_paid=True) == 47
+    asyncio.run(run())
+    assert limiter.queries == ["u-seeded"]
+
+def test_unseeded_record_is_left_to_the_database(limiter):
+    async def run():
+        await rate_limiter.record_message("u-new")
+        assert await rate_limiter.check_rate_limit("u-new") == 20
+    asyncio.run(run())
+
+def test_raises_429_at_limit(limiter):
+    async def run():
+        await rate_limiter.check_rate_limit("u-busy")
+        for _ in range(20):
+            await rate_limiter.record_message("u-busy")
+        with pytest.raises(HTTPException) as exc:
+            await rate_limiter.check_rate_limit("u-busy")
+        assert exc.value.status_code == 429
+        assert await rate_limiter.check_rate_limit("u-busy", is_paid=True) == 30
+    asyncio.run(run())
+
+def test_old_events_slide_out_and_users_are_bounded(limiter):
+    async def run():
+        await limiter.count("a")
+        limiter._windows["a"].append(time.time() - 3601)
+        assert await limiter.count("a") == 0
+        await limiter.count("b")
+        await limiter.count("c")
+        assert list(limiter._windows) == ["b", "c"]
+    asyncio.run(run())
+
+def test_memory_backend_warns_when_several_workers_run(caplog):
+    with caplog.at_level(logging.WARNING, logger="utils.rate_limiter"):
+        assert not rate_limiter.warn_if_per_worker("memory", 1)
+        assert not rate_limiter.warn_if_per_worker("redis", 4)
+        assert rate_limiter.warn_if_per_worker("memory", 4)
+    assert len(caplog.records) == 1 and "WEB_CONCURRENCY=4" in caplog.records[0].getMessage()
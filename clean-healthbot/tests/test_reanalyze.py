@@ -0,0 +1,72 @@
+import json
+import pytest
+from fastapi.testclient import TestClient
+import main
+from core.config import fake_database
+from scripts.reanalyze_conversations import Pacer, Reanalysis
+
+USER = "user-reanalysis"
+
+@pytest.fixture(scope="module")
+def api():
+    with TestClient(main.app) as client:
+        yield client
+
+@pytest.fixture
+def conversations():
+    ids = []
+    for i in range(5):
+        conv = fake_database.insert("conversations", {
+            "user_id": USER, "created_at": f"2024-06-0{i + 1}T12:00:00", "conversation_scores": {"summary": "stale"}
+        })
+        ids.append(conv["id"])
+        if i == 4:
+            continue
+        for mood in (-2, 3):
+            fake_database.insert("messages", {
+                "conversation_id": conv["id"], "user_id": USER, "user_input": f"feeling overwhelmed today {i}",
+                "bot_response": {"content": "I hear you", "mood_dimensions": {"mood": mood}}
+            })
+    yield ids
+    fake_database.tables["messages"] = [msg for msg in fake_database.tables["messages"] if msg["conversation_id"] not in ids]
+    fake_database.tables["conversations"] = [conv for conv in fake_database.tables["conversations"] if conv["id"] not in ids]
+
+def scores(conversation_id: str) -> dict:
+    return next(conv for conv in fake_database.tables["conversations"] if conv["id"] == conversation_id)["conversation_scores"]
+
+def test_rescoring_resumes_from_the_checkpoint(api, conversations, tmp_path):
+    checkpoint = str(tmp_path / "checkpoint.json")
+    first = Reanalysis(rps=1000, page_size=2, user_id=USER, limit=3, checkpoint_path=checkpoint)
+    api.portal.call(first.run)
+    assert first.state["analyzed"] == 3
+    assert scores(conversations[3]) == {"summary": "stale"}
+
+    # Stopped mid-page: the cursor points at the third conversation
+    assert not first.state["done"] and json.load(open(checkpoint))["analyzed"] == 3
+    second = Reanalysis(rps=1000, page_size=2, user_id=USER, checkpoint_path=checkpoint)
+    second.load_checkpoint()
+    api.portal.call(second.run)
+
+    assert second.state["analyzed"] == 4 and second.state["empty"] == 1 and not second.state["failed"]
+    assert second.state["prompt_tokens"] > 0
+    for conversation_id in conversations[:4]:
+        result = scores(conversation_id)
+        assert result["summary"].startswith("The user talked about")
+        assert result["average_mood_scores"]["mood"] == pytest.approx(0.5)
+        assert result["analysis_state"]["message_count"] == 2
+    assert scores(conversations[4]) == {"summary": "stale"}
+
+def test_dry_run_writes_nothing(api, conversations):
+    job = Reanalysis(rps=1000, user_id=USER, dry_run=True)
+    api.portal.call(job.run)
+    assert job.state["analyzed"] == 4
+    assert all(scores(conversation_id) == {"summary": "stale"} for conversation_id in conversations)
+
+def test_pacer_halves_on_pushback_and_recovers():
+    pacer = Pacer(8)
+    pacer.slow_down()
+    pacer.slow_down()
+    assert pacer.rate == 2
+    for _ in range(20):
+        pacer.speed_up()
+    assert pacer.rate == 8
@@ -0,0 +1,48 @@
+import asyncio
+from services.response_cache import FirstReplyCache, normalize_message
+from models.mood import BotResponse, MoodDimensions
+
+def reply(content: str) -> BotResponse:
+    return BotResponse(content=content, mood_dimensions=MoodDimensions(
+        mood=1, stress=2, anxiety=2, energy=5, motivation=5, loneliness=3, confidence=5, hope=6
+    ))
+
+def test_key_normalises_input_and_includes_version():
+    cache = FirstReplyCache(max_chars=20)
+    assert normalize_message("  Hi!!  THERE ") == "hi there"
+    assert cache.key("Hi!!", "v1") == cache.key("hi", "v1")
+    assert cache.key("hi", "v1") != cache.key("hi", "v2")
+    assert cache.key("?!", "v1") is None
+    assert cache.key("this opener is far too long to cache", "v1") is None
+
+def test_lru_eviction_ttl_and_hit_limit():
+    cache = FirstReplyCache(max_entries=2, max_hits=2)
+    cache.put("a", reply("a"))
+    cache.put("b", reply("b"))
+    cache.get("a")
+    cache.put("c", reply("c"))
+    assert cache.get("b") is None and len(cache) == 2
+    assert cache.get("a").content == "a"
+    assert cache.get("a") is None
+
+    expired = FirstReplyCache(ttl=-1)
+    expired.put("a", reply("a"))
+    assert expired.get("a") is None
+
+def test_concurrent_misses_share_one_call_and_fallbacks_are_not_cached():
+    cache = FirstReplyCache()
+    calls = []
+
+    async def create():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return reply("fresh")
+
+    async def run():
+        results = await asyncio.gather(*(cache.get_or_create("k", create) for _ in range(5)))
+        assert {r.content for r in results} == {"fresh"}
+        await cache.get_or_create("skip", create, cacheable=lambda r: False)
+
+    asyncio.run(run())
+    assert len(calls) == 2
+    assert cache.get("k") is not None and cache.get("skip") is None
@@ -0,0 +1,34 @@
+import os
+import subprocess
+import sys
+import time
+from fastapi.testclient import TestClient
+import main
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Seconds allowed for `import main` in a fresh interpreter; workers pay this on every (auto)scale-up
+IMPORT_BUDGET_SECONDS = float(os.getenv("IMPORT_BUDGET_SECONDS", "3"))
+
+def test_importing_the_app_is_cheap_and_creates_no_clients():
+    code = (
+        "import time; start = time.perf_counter(); import main; elapsed = time.perf_counter() - start; "
+        "import core.config as config; print(elapsed, config._supabase is None and config._openai_client is None)"
+    )
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    elapsed, no_clients = result.stdout.split()
+    assert no_clients == "True"
+    assert float(elapsed) < IMPORT_BUDGET_SECONDS
+
+def test_ready_once_warmup_has_finished():
+    with TestClient(main.app) as api:
+        deadline = time.monotonic() + 10
+        response = api.get("/ready")
+        while response.status_code == 503 and time.monotonic() < deadline:
+            time.sleep(0.05)
+            response = api.get("/ready")
+        assert response.status_code == 200
+        status = response.json()
+        assert status["ready"] is True
+        assert status["warmup"]["supabase"]["ok"] and status["warmup"]["openai"]["ok"]
+        assert status["warmup"]["mood_dimensions"]["ok"]
+    assert not main.warmup.ready
@@ -0,0 +1,37 @@
+import json
+from utils.streaming import ContentStreamParser, sse_event
+
+ENVELOPE = {
+    "content": "**Hello!** \"Quoted\" line\nnext é \U0001F600 done",
+    "mood_dimensions": {"mood": 4, "stress": 1, "anxiety": 1, "energy": 6,
+                        "motivation": 7, "loneliness": 1, "confidence": 5, "hope": 7}
+}
+
+def feed_in_chunks(raw, size):
+    parser = ContentStreamParser()
+    deltas = [parser.feed(raw[i:i + size]) for i in range(0, len(raw), size)]
+    return parser, "".join(deltas)
+
+def test_content_is_decoded_incrementally_for_any_chunking():
+    for ensure_ascii in (True, False):
+        raw = "Sure! " + json.dumps(ENVELOPE, ensure_ascii=ensure_ascii)
+        for size in (1, 2, 3, 7, len(raw)):
+            parser, streamed = feed_in_chunks(raw, size)
+            assert streamed == ENVELOPE["content"]
+            assert parser.done
+            assert parser.raw == raw
+
+def test_content_after_other_keys():
+    raw = json.dumps({"mood_dimensions": {"mood": 1}, "content": "late"})
+    parser, streamed = feed_in_chunks(raw, 4)
+    assert streamed == "late"
+
+def test_nothing_emitted_before_value_starts():
+    parser = ContentStreamParser()
+    assert parser.feed('{"conte') == ""
+    assert parser.feed('nt": ') == ""
+    assert parser.feed('"Hi') == "Hi"
+    assert not parser.done
+
+def test_sse_event_format():
+    assert sse_event("delta", {"content": "a\nb"}) == 'event: delta\ndata: {"content": "a\\nb"}\n\n'
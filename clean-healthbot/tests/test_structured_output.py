@@ -0,0 +1,73 @@
+import asyncio
+import json
+from types import SimpleNamespace
+import pytest
+from core.metrics import CHAT_FALLBACKS, CHAT_PARSE_FAILURES
+from services import openai_service
+from services.openai_service import BOT_RESPONSE_SCHEMA, parse_bot_response
+
+VALID = json.dumps({
+    "content": "That sounds hard.",
+    "mood_dimensions": {
+        "mood": -1, "stress": 7, "anxiety": 6, "energy": 3,
+        "motivation": 4, "loneliness": 5, "confidence": 4, "hope": 5
+    }
+})
+
+class FakeCompletions:
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.calls = []
+
+    async def create(self, **kwargs):
+        self.calls.append(kwargs)
+        content = self.replies.pop(0)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+@pytest.fixture
+def completions(monkeypatch):
+    async def build_chat_messages(user_input, history, is_paid):
+        return [{"role": "system", "content": "s"}, {"role": "user", "content": user_input}, {"role": "system", "content": "r"}], 10
+
+    def install(*replies):
+        fake = FakeCompletions(replies)
+        monkeypatch.setattr(openai_service.llm_gateway, "client", SimpleNamespace(chat=SimpleNamespace(completions=fake)))
+        return fake
+
+    monkeypatch.setattr(openai_service, "build_chat_messages", build_chat_messages)
+    return install
+
+def sample(counter, **labels):
+    return counter.labels(**labels)._value.get()
+
+def test_schema_is_strict_and_inlined():
+    assert BOT_RESPONSE_SCHEMA["additionalProperties"] is False
+    assert BOT_RESPONSE_SCHEMA["required"] == ["content", "mood_dimensions"]
+    mood = BOT_RESPONSE_SCHEMA["properties"]["mood_dimensions"]
+    assert mood["additionalProperties"] is False
+    assert set(mood["required"]) == set(mood["properties"]) >= {"mood", "stress", "hope"}
+    assert "$defs" not in json.dumps(BOT_RESPONSE_SCHEMA)
+
+def test_parse_repairs_fences_and_rejects_incomplete_replies():
+    assert parse_bot_response("```json\n" + VALID + "\n```").content == "That sounds hard."
+    with pytest.raises(ValueError):
+        parse_bot_response('{"content": "hi"}')
+
+def test_invalid_reply_is_sent_back_for_correction(completions):
+    fake = completions('{"content": "missing moods"}', VALID)
+    before = sample(CHAT_PARSE_FAILURES, mode=openai_service.CHAT_RESPONSE_FORMAT, attempt="initial")
+    response = asyncio.run(openai_service.get_mental_health_response("hi"))
+    assert response.content == "That sounds hard."
+    assert len(fake.calls) == 2
+    assert fake.calls[0]["response_format"]["type"] == openai_service.CHAT_RESPONSE_FORMAT
+    assert fake.calls[1]["messages"][-2] == {"role": "assistant", "content": '{"content": "missing moods"}'}
+    assert sample(CHAT_PARSE_FAILURES, mode=openai_service.CHAT_RESPONSE_FORMAT, attempt="initial") == before + 1
+
+def test_retries_are_bounded_then_fall_back(completions, monkeypatch):
+    monkeypatch.setattr(openai_service, "CHAT_PARSE_RETRIES", 1)
+    fake = completions("not json", "still not json", VALID)
+    before = sample(CHAT_FALLBACKS, reason="parse")
+    response = asyncio.run(openai_service.get_mental_health_response("hi"))
+    assert response == openai_service.fallback_bot_response()
+    assert len(fake.calls) == 2
+    assert sample(CHAT_FALLBACKS, reason="parse") == before + 1
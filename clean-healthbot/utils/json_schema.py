@@ -0,0 +1,23 @@
+from typing import Type
+from pydantic import BaseModel
+
+def _strict(node, defs: dict):
+    if isinstance(node, list):
+        return [_strict(item, defs) for item in node]
+    if not isinstance(node, dict):
+        return node
+    if "$ref" in node:
+        return _strict(defs[node["$ref"].split("/")[-1]], defs)
+    node = {key: _strict(value, defs) for key, value in node.items() if key not in ("title", "$defs")}
+    if node.get("type") == "object" and "properties" in node:
+        node["required"] = list(node["properties"])
+        node["additionalProperties"] = False
+    return node
+
+def strict_json_schema(model: Type[BaseModel]) -> dict:
+    """
+    JSON schema for `model` in the form OpenAI's strict structured outputs accept:
+    references inlined, every property required and no additional properties.
+    """
+    schema = model.model_json_schema()
+    return _strict(schema, schema.get("$defs", {}))
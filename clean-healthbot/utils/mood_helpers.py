@@ -1,12 +1,74 @@
-from core.config import supabase
-
-def get_mood_dimensions() -> str :
-    response = supabase.table("mood_dim") \
-    .select("name,range").execute()
-    mood_dimensions = response.data
-    res = ""
-    for dimension in mood_dimensions:
-       res+=dimension["name"].lower()+" : float between "+str(dimension["range"])+","
-    
-    res = res[:-1]
-    return res 
\ No newline at end of file
+import asyncio
+import logging
+import os
+import time
+from typing import List
+from core.config import get_supabase
+from core.logging import describe_error
+
+logger = logging.getLogger(__name__)
+
+MOOD_DIMENSIONS_TTL = float(os.getenv("MOOD_DIMENSIONS_TTL", "3600"))
+
+def format_mood_dimensions(mood_dimensions: List[dict]) -> str:
+    """Render mood_dim rows as "name : float between range" for the system prompt"""
+    return ",".join(
+        dimension["name"].lower() + " : float between " + str(dimension["range"])
+        for dimension in mood_dimensions
+    )
+
+class MoodDimensionRegistry:
+    """
+    Cached copy of the mood_dim catalogue.
+    - Loaded once at startup and refreshed after `ttl` seconds; nothing in the app edits mood_dim, so edits
+      made directly in the database show up within MOOD_DIMENSIONS_TTL (restart to apply them at once).
+    - `version` changes on every reload so derived values (the system prompt) can be re-rendered.
+    """
+
+    def __init__(self, ttl: float = MOOD_DIMENSIONS_TTL):
+        self.ttl = ttl
+        self.rows: List[dict] = []
+        self.version = 0
+        self._loaded_at = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def is_stale(self) -> bool:
+        return self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl
+
+    @property
+    def names(self) -> List[str]:
+        return [dimension["name"].lower() for dimension in self.rows]
+
+    @property
+    def described(self) -> str:
+        return format_mood_dimensions(self.rows)
+
+    async def load(self) -> None:
+        response = await get_supabase().table("mood_dim") \
+            .select("name,range").execute()
+        self.rows = response.data
+        self.version += 1
+        self._loaded_at = time.monotonic()
+
+    async def refresh(self) -> "MoodDimensionRegistry":
+        """Reload if stale; concurrent callers share a single query"""
+        if not self.is_stale:
+            return self
+        async with self._lock:
+            if not self.is_stale:
+                return self
+            try:
+                await self.load()
+            except Exception as e:
+                if not self.rows:
+                    raise
+                # Keep serving the previous catalogue until the next retry
+                logger.error("Error refreshing mood dimensions: %s", describe_error(e))
+                self._loaded_at = time.monotonic()
+        return self
+
+mood_registry = MoodDimensionRegistry()
+
+async def get_mood_dimensions() -> str :
+    return (await mood_registry.refresh()).described
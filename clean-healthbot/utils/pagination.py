@@ -0,0 +1,60 @@
+import base64
+import json
+from typing import List, Optional, Tuple
+from fastapi import HTTPException
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+# Supabase caps the rows returned by one request at 1000; batch readers page in steps of this size
+SUPABASE_MAX_ROWS = 1000
+
+def encode_cursor(row: dict) -> str:
+    """Opaque cursor pointing just past `row` in (created_at, id) order"""
+    raw = json.dumps([row["created_at"], row["id"]]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded))
+        return str(created_at), str(row_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def parse_fields(fields: Optional[str], allowed: List[str], required: List[str]) -> List[str]:
+    """Columns to select: the requested projection plus the keyset columns"""
+    if not fields:
+        return list(allowed)
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in requested if field not in allowed]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return list(dict.fromkeys(required + requested))
+
+def _quote(value: str) -> str:
+    # Timestamps contain characters reserved by PostgREST's logical filter syntax
+    return '"' + value.replace('"', '\\"') + '"'
+
+def keyset_page(query, cursor: Optional[str], limit: int, desc: bool = False):
+    """
+    Apply keyset pagination on (created_at, id) to a PostgREST select.
+    - Rows strictly after the cursor in the requested direction, ordered by created_at then id.
+    - Fetches one extra row so the caller can tell whether another page exists.
+    """
+    direction = "desc" if desc else "asc"
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        op = "lt" if desc else "gt"
+        query.params = query.params.add(
+            "or",
+            f"(created_at.{op}.{_quote(created_at)},and(created_at.eq.{_quote(created_at)},id.{op}.{_quote(row_id)}))"
+        )
+    query.params = query.params.add("order", f"created_at.{direction},id.{direction}")
+    return query.limit(limit + 1)
+
+def split_page(rows: List[dict], limit: int) -> Tuple[List[dict], Optional[str]]:
+    """Trim the look-ahead row and return (page, next_cursor)"""
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1])
+    return rows, None
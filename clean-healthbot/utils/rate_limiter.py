@@ -1,28 +1,158 @@
-from datetime import datetime, timedelta
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta, timezone
+from typing import List
 from fastapi import HTTPException
-from core.config import supabase
+from core.config import get_supabase
+from core.logging import describe_error
+from core.metrics import RATE_LIMITED
 
-# Rate limiting helper
-async def check_rate_limit(user_id: str, is_paid: bool = False):
-    one_hour_ago = datetime.utcnow() - timedelta(hours=1)
-    
-    # Query messages in the last hour
-    response = supabase.table("messages") \
-        .select("id") \
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_WINDOW = timedelta(hours=1)
+FREE_MESSAGES_PER_HOUR = 20
+PAID_MESSAGES_PER_HOUR = 50
+
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_MAX_USERS = int(os.getenv("RATE_LIMIT_MAX_USERS", "100000"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+# Worker processes serving the app; uvicorn and gunicorn both read it as their default --workers
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+
+def _to_timestamp(created_at: str) -> float:
+    ts = datetime.fromisoformat(created_at)
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return ts.timestamp()
+
+async def load_recent_message_times(user_id: str) -> List[float]:
+    """Timestamps of the user's messages inside the window, used once to seed a backend"""
+    one_hour_ago = datetime.utcnow() - RATE_LIMIT_WINDOW
+    response = await get_supabase().table("messages") \
+        .select("created_at") \
         .eq("user_id", user_id) \
         .gte("created_at", one_hour_ago.isoformat()) \
         .execute()
-    
-    print("response.data in check rate limit", response.data)
-    message_count = len(response.data)
-    limit = 50 if is_paid else 20
-    
+    return sorted(_to_timestamp(row["created_at"]) for row in response.data)
+
+class InMemoryRateLimiter:
+    """
+    Sliding-window log kept per user in this process.
+    - Each user's window is seeded from `messages` on first use, then maintained by record().
+    - Holds at most one timestamp per message in the last hour (<= 50 per user).
+    - Least recently seen users are dropped beyond `max_users` and re-seeded on return.
+    Counts are per worker; use the redis backend when running several workers.
+    """
+
+    def __init__(self, window: timedelta = RATE_LIMIT_WINDOW, max_users: int = RATE_LIMIT_MAX_USERS):
+        self.window = window.total_seconds()
+        self.max_users = max_users
+        self._windows: "OrderedDict[str, deque]" = OrderedDict()
+
+    def _trim(self, events: deque, now: float) -> None:
+        cutoff = now - self.window
+        while events and events[0] <= cutoff:
+            events.popleft()
+
+    async def count(self, user_id: str) -> int:
+        events = self._windows.get(user_id)
+        if events is None:
+            seeded = deque(await load_recent_message_times(user_id))
+            # Another request may have seeded this user while we were waiting
+            events = self._windows.setdefault(user_id, seeded)
+        self._windows.move_to_end(user_id)
+        while len(self._windows) > self.max_users:
+            self._windows.popitem(last=False)
+        self._trim(events, time.time())
+        return len(events)
+
+    async def record(self, user_id: str) -> None:
+        events = self._windows.get(user_id)
+        # Unseeded users pick this message up from the database when first counted
+        if events is not None:
+            events.append(time.time())
+
+class RedisRateLimiter:
+    """
+    Sliding-window log in a Redis sorted set, shared by every worker.
+    - ratelimit:{user_id} holds one member per message scored by its timestamp.
+    - ratelimit:{user_id}:seeded marks that the set was seeded from `messages`.
+    """
+
+    def __init__(self, url: str = REDIS_URL, window: timedelta = RATE_LIMIT_WINDOW):
+        import redis.asyncio as redis
+
+        self.redis = redis.from_url(url)
+        self.window = window.total_seconds()
+
+    async def count(self, user_id: str) -> int:
+        key = f"ratelimit:{user_id}"
+        now = time.time()
+        if not await self.redis.exists(f"{key}:seeded"):
+            times = await load_recent_message_times(user_id)
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.delete(key)
+                if times:
+                    pipe.zadd(key, {f"seed:{i}": ts for i, ts in enumerate(times)})
+                pipe.expire(key, int(self.window))
+                pipe.set(f"{key}:seeded", 1, ex=int(self.window))
+                await pipe.execute()
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zremrangebyscore(key, "-inf", now - self.window)
+            pipe.zcard(key)
+            _, count = await pipe.execute()
+        return count
+
+    async def record(self, user_id: str) -> None:
+        key = f"ratelimit:{user_id}"
+        if not await self.redis.exists(f"{key}:seeded"):
+            return
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zadd(key, {uuid.uuid4().hex: time.time()})
+            pipe.expire(key, int(self.window))
+            await pipe.execute()
+
+def create_rate_limiter(backend: str = RATE_LIMIT_BACKEND):
+    if backend == "redis":
+        return RedisRateLimiter()
+    if backend == "memory":
+        return InMemoryRateLimiter()
+    raise ValueError(f"Unknown RATE_LIMIT_BACKEND: {backend}")
+
+rate_limiter = create_rate_limiter()
+
+def warn_if_per_worker(backend: str = RATE_LIMIT_BACKEND, workers: int = WEB_CONCURRENCY) -> bool:
+    """Called at startup: with several workers the memory backend lets a user send up to `workers` times the limit"""
+    if backend != "memory" or workers <= 1:
+        return False
+    logger.warning(
+        "RATE_LIMIT_BACKEND=memory counts per worker: with WEB_CONCURRENCY=%d a user can send up to %d times "
+        "the hourly limit. Set RATE_LIMIT_BACKEND=redis to share one window across workers", workers, workers
+    )
+    return True
+
+# Rate limiting helper
+async def check_rate_limit(user_id: str, is_paid: bool = False):
+    message_count = await rate_limiter.count(user_id)
+    limit = PAID_MESSAGES_PER_HOUR if is_paid else FREE_MESSAGES_PER_HOUR
+
     remaining_responses = max(0, limit - message_count)
-    
+
     if message_count >= limit:
+        RATE_LIMITED.labels(tier="paid" if is_paid else "free").inc()
         raise HTTPException(
             status_code=429,
             detail=f"Rate limit exceeded. Maximum {limit} messages per hour."
         )
-    
-    return remaining_responses 
\ No newline at end of file
+
+    return remaining_responses
+
+async def record_message(user_id: str):
+    """Count a persisted message against the user's hourly limit"""
+    try:
+        await rate_limiter.record(user_id)
+    except Exception as e:
+        logger.error("Error recording message for rate limit: %s", describe_error(e))
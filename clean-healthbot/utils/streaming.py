@@ -0,0 +1,100 @@
+import json
+import zlib
+from typing import AsyncIterator, Iterable
+
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+class ContentStreamParser:
+    """
+    Incrementally extracts the "content" string from a streamed JSON envelope.
+    - feed() takes raw model tokens and returns the newly decoded content text.
+    - The full raw text is kept so the envelope can be parsed once the stream ends.
+    """
+
+    def __init__(self, field: str = "content"):
+        self.key = f'"{field}"'
+        self.raw = ""
+        self.content = ""
+        self._pos = 0
+        self._state = "key"  # key -> colon -> open -> value -> done
+
+    def feed(self, chunk: str) -> str:
+        self.raw += chunk
+        out = []
+        raw = self.raw
+        while self._pos < len(raw) and self._state != "done":
+            if self._state == "key":
+                idx = raw.find(self.key, self._pos)
+                if idx == -1:
+                    # Keep enough of the tail to match a key split across chunks
+                    self._pos = max(self._pos, len(raw) - len(self.key) + 1)
+                    break
+                self._pos = idx + len(self.key)
+                self._state = "colon"
+            elif self._state in ("colon", "open"):
+                ch = raw[self._pos]
+                if ch.isspace():
+                    self._pos += 1
+                elif self._state == "colon" and ch == ":":
+                    self._pos += 1
+                    self._state = "open"
+                elif self._state == "open" and ch == '"':
+                    self._pos += 1
+                    self._state = "value"
+                else:
+                    # "content" appeared somewhere other than as a key; keep looking
+                    self._state = "key"
+            else:
+                ch = raw[self._pos]
+                if ch == '"':
+                    self._pos += 1
+                    self._state = "done"
+                elif ch == "\\":
+                    if self._pos + 1 >= len(raw):
+                        break
+                    esc = raw[self._pos + 1]
+                    if esc == "u":
+                        if self._pos + 6 > len(raw):
+                            break
+                        code = int(raw[self._pos + 2:self._pos + 6], 16)
+                        if 0xD800 <= code < 0xDC00:
+                            # Surrogate pair: wait for the low half before emitting
+                            if self._pos + 12 > len(raw):
+                                break
+                            low = int(raw[self._pos + 8:self._pos + 12], 16)
+                            code = 0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)
+                            self._pos += 6
+                        out.append(chr(code))
+                        self._pos += 6
+                    else:
+                        out.append(_ESCAPES.get(esc, esc))
+                        self._pos += 2
+                else:
+                    out.append(ch)
+                    self._pos += 1
+        text = "".join(out)
+        self.content += text
+        return text
+
+    @property
+    def done(self) -> bool:
+        return self._state == "done"
+
+
+def sse_event(event: str, data) -> str:
+    """Format one Server-Sent Events frame"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def ndjson_lines(records: Iterable[dict]) -> bytes:
+    """Encode records as newline-delimited JSON"""
+    return "".join(json.dumps(record, ensure_ascii=False, default=str) + "\n" for record in records).encode("utf-8")
+
+async def gzip_stream(chunks: AsyncIterator[bytes], level: int = 6) -> AsyncIterator[bytes]:
+    """
+    Gzip a byte stream as it is produced.
+    Every chunk is flushed to a byte boundary, so the client can decompress what it has received so far.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    async for chunk in chunks:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()